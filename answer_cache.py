@@ -0,0 +1,137 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a question for exact matching: lower case, collapsed whitespace, no trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+
+class AnswerCache:
+    """In-memory cache of RAG answers with an exact-match and a semantic tier.
+
+    A question is first looked up by its normalized text. Otherwise its embedding is compared with the
+    embeddings of the cached questions, and the answer of the most similar one is reused when the cosine
+    similarity reaches `similarity_threshold`. Entries expire after `ttl` seconds, the least recently
+    used entries are evicted beyond `max_entries`, and the whole cache is cleared whenever `version_fn`
+    reports a new version of the vector store.
+
+    Args:
+        embed_query: Function returning the embedding of a question.
+        similarity_threshold (float): Minimum cosine similarity for a semantic hit.
+        ttl (float): Seconds an answer stays valid.
+        max_entries (int): Maximum number of cached answers.
+        version_fn (optional): Function returning the current version of the vector store.
+    """
+
+    def __init__(
+        self,
+        embed_query,
+        similarity_threshold: float = 0.97,
+        ttl: float = 24 * 3600,
+        max_entries: int = 1000,
+        version_fn=None,
+    ):
+        self.embed_query = embed_query
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_fn = version_fn or (lambda: None)
+
+        self._entries = OrderedDict()
+        self._version = self.version_fn()
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    def _expire(self):
+        """Drops every entry if the vector store changed, and the entries older than the ttl otherwise."""
+        version = self.version_fn()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            return
+
+        now = time.time()
+        for key in [
+            key
+            for key, entry in self._entries.items()
+            if now - entry["created"] > self.ttl
+        ]:
+            del self._entries[key]
+
+    def _hit(self, key: str, semantic: bool) -> str:
+        entry = self._entries[key]
+        self._entries.move_to_end(key)
+        if semantic:
+            self.semantic_hits += 1
+        else:
+            self.exact_hits += 1
+        self.latency_saved += entry["latency"]
+        return entry["answer"]
+
+    def get(self, query: str) -> str:
+        """Returns the cached answer to `query` or to a semantically equivalent question, or None."""
+        key = normalize_query(query)
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                return self._hit(key, semantic=False)
+            keys = list(self._entries)
+            matrix = (
+                np.stack([self._entries[k]["vector"] for k in keys]) if keys else None
+            )
+
+        # Embedding the question is the only remote call, so do it outside of the lock.
+        if matrix is not None:
+            vector = self._unit(self.embed_query(query))
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                with self._lock:
+                    if keys[best] in self._entries:
+                        return self._hit(keys[best], semantic=True)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query: str, answer: str, latency: float):
+        """Caches the answer to `query`, along with the seconds it took to generate it."""
+        vector = self._unit(self.embed_query(query))
+        with self._lock:
+            self._entries[normalize_query(query)] = {
+                "answer": answer,
+                "vector": vector,
+                "created": time.time(),
+                "latency": latency,
+            }
+            self._entries.move_to_end(normalize_query(query))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def stats(self) -> dict:
+        """Returns the hit counters of both tiers, the hit rate and the seconds of generation saved."""
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+            ),
+            "latency_saved": self.latency_saved,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,119 @@
+import xml.etree.ElementTree as ET
+
+from http_client import fetch
+
+ARXIV_API_URL = "https://export.arxiv.org/api/query"
+ATOM_NS = {"atom": "http://www.w3.org/2005/Atom"}
+
+
+def strip_version(arxiv_id: str) -> str:
+    """Removes the version suffix of an arXiv identifier, e.g. '2403.01234v2' -> '2403.01234'."""
+    head, _, tail = arxiv_id.rpartition("v")
+    return head if head and tail.isdigit() else arxiv_id
+
+
+def parse_feed(feed: str) -> dict:
+    """Parses an arXiv API Atom feed.
+
+    Args:
+        feed (str): The Atom XML returned by the arXiv API.
+
+    Returns:
+        dict: Maps the versionless arXiv identifier of each entry to its 'published', 'authors' and 'summary'.
+    """
+    root = ET.fromstring(feed)
+
+    metadata = {}
+    for entry in root.findall("atom:entry", ATOM_NS):
+        entry_id = entry.findtext("atom:id", default="", namespaces=ATOM_NS)
+        # Malformed identifiers come back as an entry pointing at the API's error page.
+        if "/abs/" not in entry_id:
+            continue
+
+        arxiv_id = entry_id.split("/abs/")[-1]
+        authors = [
+            author.findtext("atom:name", default="", namespaces=ATOM_NS)
+            for author in entry.findall("atom:author", ATOM_NS)
+        ]
+        # Same fields as the ArxivRetriever metadata: the date of the latest version, the comma separated
+        # author names and the abstract.
+        metadata[strip_version(arxiv_id)] = {
+            "published": entry.findtext("atom:updated", namespaces=ATOM_NS)[:10],
+            "authors": ", ".join(authors),
+            "summary": entry.findtext("atom:summary", namespaces=ATOM_NS).strip(),
+        }
+
+    return metadata
+
+
+def query_arxiv(
+    doc_nums: list, session=None, rate_limiter=None, url: str = ARXIV_API_URL
+) -> dict:
+    """Looks up many arXiv articles with a single `id_list` request to the arXiv API.
+
+    Args:
+        doc_nums (list): arXiv document numbers, e.g. ['2403.01234v1', '2402.05678']
+        session (requests.Session, optional): pooled HTTP session to send the request with
+        rate_limiter (RateLimiter, optional): per-host rate limiter to wait on before the request
+        url (str): url of the arXiv API query endpoint
+
+    Returns:
+        dict: Maps the versionless arXiv identifier of each article found to its metadata.
+    """
+    query_url = (
+        f"{url}?id_list={','.join(doc_nums)}&start=0&max_results={len(doc_nums)}"
+    )
+    response = fetch(query_url, session, rate_limiter)
+    response.raise_for_status()
+    return parse_feed(response.text)
+
+
+def fetch_arxiv_metadata(
+    doc_nums: list,
+    session=None,
+    rate_limiter=None,
+    chunk_size: int = 100,
+    url: str = ARXIV_API_URL,
+) -> dict:
+    """Get the published date, authors and summary of many arXiv articles in bulk.
+
+    The identifiers are resolved in chunks of `chunk_size` per API request and each feed is parsed once.
+    When a chunk fails, or some of its identifiers are missing from the feed, those identifiers are
+    looked up again one at a time so a single bad identifier does not lose the whole chunk.
+
+    Args:
+        doc_nums (list): arXiv document numbers, e.g. ['2403.01234v1', '2402.05678']
+        session (requests.Session, optional): pooled HTTP session to send the requests with
+        rate_limiter (RateLimiter, optional): per-host rate limiter to wait on before each request
+        chunk_size (int): maximum number of identifiers resolved per API request
+        url (str): url of the arXiv API query endpoint
+
+    Returns:
+        dict: Maps each document number that could be resolved to its 'published', 'authors' and 'summary'.
+    """
+    found = {}
+    missing = []
+    for start in range(0, len(doc_nums), chunk_size):
+        chunk = doc_nums[start : start + chunk_size]
+        try:
+            found.update(query_arxiv(chunk, session, rate_limiter, url))
+        except Exception as e:
+            print(f"arXiv bulk lookup failed, retrying one by one: {e}")
+            missing.extend(chunk)
+            continue
+        missing.extend(
+            doc_num for doc_num in chunk if strip_version(doc_num) not in found
+        )
+
+    # Fall back to one request per identifier for whatever the bulk requests did not resolve.
+    for doc_num in missing:
+        try:
+            found.update(query_arxiv([doc_num], session, rate_limiter, url))
+        except Exception as e:
+            print(f"arXiv lookup failed for {doc_num}: {e}")
+
+    return {
+        doc_num: found[strip_version(doc_num)]
+        for doc_num in doc_nums
+        if strip_version(doc_num) in found
+    }
@@ -0,0 +1,81 @@
+"""Measures recall@k, query latency and index size of the FAISS index settings against exact search.
+
+Vectors are synthetic: unit-length points drawn around random cluster centers, which mimics the
+topical clustering of paper chunk embeddings. Exact inner-product search provides the ground truth.
+
+Usage:
+    python -m benchmarks.bench_ann --vectors 50000 --dim 384 --queries 500
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from vectorstore import build_index, normalize, set_search_params
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 100, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    points = centers[rng.integers(clusters, size=n)] + 0.5 * rng.normal(size=(n, dim))
+    return normalize(points)
+
+
+def index_bytes(index) -> int:
+    import faiss
+
+    return faiss.serialize_index(index).nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=50_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    corpus = synthetic_vectors(args.vectors + args.queries, args.dim)
+    vectors, queries = corpus[: args.vectors], corpus[args.vectors :]
+
+    exact = build_index(vectors, "flat")
+    _, truth = exact.search(queries, args.k)
+
+    configs = [("flat", q, {}) for q in ("none", "fp16", "int8")]
+    configs += [
+        ("hnsw", q, {"ef_search": ef}) for q in ("none", "int8") for ef in (16, 64, 128)
+    ]
+    configs += [
+        ("ivf", q, {"nprobe": nprobe})
+        for q in ("none", "int8")
+        for nprobe in (1, 8, 32)
+    ]
+
+    print(
+        f"{args.vectors} vectors, dim {args.dim}, {args.queries} queries, recall@{args.k}"
+    )
+    built = {}
+    for index_type, quantization, params in configs:
+        key = (index_type, quantization)
+        if key not in built:
+            start = time.perf_counter()
+            built[key] = build_index(vectors, index_type, quantization)
+            build_seconds = time.perf_counter() - start
+        index = built[key]
+        set_search_params(index, **params)
+
+        start = time.perf_counter()
+        _, found = index.search(queries, args.k)
+        latency_ms = (time.perf_counter() - start) / args.queries * 1000
+
+        recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+        label = f"{index_type}/{quantization} {params or ''}"
+        print(
+            f"{label:32s} recall {recall:.3f}  {latency_ms:.3f} ms/query  "
+            f"size {index_bytes(index) / 2**20:.1f} MB  build {build_seconds:.1f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measures how fast the paper database loads a large batch of papers, row by row vs. bulk upsert.
+
+The row-by-row loader is the previous implementation of `insert_or_update_database`: a SELECT and an
+INSERT per paper with default journaling. Papers are synthetic and both loaders write to temporary
+databases, which are loaded twice to time the insert and the update path.
+
+Usage:
+    python -m benchmarks.bench_database --papers 50000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from database import insert_or_update_database
+
+
+def synthetic_papers(n: int) -> list:
+    return [
+        {
+            "url": f"https://paperswithcode.com/paper/paper-{i}",
+            "title": f"Paper {i}",
+            "arxiv_link": f"https://arxiv.org/pdf/{2400 + i // 100000}.{i % 100000:05d}v1.pdf",
+            "published": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}",
+            "authors": "Ada Lovelace, Alan Turing",
+            "summary": "A synthetic abstract. " * 40,
+        }
+        for i in range(n)
+    ]
+
+
+def row_by_row(paper_metadata, path: str):
+    with sqlite3.connect(path) as conn:
+        c = conn.cursor()
+        c.execute(
+            """CREATE TABLE IF NOT EXISTS papers
+                    (url TEXT PRIMARY KEY, title TEXT, arxiv_link TEXT, published DATE, authors TEXT, summary TEXT )"""
+        )
+        for paper in paper_metadata:
+            c.execute("SELECT 1 FROM papers WHERE url = :url", {"url": paper["url"]})
+            if not c.fetchone():
+                c.execute(
+                    """INSERT OR REPLACE INTO papers (url, title, arxiv_link, published, authors, summary)
+                    VALUES (:url, :title, :arxiv_link, :published, :authors, :summary)""",
+                    paper,
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--papers", type=int, default=50_000)
+    args = parser.parse_args()
+
+    papers = synthetic_papers(args.papers)
+    loaders = {
+        "row by row": row_by_row,
+        "bulk upsert": lambda papers, path: insert_or_update_database(
+            papers, path, snapshot=False
+        ),
+    }
+
+    print(f"{args.papers} papers")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, loader in loaders.items():
+            path = os.path.join(directory, name.replace(" ", "_") + ".db")
+            timings = []
+            for _ in ("insert", "update"):
+                start = time.perf_counter()
+                loader(papers, path)
+                timings.append(time.perf_counter() - start)
+            print(
+                f"{name:12s} insert {timings[0]:.2f} s ({args.papers / timings[0]:,.0f} papers/s)  "
+                f"update {timings[1]:.2f} s ({args.papers / timings[1]:,.0f} papers/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Compares the OpenAI embedder with the local int8 ONNX model: query latency, throughput and retrieval quality.
+
+Both models embed every chunk of the existing vector database and the questions of the retrieval eval
+set (see eval_retrieval.py). Retrieval is exact dense search over the chunks, and a question counts as
+answered when a chunk of its paper is among the top k. The chunk vectors are served from the embedding
+cache when they are there (the OpenAI ones were cached while indexing); query latency is measured
+without the cache, one question at a time, as the RAG chain embeds them.
+
+Needs data/, an OpenAI key and the exported ONNX model (`python onnx_embeddings.py --export`).
+
+Usage:
+    python -m benchmarks.bench_embeddings --k 4 --threads 1 4 0
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.eval_retrieval import load_eval_set
+from embedding_cache import open_cache
+from embedding_executor import BatchedEmbeddings
+from embedding_models import create_embeddings
+from onnx_embeddings import OnnxEmbeddings
+from vectorstore import get_vectorstore, normalize
+
+
+def embed_corpus(embeddings, texts: list) -> np.ndarray:
+    """Embeds the chunks with a model, through its embedding cache."""
+    batched = BatchedEmbeddings(embeddings, cache=open_cache(embeddings.model))
+    return normalize(batched.embed_documents(texts))
+
+
+def embed_questions(embeddings, questions: list) -> tuple:
+    """Embeds the questions one at a time, without the cache, returning the vectors and the latencies."""
+    vectors, seconds = [], []
+    for question in questions:
+        start = time.perf_counter()
+        vectors.append(embeddings.embed_query(question))
+        seconds.append(time.perf_counter() - start)
+    return normalize(vectors), np.array(seconds)
+
+
+def evaluate(
+    chunk_vectors: np.ndarray, titles: list, query_vectors: np.ndarray, eval_set, k: int
+) -> dict:
+    """Returns the recall and MRR of exact dense search, like eval_retrieval.evaluate."""
+    hits, reciprocal_ranks = 0, 0.0
+    scores = query_vectors @ chunk_vectors.T
+    for item, row in zip(eval_set, scores):
+        top = np.argsort(-row)[:k]
+        found = [titles[i] for i in top]
+        if item["title"] in found:
+            hits += 1
+            reciprocal_ranks += 1 / (found.index(item["title"]) + 1)
+    return {"recall": hits / len(eval_set), "mrr": reciprocal_ranks / len(eval_set)}
+
+
+def throughput(embeddings, texts: list) -> float:
+    """Returns the texts embedded per second by a model, without the cache."""
+    start = time.perf_counter()
+    embeddings.embed_documents(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", default=None, help="JSONL eval set")
+    parser.add_argument("--max-questions", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, 4, 0],
+        help="CPU threads of the ONNX model, 0 lets onnxruntime pick",
+    )
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument(
+        "--sample", type=int, default=512, help="chunks embedded for the throughput"
+    )
+    args = parser.parse_args()
+
+    eval_set = load_eval_set(args.questions)[: args.max_questions]
+    questions = [item["question"] for item in eval_set]
+
+    openai_embeddings = create_embeddings("openai")
+    stored = get_vectorstore(openai_embeddings).get(include=["documents", "metadatas"])
+    texts = stored["documents"]
+    titles = [(metadata or {}).get("title") for metadata in stored["metadatas"]]
+    sample = texts[: args.sample]
+    print(f"{len(texts)} chunks, {len(questions)} questions, recall@{args.k}")
+
+    models = [("openai", openai_embeddings)]
+    models += [
+        (
+            f"onnx int8, {threads or 'auto'} threads",
+            OnnxEmbeddings(threads=threads, batch_size=args.batch_size),
+        )
+        for threads in args.threads
+    ]
+    # The float32 model, to see what the int8 quantization costs in quality.
+    models.append(
+        (
+            "onnx float32, auto threads",
+            OnnxEmbeddings(quantized=False, batch_size=args.batch_size),
+        )
+    )
+
+    corpus = {}
+    for name, embeddings in models:
+        # Thread settings of one model retrieve alike, so the chunks are embedded once per model.
+        if embeddings.model not in corpus:
+            corpus[embeddings.model] = embed_corpus(embeddings, texts)
+        query_vectors, seconds = embed_questions(embeddings, questions)
+        metrics = evaluate(
+            corpus[embeddings.model], titles, query_vectors, eval_set, args.k
+        )
+        texts_per_second = throughput(embeddings, sample)
+        print(
+            f"{name:28s} recall {metrics['recall']:.2f}  MRR {metrics['mrr']:.2f}  "
+            f"query p50 {np.percentile(seconds, 50) * 1000:.1f} ms  "
+            f"p95 {np.percentile(seconds, 95) * 1000:.1f} ms  "
+            f"{texts_per_second:.0f} chunks/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measures the latency of Streamlit reruns of main.py with and without the data caches.
+
+Runs the app headless with Streamlit's AppTest on a synthetic paper database, once clearing the caches
+before every rerun (every rerun re-reads and re-formats the data) and once keeping them.
+
+Usage:
+    python -m benchmarks.bench_rerun --papers 200 --runs 20
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from database import insert_or_update_database, save_topics
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "main.py")
+
+
+def write_data(directory: str, n_papers: int):
+    """Writes a synthetic paper database, with topics, into `directory`/data."""
+    os.makedirs(os.path.join(directory, "data"))
+    paper_metadata = [
+        {
+            "url": f"https://paperswithcode.com/paper/paper-{i}",
+            "title": f"Paper {i}",
+            "arxiv_link": f"https://arxiv.org/pdf/2401.{i:05d}v1.pdf",
+            "published": f"2024-{1 + i % 12:02d}-01",
+            "authors": "Ann One, Bob Two",
+            "summary": "We study things. " * 80,
+        }
+        for i in range(n_papers)
+    ]
+    path = os.path.join(directory, "data/papers.db")
+    insert_or_update_database(paper_metadata, path)
+    save_topics(
+        {topic: [f"keyword {topic}-{k}" for k in range(10)] for topic in range(5)},
+        {paper["url"]: i % 5 for i, paper in enumerate(paper_metadata)},
+        path,
+    )
+
+
+def time_reruns(app: AppTest, runs: int, clear_caches: bool) -> list:
+    """Reruns the app `runs` times and returns the latency of each rerun in milliseconds."""
+    latencies = []
+    for _ in range(runs):
+        if clear_caches:
+            st.cache_data.clear()
+            st.cache_resource.clear()
+        start = time.perf_counter()
+        app.run(timeout=60)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert not app.exception, app.exception
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--papers", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        write_data(directory, args.papers)
+        os.chdir(directory)
+        try:
+            app = AppTest.from_file(APP_PATH)
+            app.run(timeout=60)  # warm up imports
+            uncached = time_reruns(app, args.runs, clear_caches=True)
+            cached = time_reruns(app, args.runs, clear_caches=False)
+        finally:
+            os.chdir(cwd)
+
+    print(f"papers: {args.papers}, reruns: {args.runs}")
+    print(f"uncached rerun: median {statistics.median(uncached):.1f} ms")
+    print(f"cached rerun:   median {statistics.median(cached):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
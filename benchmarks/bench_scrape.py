@@ -0,0 +1,103 @@
+"""Compares the serial and concurrent scraping of paper pages against a local stub server.
+
+Also compares a first and a repeat refresh with the HTTP cache and the arXiv link memo, and the parsing
+of a page with html.parser vs. lxml restricted to the 'a' tags.
+
+Usage:
+    python -m benchmarks.bench_scrape --papers 50 --latency 0.05
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from bs4 import BeautifulSoup
+
+from benchmarks.stub_server import StubServer, front_page
+from get_data import ONLY_LINKS, get_arxiv_links, scrape_paper_metadata
+from http_client import HttpCache, RateLimiter, create_session
+
+
+def run(url: str, max_workers: int, cache=None, memo_path: str = None) -> float:
+    """Scrapes the stub front page and every paper page, returning the wall-clock time in seconds."""
+    session = create_session(pool_size=max_workers)
+    rate_limiter = RateLimiter(requests_per_second=0)
+
+    start = time.perf_counter()
+    paper_metadata = scrape_paper_metadata(url, session, rate_limiter, cache)
+    links = get_arxiv_links(
+        paper_metadata, max_workers, session, rate_limiter, cache, memo_path
+    )
+    elapsed = time.perf_counter() - start
+
+    assert all(links), "every stub paper page links to an arXiv pdf"
+    return elapsed
+
+
+def refresh(server: StubServer, max_workers: int, directory: str) -> dict:
+    """Runs a refresh with the HTTP cache and link memo in `directory`, counting requests and bytes."""
+    requests, bytes_sent = server.request_count, server.bytes_sent
+    seconds = run(
+        server.url,
+        max_workers,
+        cache=HttpCache(os.path.join(directory, "http_cache")),
+        memo_path=os.path.join(directory, "arxiv_links.json"),
+    )
+    return {
+        "seconds": seconds,
+        "requests": server.request_count - requests,
+        "bytes": server.bytes_sent - bytes_sent,
+    }
+
+
+def parse_seconds(html: str, runs: int = 20, **kwargs) -> float:
+    """Returns the mean seconds to parse `html` and find its links."""
+    start = time.perf_counter()
+    for _ in range(runs):
+        BeautifulSoup(html, **kwargs).find_all("a")
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--papers", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with StubServer(n_papers=args.papers, latency=args.latency) as server:
+        serial = run(server.url, max_workers=1)
+        concurrent = run(server.url, max_workers=args.workers)
+
+        with tempfile.TemporaryDirectory() as directory:
+            first = refresh(server, args.workers, directory)
+            repeat = refresh(server, args.workers, directory)
+
+    print(f"papers: {args.papers}, latency per request: {args.latency * 1000:.0f} ms")
+    print(f"serial (1 worker):       {serial:.2f} s")
+    print(f"concurrent ({args.workers} workers):  {concurrent:.2f} s")
+    print(f"speedup:                 {serial / concurrent:.1f}x")
+
+    print("\nrefresh with the HTTP cache and the arXiv link memo:")
+    for name, stats in (("first", first), ("repeat", repeat)):
+        print(
+            f"{name:8s}{stats['seconds']:8.2f} s{stats['requests']:6d} requests"
+            f"{stats['bytes'] / 1000:10.1f} kB"
+        )
+
+    # The stub pages are tiny; pad the front page with markup to the size of the real one (~300 kB).
+    filler = '<div class="row"><p>Lorem ipsum <span>dolor</span> sit amet.</p></div>'
+    html = front_page(args.papers).replace(
+        "</body>", filler * (300_000 // len(filler)) + "</body>"
+    )
+    slow = parse_seconds(html, features="html.parser")
+    fast = parse_seconds(html, features="lxml", parse_only=ONLY_LINKS)
+    print(f"\nparsing a {len(html) / 1000:.0f} kB page:")
+    print(f"html.parser:             {slow * 1000:.1f} ms")
+    print(f"lxml, 'a' tags only:     {fast * 1000:.1f} ms")
+    print(f"speedup:                 {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Load tests the QA service: throughput and latency at N concurrent users, with fake models.
+
+The service runs in this process on a local port, with the fake embeddings and chat model of
+benchmarks/fakes.py over a synthetic corpus (see benchmarks/suite.py). Every user is a thread asking its
+questions one after the other through qa_client, like the app does. A fraction of the questions are
+drawn from a few popular ones, which the service answers once while they are in flight.
+
+Usage:
+    python -m benchmarks.bench_service --users 1 8 32 64 --questions 4 --duplicates 0.2
+"""
+
+import argparse
+import os
+import random
+import socket
+import threading
+import time
+from unittest import mock
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from benchmarks.suite import (
+    cached_embeddings,
+    index_corpus,
+    latency_summary,
+    synthetic_corpus,
+    workdir,
+)
+from instrumentation import METRICS
+from qa_client import QAServiceError, stream_answer
+from vectorstore import get_vectorstore
+
+
+def serve(app) -> tuple:
+    """Runs an app with uvicorn in a background thread, returning the server and its url."""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The service failed to start")
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def load_test(url: str, questions: list) -> dict:
+    """Runs one thread per list of questions against the service, returning throughput and latencies."""
+    first_chunk, total, outcomes = [], [], {"rejected": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def user(user_questions: list):
+        for question in user_questions:
+            start = time.perf_counter()
+            first = None
+            try:
+                for _ in stream_answer(question, url):
+                    if first is None:
+                        first = time.perf_counter() - start
+            except QAServiceError as e:
+                with lock:
+                    outcomes["rejected" if "HTTP 503" in str(e) else "errors"] += 1
+                continue
+            with lock:
+                first_chunk.append(first)
+                total.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=user, args=(qs,)) for qs in questions]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    return {
+        "users": len(questions),
+        "answered": len(total),
+        **outcomes,
+        "seconds": seconds,
+        "questions_per_second": len(total) / seconds,
+        "first_chunk": latency_summary(first_chunk) if first_chunk else {},
+        "total": latency_summary(total) if total else {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--questions", type=int, default=4, help="questions per user")
+    parser.add_argument("--duplicates", type=float, default=0.2)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--llm-first-token", type=float, default=0.3)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100)
+    parser.add_argument("--backend", default="faiss", choices=["chroma", "faiss"])
+    args = parser.parse_args()
+
+    import rag
+    from qa_service import create_app
+
+    papers, chunks = synthetic_corpus(args.chunks)
+    texts = [
+        chunk.page_content for paper_chunks in chunks.values() for chunk in paper_chunks
+    ]
+    rng = random.Random(0)
+
+    def new_question():
+        return " ".join(rng.choice(texts).split()[:10])
+
+    def fake_chat_model(callbacks=None, **kwargs):
+        return FakeChatModel(
+            first_token_latency=args.llm_first_token,
+            tokens_per_second=args.llm_tokens_per_second,
+            callbacks=callbacks,
+        )
+
+    with workdir():
+        embeddings = cached_embeddings(FakeEmbeddings(latency=args.embed_latency))
+        index_corpus(
+            papers, chunks, get_vectorstore(embeddings, args.backend), args.backend
+        )
+
+        # The service still creates its OpenAI client, which the fake model does not use but needs a key.
+        with mock.patch.object(rag, "get_embeddings", lambda: embeddings), mock.patch(
+            "vectorstore.VECTOR_STORE", args.backend
+        ), mock.patch("langchain_openai.ChatOpenAI", fake_chat_model), mock.patch.dict(
+            os.environ, {"OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "unused")}
+        ):
+            rag.rag_chains.cache_clear()
+            rag.get_answer_cache.cache_clear()
+            server, url = serve(
+                create_app(args.max_concurrency, args.max_queue, args.timeout)
+            )
+            try:
+                print(
+                    f"service: {args.max_concurrency} concurrent questions, queue of {args.max_queue}; "
+                    f"LLM: {args.llm_first_token * 1000:.0f} ms to first token, "
+                    f"{args.llm_tokens_per_second:.0f} tokens/s"
+                )
+                print(
+                    f"{'users':>6s}{'answered':>10s}{'rejected':>10s}{'errors':>8s}{'dedup':>7s}"
+                    f"{'q/s':>8s}{'first p50':>11s}{'first p95':>11s}{'total p50':>11s}{'total p95':>11s}"
+                )
+                for users in args.users:
+                    # New questions at every level, so the answer cache only serves the popular ones.
+                    popular = [new_question() for _ in range(4)]
+                    questions = [
+                        [
+                            (
+                                rng.choice(popular)
+                                if rng.random() < args.duplicates
+                                else new_question()
+                            )
+                            for _ in range(args.questions)
+                        ]
+                        for _ in range(users)
+                    ]
+                    METRICS.reset()
+                    result = load_test(url, questions)
+                    deduplicated = METRICS.snapshot()["counters"].get(
+                        "qa.deduplicated", 0
+                    )
+                    first, total = result["first_chunk"], result["total"]
+                    print(
+                        f"{users:6d}{result['answered']:10d}{result['rejected']:10d}{result['errors']:8d}"
+                        f"{deduplicated:7.0f}{result['questions_per_second']:8.2f}"
+                        f"{first.get('p50_ms', 0):9.0f}ms{first.get('p95_ms', 0):9.0f}ms"
+                        f"{total.get('p50_ms', 0):9.0f}ms{total.get('p95_ms', 0):9.0f}ms"
+                    )
+            finally:
+                server.should_exit = True
+                rag.rag_chains.cache_clear()
+                rag.get_answer_cache.cache_clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measures the cold import time and peak memory of the app and CLI modules, and fails above a budget.
+
+Every module is imported in a fresh interpreter with `python -X importtime`, so the numbers include
+everything the module pulls in at import time. The slowest imports are listed to help find regressions.
+
+Usage:
+    python -m benchmarks.bench_startup --max-seconds 2 --max-rss-mb 250
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prints the peak resident set size of the child interpreter (in KiB on Linux) after the import.
+PROBE = "import resource, {module}; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def measure(module: str) -> dict:
+    """Imports `module` in a fresh interpreter and returns its import time, peak RSS and slowest imports."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+
+    # importtime lines look like: "import time:  self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            imports.append((int(match.group(2)), len(match.group(3)), match.group(4)))
+
+    top_level = [cumulative for cumulative, depth, _ in imports if depth == 1]
+    slowest = sorted((entry for entry in imports if 1 < entry[1] <= 5), reverse=True)[
+        :5
+    ]
+
+    return {
+        "module": module,
+        "seconds": sum(top_level) / 1e6,
+        "rss_mb": int(result.stdout.strip().splitlines()[-1]) / 1024,
+        "slowest": [(name, cumulative / 1e6) for cumulative, _, name in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=["main", "rag"])
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--max-rss-mb", type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        stats = measure(module)
+        print(
+            f"{module}: import {stats['seconds']:.2f} s, peak RSS {stats['rss_mb']:.0f} MB"
+        )
+        for name, seconds in stats["slowest"]:
+            print(f"    {seconds:6.2f} s  {name}")
+
+        if args.max_seconds is not None and stats["seconds"] > args.max_seconds:
+            print(f"  -> import time above budget of {args.max_seconds} s")
+            failed = True
+        if args.max_rss_mb is not None and stats["rss_mb"] > args.max_rss_mb:
+            print(f"  -> peak RSS above budget of {args.max_rss_mb} MB")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
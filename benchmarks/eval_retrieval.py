@@ -0,0 +1,107 @@
+"""Compares the dense-only retriever with the hybrid retriever on an offline retrieval eval set.
+
+By default the eval set is derived from data/paper_metadata.json: the title and the first sentence of
+the abstract of each paper are asked as questions, and a question counts as answered when a chunk of
+that paper is retrieved. A JSONL file of {"question": ..., "title": ...} lines can be given instead.
+
+Usage:
+    python -m benchmarks.eval_retrieval --k 4 --rerank none mmr
+"""
+
+import argparse
+import json
+import time
+
+import tiktoken
+from context import ContextAssembler
+from rag import context_tokens, get_embeddings
+from retrieval import HybridRetriever
+from vectorstore import get_vectorstore
+
+
+def load_eval_set(path: str = None) -> list:
+    """Loads the eval questions, each with the title of the paper that answers it."""
+    if path is not None:
+        with open(path, "r") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    with open("data/paper_metadata.json", "r") as file:
+        paper_metadata = json.load(file)
+
+    questions = []
+    for paper in paper_metadata:
+        questions.append({"question": paper["title"], "title": paper["title"]})
+        first_sentence = paper["summary"].replace("\n", " ").split(". ")[0]
+        questions.append({"question": first_sentence, "title": paper["title"]})
+    return questions
+
+
+def evaluate(retrieve, eval_set: list) -> dict:
+    """Runs every question through `retrieve` and returns recall, MRR, context tokens and latency.
+
+    The context tokens are counted for the retrieved chunks as they are, and for the context assembled
+    from them for the prompt (merged, deduplicated, cited and cut to the RAG_CONTEXT_TOKENS budget).
+    """
+    encoding = tiktoken.get_encoding("cl100k_base")
+    assembler = ContextAssembler(max_tokens=context_tokens)
+    hits, reciprocal_ranks, tokens, assembled_tokens, seconds = 0, 0.0, 0, 0, 0.0
+    for item in eval_set:
+        start = time.perf_counter()
+        docs = retrieve(item["question"])
+        seconds += time.perf_counter() - start
+
+        titles = [doc.metadata.get("title") for doc in docs]
+        if item["title"] in titles:
+            hits += 1
+            reciprocal_ranks += 1 / (titles.index(item["title"]) + 1)
+        tokens += sum(len(encoding.encode(doc.page_content)) for doc in docs)
+        assembled_tokens += len(encoding.encode(assembler.format(docs)))
+
+    n = len(eval_set)
+    return {
+        "recall": hits / n,
+        "mrr": reciprocal_ranks / n,
+        "context_tokens": tokens / n,
+        "assembled_tokens": assembled_tokens / n,
+        "latency_ms": seconds / n * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", default=None, help="JSONL eval set")
+    parser.add_argument("--dense-k", type=int, default=10)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument(
+        "--rerank",
+        nargs="+",
+        default=["none", "mmr"],
+        choices=["none", "mmr", "cross-encoder"],
+    )
+    args = parser.parse_args()
+
+    eval_set = load_eval_set(args.questions)
+    vectordb = get_vectorstore(get_embeddings())
+
+    results = {
+        f"dense k={args.dense_k}": evaluate(
+            lambda q: vectordb.similarity_search(q, k=args.dense_k), eval_set
+        )
+    }
+    for rerank in args.rerank:
+        retriever = HybridRetriever.from_vectordb(vectordb, k=args.k, rerank=rerank)
+        results[f"hybrid k={args.k} rerank={rerank}"] = evaluate(
+            retriever.get_relevant_documents, eval_set
+        )
+
+    print(f"{len(eval_set)} questions")
+    for name, metrics in results.items():
+        print(
+            f"{name:32s} recall {metrics['recall']:.2f}  MRR {metrics['mrr']:.2f}  "
+            f"context tokens {metrics['context_tokens']:.0f} (assembled {metrics['assembled_tokens']:.0f})  "
+            f"latency {metrics['latency_ms']:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
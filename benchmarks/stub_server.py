@@ -0,0 +1,191 @@
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+
+def front_page(n_papers: int) -> str:
+    """Builds a paperswithcode-like front page linking to `n_papers` trending papers."""
+    links = "\n".join(
+        f'<h1><a href="/paper/stub-paper-{i}">Stub paper {i}</a></h1>'
+        f'<a href="/paper/stub-paper-{i}#code">Code</a>'
+        for i in range(n_papers)
+    )
+    return f"<html><body>{links}</body></html>"
+
+
+def paper_page(i: int) -> str:
+    """Builds a paperswithcode-like paper page linking to the arXiv pdf of the paper."""
+    return (
+        "<html><body>"
+        f'<a href="https://arxiv.org/pdf/2401.{i:05d}v1.pdf">Paper</a>'
+        "</body></html>"
+    )
+
+
+def arxiv_feed(doc_nums: list) -> str:
+    """Builds an arXiv API Atom feed with an entry for every requested arXiv document number."""
+    entries = "".join(
+        "<entry>"
+        f"<id>http://arxiv.org/abs/{doc_num}</id>"
+        f"<updated>2024-01-{1 + i % 28:02d}T00:00:00Z</updated>"
+        f"<summary>Abstract of stub paper {doc_num}. We study stub methods.</summary>"
+        "<author><name>Ada Lovelace</name></author><author><name>Alan Turing</name></author>"
+        "</entry>"
+        for i, doc_num in enumerate(doc_nums)
+    )
+    return f'<feed xmlns="http://www.w3.org/2005/Atom">{entries}</feed>'
+
+
+def make_pdf(pages: list) -> bytes:
+    """Builds a minimal pdf with one page per list of text lines, readable by pypdf and PyMuPDF."""
+
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    # Object 1 is the catalog, 2 the page tree and 3 the font; every page adds its content and page objects.
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for lines in pages:
+        text = " ".join(f"({escape(line)}) '" for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{content}\nendobj\n".encode("latin-1", "replace")
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    pdf += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode()
+    return pdf
+
+
+class StubAdapter(HTTPAdapter):
+    """Transport adapter sending every request to the stub server, whatever the host of its url.
+
+    Mounted on a session for e.g. 'https://arxiv.org/', it lets the scraping and pdf download code run
+    unchanged against the stub.
+    """
+
+    def __init__(self, stub_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.stub_url = stub_url.rstrip("/")
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = (
+            self.stub_url + parts.path + (f"?{parts.query}" if parts.query else "")
+        )
+        return super().send(request, **kwargs)
+
+
+class StubServer:
+    """Local HTTP server standing in for paperswithcode.com, with a fixed latency added to every response.
+
+    Routes can be added with `add_route(path, body, content_type)`; unknown paths return 404. Paths under
+    /api/query answer like the arXiv API. Responses carry an ETag, and conditional requests of unchanged
+    routes are answered with 304 Not Modified. The bytes of the response bodies sent are counted in
+    `bytes_sent`.
+
+    Args:
+        n_papers (int): Number of trending papers listed on the front page.
+        latency (float): Seconds to wait before answering each request.
+    """
+
+    def __init__(self, n_papers: int = 20, latency: float = 0.05):
+        self.latency = latency
+        self.routes = {"/": (front_page(n_papers).encode(), "text/html")}
+        for i in range(n_papers):
+            self.add_route(f"/paper/stub-paper-{i}", paper_page(i))
+        self.request_count = 0
+        self.bytes_sent = 0
+        self._server = None
+        self._thread = None
+
+    def add_route(self, path: str, body, content_type: str = "text/html"):
+        if isinstance(body, str):
+            body = body.encode()
+        self.routes[path] = (body, content_type)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def session(self, pool_size: int = 16, **kwargs):
+        """Creates a session like `http_client.create_session`, sending arXiv and paperswithcode requests to the stub."""
+        from http_client import create_session
+
+        session = create_session(pool_size, **kwargs)
+        adapter = StubAdapter(
+            self.url, pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        for host in ("arxiv.org", "export.arxiv.org", "paperswithcode.com"):
+            session.mount(f"https://{host}/", adapter)
+        return session
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.request_count += 1
+                time.sleep(stub.latency)
+                route = stub.routes.get(self.path)
+                if self.path.startswith("/api/query"):
+                    query = parse_qs(urlsplit(self.path).query)
+                    doc_nums = query.get("id_list", [""])[0].split(",")
+                    route = (arxiv_feed(doc_nums).encode(), "application/atom+xml")
+                if route is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body, content_type = route
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+                stub.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,428 @@
+"""Runs the offline benchmark suite: ingestion, indexing, retrieval and end-to-end QA, with JSON results.
+
+Nothing leaves the machine. paperswithcode, the arXiv API and the arXiv pdfs are served by a local stub
+server (the scraping and download code runs unchanged, its sessions are routed to the stub), and the
+OpenAI models are replaced by the deterministic fakes of benchmarks/fakes.py with configurable latency.
+Every benchmark runs in its own temporary working directory.
+
+- ingestion: scrape the front page, paper pages and arXiv metadata of `--papers` papers, then download,
+  parse, split, embed and index their pdfs.
+- indexing: index synthetic corpora of `--sizes` chunks, then rerun the (no-op) incremental update.
+- retrieval: build the hybrid retriever over each corpus and time queries, with the hit rate of the
+  source chunk's paper among the results.
+- qa: answer questions end to end through the RAG chain, one by one with streaming (time to first
+  chunk and total) and concurrently with `rag_batch` (throughput).
+
+Results are written to `--output`. With `--compare`, throughputs ('*_per_second') and latencies
+('*_ms', '*_seconds') are compared with a baseline results file, and the run fails when any got worse
+by more than `--tolerance`.
+
+Usage:
+    python -m benchmarks.suite --sizes 100 1000 10000 50000 --output benchmark_results.json
+    python -m benchmarks.suite --output new_results.json --compare benchmark_results.json --tolerance 0.25
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from langchain_core.documents import Document
+
+from benchmarks.bench_chunking import synthetic_paper
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from benchmarks.stub_server import StubServer, make_pdf
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from embedding_executor import BatchedEmbeddings
+from http_client import RateLimiter
+from indexing import get_arxiv_id, update_vector_database
+from instrumentation import METRICS, percentile
+from vectorstore import VECTOR_STORE, get_vectorstore
+
+
+@contextlib.contextmanager
+def workdir():
+    """Runs a benchmark in a temporary working directory, so the data/ files it writes are thrown away."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "data"))
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def latency_summary(seconds: list) -> dict:
+    """Summarizes latencies in milliseconds."""
+    values = sorted(seconds)
+    return {
+        "mean_ms": statistics.mean(values) * 1000,
+        "p50_ms": percentile(values, 0.5) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+    }
+
+
+def cached_embeddings(embeddings: FakeEmbeddings, batched: bool = False):
+    """Wraps fake embeddings like the app does, with an embedding cache in the working directory."""
+    cache = EmbeddingCache(
+        embeddings.model, directory=os.path.abspath("data/embedding_cache")
+    )
+    if batched:
+        # The API rate limits would dominate the larger corpora, so they are lifted like the HTTP ones.
+        return BatchedEmbeddings(
+            embeddings,
+            cache=cache,
+            tokens_per_minute=10**12,
+            requests_per_minute=10**9,
+        )
+    return CachedEmbeddings(embeddings, cache=cache)
+
+
+def synthetic_corpus(n_chunks: int, chunks_per_paper: int = 50, seed: int = 0):
+    """Builds papers and their chunk documents, with vocabularies that differ between papers.
+
+    Returns:
+        tuple: The paper metadata and a dict mapping the arXiv id of each paper to its chunks.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    papers, chunks = [], {}
+    for i in range((n_chunks + chunks_per_paper - 1) // chunks_per_paper):
+        paper = {
+            "url": f"https://paperswithcode.com/paper/synthetic-{i}",
+            "title": f"Synthetic paper {i}",
+            "arxiv_link": f"https://arxiv.org/pdf/{2400 + i // 100000}.{i % 100000:05d}v1.pdf",
+            "published": f"2024-{1 + i % 12:02d}-01",
+            "authors": "Ada Lovelace, Alan Turing",
+            "summary": f"Abstract of synthetic paper {i}.",
+        }
+        # Every paper draws most of its words from its own slice of the vocabulary.
+        own = rng.sample(vocabulary, 200)
+        n = min(chunks_per_paper, n_chunks - i * chunks_per_paper)
+        chunks[get_arxiv_id(paper)] = [
+            Document(
+                page_content=" ".join(
+                    rng.choice(own) if rng.random() < 0.7 else rng.choice(vocabulary)
+                    for _ in range(150)
+                ),
+                metadata={
+                    "source": paper["arxiv_link"],
+                    "page": j // 5,
+                    "arxiv_id": get_arxiv_id(paper),
+                    "title": paper["title"],
+                    "section": "",
+                    "chunk": j,
+                },
+            )
+            for j in range(n)
+        ]
+        papers.append(paper)
+    return papers, chunks
+
+
+def index_corpus(papers: list, chunks: dict, vectordb, backend: str) -> float:
+    """Indexes a synthetic corpus with the incremental indexer, returning the seconds it took."""
+    start = time.perf_counter()
+    update_vector_database(
+        papers,
+        vectordb,
+        lambda changed: ((paper, chunks[get_arxiv_id(paper)]) for paper in changed),
+        vector_store=backend,
+    )
+    return time.perf_counter() - start
+
+
+def bench_ingestion(
+    n_papers: int, http_latency: float, embed_latency: float, backend: str
+) -> dict:
+    """Scrapes and indexes `n_papers` papers served by the stub server."""
+    from get_data import get_paper_info, load_paper_chunks
+
+    with StubServer(n_papers, http_latency) as server, workdir():
+        rng = random.Random(0)
+        for i in range(n_papers):
+            pages = [page.page_content.splitlines() for page in synthetic_paper(rng)]
+            server.add_route(
+                f"/pdf/2401.{i:05d}v1.pdf", make_pdf(pages), "application/pdf"
+            )
+
+        # The requests go to the local stub, so the politeness rate limits of the real hosts are lifted.
+        with mock.patch("get_data.create_session", server.session), mock.patch(
+            "pdf_ingest.create_session", server.session
+        ), mock.patch("pdf_ingest.RateLimiter", lambda **kwargs: RateLimiter(0)):
+            start = time.perf_counter()
+            papers = get_paper_info(requests_per_second=0, url=server.url)
+            scrape_seconds = time.perf_counter() - start
+            requests = server.request_count
+
+            embeddings = cached_embeddings(
+                FakeEmbeddings(latency=embed_latency), batched=True
+            )
+            vectordb = get_vectorstore(embeddings, backend)
+            start = time.perf_counter()
+            stats = update_vector_database(
+                papers, vectordb, load_paper_chunks, vector_store=backend
+            )
+            index_seconds = time.perf_counter() - start
+
+    return {
+        "papers": len(papers),
+        "requests": requests,
+        "scrape_seconds": scrape_seconds,
+        "scrape_papers_per_second": len(papers) / scrape_seconds,
+        "chunks": stats["added"],
+        "index_seconds": index_seconds,
+        "index_papers_per_second": stats["indexed"] / index_seconds,
+        "index_chunks_per_second": stats["added"] / index_seconds,
+    }
+
+
+def bench_index_and_retrieval(
+    n_chunks: int, n_queries: int, embed_latency: float, backend: str, k: int = 4
+) -> tuple:
+    """Indexes a synthetic corpus of `n_chunks` chunks and times retrieval over it."""
+    from retrieval import HybridRetriever
+
+    papers, chunks = synthetic_corpus(n_chunks)
+    with workdir():
+        embeddings = cached_embeddings(
+            FakeEmbeddings(latency=embed_latency), batched=True
+        )
+        vectordb = get_vectorstore(embeddings, backend)
+        index_seconds = index_corpus(papers, chunks, vectordb, backend)
+        rerun_seconds = index_corpus(papers, chunks, vectordb, backend)
+        indexing = {
+            "chunks": n_chunks,
+            "index_seconds": index_seconds,
+            "index_chunks_per_second": n_chunks / index_seconds,
+            "noop_rerun_seconds": rerun_seconds,
+        }
+
+        start = time.perf_counter()
+        retriever = HybridRetriever.from_vectordb(vectordb, k=k)
+        build_seconds = time.perf_counter() - start
+
+        # Each query is a span of words from a random chunk; a hit retrieves a chunk of its paper.
+        rng = random.Random(1)
+        seconds, hits = [], 0
+        for _ in range(n_queries):
+            chunk = rng.choice(rng.choice(list(chunks.values())))
+            words = chunk.page_content.split()
+            start_word = rng.randrange(len(words) - 12)
+            query = " ".join(words[start_word : start_word + 12])
+
+            start = time.perf_counter()
+            docs = retriever.get_relevant_documents(query)
+            seconds.append(time.perf_counter() - start)
+            hits += chunk.metadata["arxiv_id"] in {
+                doc.metadata.get("arxiv_id") for doc in docs
+            }
+
+        retrieval = {
+            "chunks": n_chunks,
+            "build_seconds": build_seconds,
+            "hit_rate": hits / n_queries,
+            **latency_summary(seconds),
+            "queries_per_second": n_queries / sum(seconds),
+        }
+    return indexing, retrieval
+
+
+def bench_qa(
+    n_chunks: int,
+    n_questions: int,
+    concurrency: int,
+    embed_latency: float,
+    first_token_latency: float,
+    tokens_per_second: float,
+    backend: str,
+) -> dict:
+    """Answers questions end to end through the RAG chain, with fake embeddings and a fake LLM."""
+    import rag
+
+    papers, chunks = synthetic_corpus(n_chunks)
+    rng = random.Random(2)
+    questions = [
+        " ".join(
+            rng.choice(rng.choice(list(chunks.values()))).page_content.split()[:10]
+        )
+        for _ in range(2 * n_questions)
+    ]
+
+    with workdir():
+        embeddings = cached_embeddings(FakeEmbeddings(latency=embed_latency))
+        index_corpus(papers, chunks, get_vectorstore(embeddings, backend), backend)
+
+        def fake_chat_model(callbacks=None, **kwargs):
+            return FakeChatModel(
+                first_token_latency=first_token_latency,
+                tokens_per_second=tokens_per_second,
+                callbacks=callbacks,
+            )
+
+        with mock.patch.object(rag, "get_embeddings", lambda: embeddings), mock.patch(
+            "vectorstore.VECTOR_STORE", backend
+        ), mock.patch("langchain_openai.ChatOpenAI", fake_chat_model):
+            rag.rag_chains.cache_clear()
+            rag.get_answer_cache.cache_clear()
+            METRICS.reset()
+            try:
+                # One by one, streaming, as the app and the command line interface do.
+                first_chunk, total = [], []
+                for question in questions[:n_questions]:
+                    start = time.perf_counter()
+                    for i, _ in enumerate(rag.rag_stream(question)):
+                        if i == 0:
+                            first_chunk.append(time.perf_counter() - start)
+                    total.append(time.perf_counter() - start)
+
+                # Concurrently, with new questions so the answer cache does not serve them.
+                start = time.perf_counter()
+                results = list(
+                    rag.rag_batch(questions[n_questions:], max_concurrency=concurrency)
+                )
+                batch_seconds = time.perf_counter() - start
+                spans = METRICS.snapshot()["histograms"]
+            finally:
+                rag.rag_chains.cache_clear()
+                rag.get_answer_cache.cache_clear()
+
+    assert not any(result["error"] for result in results), results
+    return {
+        "chunks": n_chunks,
+        "questions": n_questions,
+        "first_chunk": latency_summary(first_chunk),
+        "total": latency_summary(total),
+        "batch_concurrency": concurrency,
+        "batch_seconds": batch_seconds,
+        "batch_questions_per_second": n_questions / batch_seconds,
+        "spans_p50_ms": {
+            name: summary["p50"] * 1000
+            for name, summary in spans.items()
+            if summary["unit"] == "s" and summary["count"]
+        },
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Flattens nested results into a dict mapping 'a.b.c' paths to numbers."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns the metrics that got worse than the baseline by more than `tolerance`."""
+    regressions = []
+    current, previous = flatten(results), flatten(baseline)
+    for path, value in current.items():
+        base = previous.get(path)
+        if not base or ".spans_p50_ms." in path:
+            continue
+        if path.endswith("_per_second"):
+            worse = value < base * (1 - tolerance)
+        elif path.endswith(("_ms", "_seconds")):
+            worse = value > base * (1 + tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append(f"{path}: {base:.4g} -> {value:.4g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        default=["ingestion", "indexing", "qa"],
+        choices=["ingestion", "indexing", "qa"],
+        help="'indexing' also runs the retrieval benchmark on every corpus",
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000, 10_000, 50_000]
+    )
+    parser.add_argument("--papers", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--qa-chunks", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--http-latency", type=float, default=0.02)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--llm-first-token", type=float, default=0.3)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100)
+    parser.add_argument("--backend", default=VECTOR_STORE, choices=["chroma", "faiss"])
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="baseline results file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {}
+    if "ingestion" in args.benchmarks:
+        print(f"ingestion: {args.papers} papers")
+        results["ingestion"] = bench_ingestion(
+            args.papers, args.http_latency, args.embed_latency, args.backend
+        )
+    if "indexing" in args.benchmarks:
+        results["indexing"], results["retrieval"] = {}, {}
+        for size in args.sizes:
+            print(f"indexing and retrieval: {size} chunks")
+            (
+                results["indexing"][str(size)],
+                results["retrieval"][str(size)],
+            ) = bench_index_and_retrieval(
+                size, args.queries, args.embed_latency, args.backend
+            )
+    if "qa" in args.benchmarks:
+        print(f"qa: {args.questions} questions over {args.qa_chunks} chunks")
+        results["qa"] = bench_qa(
+            args.qa_chunks,
+            args.questions,
+            args.concurrency,
+            args.embed_latency,
+            args.llm_first_token,
+            args.llm_tokens_per_second,
+            args.backend,
+        )
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import bisect
+import re
+from collections import Counter
+
+from langchain_core.documents import Document
+
+# Numbered section headings such as "3 Method", "3.2. Training Details", "A.1 Proofs" or "IV. RESULTS".
+NUMBERED_HEADING = re.compile(
+    r"^(?:\d{1,2}(?:\.\d{1,2}){0,2}\.?|[A-H](?:\.\d{1,2}){0,2}\.?|[IVX]{1,4}\.)\s+[A-Z][^.!?]{1,80}$"
+)
+# Unnumbered headings common in papers.
+NAMED_HEADING = re.compile(
+    r"^(?:abstract|introduction|related work|background|method(?:s|ology)?|experiments?|results|"
+    r"discussion|limitations|conclusions?|acknowledge?ments?|references|bibliography|appendix|"
+    r"appendices|supplementary materials?)$",
+    re.IGNORECASE,
+)
+# Sections dropped from the index: citations and thanks answer no questions about the paper.
+DROPPED_SECTION = re.compile(
+    r"^(?:[\dIVX]{1,4}\.?\s+)?(?:references|bibliography|acknowledge?ments?)$",
+    re.IGNORECASE,
+)
+# Appendices follow the references and are indexed again.
+APPENDIX_HEADING = re.compile(
+    r"^(?:appendix|appendices|supplementary materials?)\b|^[A-H](?:\.\d{1,2})?\.?\s+[A-Z]",
+    re.IGNORECASE,
+)
+# The arXiv identifier stamped in the margin of the first page, and bare page numbers.
+BOILERPLATE_LINE = re.compile(r"^(?:arXiv:\d{4}\.\d{4,5}(?:v\d+)?\b.*|\d{1,3})$")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+
+
+def is_heading(line: str) -> bool:
+    """Checks whether a line of pdf text is a section heading."""
+    if len(line.split()) > 10:
+        return False
+    return bool(NUMBERED_HEADING.match(line) or NAMED_HEADING.match(line))
+
+
+def repeated_lines(pages: list, edge_lines: int = 2, min_share: float = 0.5) -> set:
+    """Finds the running headers and footers of a paper.
+
+    A line counts as a running header or footer when it is among the first or last `edge_lines` lines of
+    at least `min_share` of the pages (and of at least 3 pages). Digits are ignored when comparing lines,
+    so page numbers in a footer do not hide it.
+    """
+    counts = Counter()
+    for page in pages:
+        lines = [line.strip() for line in page.page_content.splitlines()]
+        lines = [line for line in lines if line]
+        edges = lines[:edge_lines] + lines[-edge_lines:]
+        counts.update({re.sub(r"\d+", "#", line) for line in edges})
+
+    threshold = max(3, min_share * len(pages))
+    return {line for line, count in counts.items() if count >= threshold}
+
+
+class PaperSplitter:
+    """Splits the pages of a paper into chunks of a bounded number of tokens along its structure.
+
+    Pages are cleaned first: running headers and footers, page numbers and the arXiv margin stamp are
+    removed, and pages with almost no text left (e.g. full-page figures) are dropped. The text is then cut
+    into sections at the section headings, and the references and acknowledgements are dropped. Each
+    section is split into sentences, which are packed into chunks of at most `chunk_tokens` tokens
+    (counted with tiktoken, like the embedding model does). Chunks never span two sections, and
+    consecutive chunks of a section share whole sentences of at most `overlap_tokens` tokens.
+
+    Every chunk keeps the metadata of the page it starts on, plus the 'section' it belongs to and its
+    position in the paper.
+
+    Args:
+        chunk_tokens (int): Maximum number of tokens per chunk.
+        overlap_tokens (int): Maximum number of tokens repeated from the end of the previous chunk.
+        min_chunk_tokens (int): Chunks and sections with fewer tokens are merged into their neighbors.
+        min_page_words (int): Pages with fewer words after cleaning are dropped.
+        encoding (str): tiktoken encoding used to count tokens.
+    """
+
+    def __init__(
+        self,
+        chunk_tokens: int = 192,
+        overlap_tokens: int = 24,
+        min_chunk_tokens: int = 16,
+        min_page_words: int = 20,
+        encoding: str = "cl100k_base",
+    ):
+        import tiktoken
+
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.min_page_words = min_page_words
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def clean_lines(self, pages: list):
+        """Yields the page number and text of every line of the paper that is not boilerplate."""
+        repeated = repeated_lines(pages)
+        for i, page in enumerate(pages):
+            lines = [line.strip() for line in page.page_content.splitlines()]
+            lines = [
+                line
+                for line in lines
+                if line
+                and not BOILERPLATE_LINE.match(line)
+                and re.sub(r"\d+", "#", line) not in repeated
+            ]
+            if sum(len(line.split()) for line in lines) < self.min_page_words:
+                continue
+            for line in lines:
+                yield i, line
+
+    def sections(self, pages: list):
+        """Yields the heading and the lines of every section of the paper, without the dropped sections.
+
+        Lines before the first heading (title, authors) form a section with an empty heading.
+        """
+        heading, lines, dropping = "", [], False
+        for i, line in self.clean_lines(pages):
+            if is_heading(line):
+                if dropping and not APPENDIX_HEADING.match(line):
+                    continue
+                if lines and not dropping:
+                    yield heading, lines
+                heading, lines = line, []
+                dropping = bool(DROPPED_SECTION.match(line))
+            if not dropping:
+                lines.append((i, line))
+        if lines and not dropping:
+            yield heading, lines
+
+    def sentences(self, lines: list) -> list:
+        """Joins the lines of a section and splits them into sentences, each with the page it starts on.
+
+        Words hyphenated across a line break are joined again.
+        """
+        text, starts, pages = "", [], []
+        for i, line in lines:
+            if text.endswith("-") and text[-2:-1].isalpha() and line[:1].islower():
+                text = text[:-1]
+            elif text:
+                text += " "
+            starts.append(len(text))
+            pages.append(i)
+            text += line
+
+        sentences, start = [], 0
+        for match in SENTENCE_END.finditer(text):
+            sentences.append(
+                (
+                    pages[bisect.bisect_right(starts, start) - 1],
+                    text[start : match.start()],
+                )
+            )
+            start = match.end()
+        if start < len(text):
+            sentences.append(
+                (pages[bisect.bisect_right(starts, start) - 1], text[start:])
+            )
+        return sentences
+
+    def units(self, sentences: list):
+        """Yields the page, text and token count of every sentence, cutting sentences longer than a chunk."""
+        for page, sentence in sentences:
+            tokens = self._encoding.encode(sentence, disallowed_special=())
+            if len(tokens) <= self.chunk_tokens:
+                yield page, sentence, len(tokens)
+                continue
+            for start in range(0, len(tokens), self.chunk_tokens):
+                window = tokens[start : start + self.chunk_tokens]
+                yield page, self._encoding.decode(window), len(window)
+
+    def pack(self, units: list) -> list:
+        """Packs the sentences of one section into chunks, returned as lists of sentence units."""
+        chunks, chunk, chunk_tokens, first_new = [], [], 0, 0
+        for unit in units:
+            if len(chunk) > first_new and chunk_tokens + unit[2] > self.chunk_tokens:
+                chunks.append(chunk)
+                # Start the next chunk with the last sentences of this one, within the overlap budget and
+                # leaving room for the sentence that did not fit.
+                overlap_budget = min(self.overlap_tokens, self.chunk_tokens - unit[2])
+                overlap, overlap_tokens = [], 0
+                for previous in reversed(chunk):
+                    if overlap_tokens + previous[2] > overlap_budget:
+                        break
+                    overlap.insert(0, previous)
+                    overlap_tokens += previous[2]
+                chunk, chunk_tokens, first_new = overlap, overlap_tokens, len(overlap)
+            chunk.append(unit)
+            chunk_tokens += unit[2]
+
+        tail = chunk[first_new:]
+        tail_tokens = sum(unit[2] for unit in tail)
+        if (
+            chunks
+            and tail_tokens < self.min_chunk_tokens
+            and sum(unit[2] for unit in chunks[-1]) + tail_tokens <= self.chunk_tokens
+        ):
+            # A short tail is added to the previous chunk, if it fits, instead of becoming a chunk of its own.
+            chunks[-1].extend(tail)
+        elif tail:
+            chunks.append(chunk)
+        return chunks
+
+    def _section_chunks(self, pages: list):
+        """Yields the heading of the section and the sentence units of every chunk of the paper."""
+        pending, pending_tokens = [], 0
+        for heading, lines in self.sections(pages):
+            units = pending + list(self.units(self.sentences(lines)))
+            tokens = pending_tokens + sum(unit[2] for unit in units[len(pending) :])
+            # A section with hardly any text, e.g. a heading directly followed by a subsection heading,
+            # is merged into the next section.
+            if tokens < self.min_chunk_tokens:
+                pending, pending_tokens = units, tokens
+                continue
+            pending, pending_tokens = [], 0
+
+            for chunk in self.pack(units):
+                yield heading, chunk
+
+        if pending:
+            yield heading, pending
+
+    def iter_chunks(self, pages: list):
+        """Splits the pages of one paper, yielding its chunk documents one by one.
+
+        Args:
+            pages (list): The page documents of the paper, in page order.
+
+        Yields:
+            Document: The chunks, each with the metadata of the page it starts on, its 'section' and its
+                      position in the paper ('chunk'), so neighboring chunks can be merged again.
+        """
+        for position, (heading, chunk) in enumerate(self._section_chunks(pages)):
+            page = chunk[0][0]
+            yield Document(
+                page_content=" ".join(unit[1] for unit in chunk),
+                metadata={
+                    **pages[page].metadata,
+                    "section": heading,
+                    "chunk": position,
+                },
+            )
+
+    def split_documents(self, pages: list) -> list:
+        """Splits the pages of one paper into chunk documents, see `iter_chunks`."""
+        return list(self.iter_chunks(pages))
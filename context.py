@@ -0,0 +1,161 @@
+import re
+
+from instrumentation import observe
+
+
+def shingles(text: str, size: int = 3) -> set:
+    """Returns the set of word `size`-grams of a text, used to compare passages."""
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i : i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def merge_text(first: str, second: str, min_overlap: int = 20) -> str:
+    """Merges two chunks of the same paper if one contains the other or they overlap.
+
+    Consecutive chunks share the end of the first chunk with the start of the second (see chunking.py),
+    which is kept only once.
+
+    Returns:
+        str: The merged text, or None if the chunks do not overlap.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for a, b in ((first, second), (second, first)):
+        # Look for the longest end of `a` that `b` starts with.
+        for start in range(max(0, len(a) - len(b)), len(a) - min_overlap + 1):
+            if a[start] == b[0] and b.startswith(a[start:]):
+                return a + b[len(a) - start :]
+    return None
+
+
+class ContextAssembler:
+    """Assembles the retrieved chunks into the context of the prompt, within a token budget.
+
+    Chunks of the same paper that overlap or are neighbors in the paper are merged into one passage, so
+    their shared text is sent once. Passages that are near-identical to a better ranked passage (e.g. the
+    same text indexed for two versions of a paper) are dropped. The remaining passages are added best
+    first until `max_tokens` tokens (counted with tiktoken) are used; the passage that crosses the budget
+    is cut off. Every passage starts with a compact citation: the source number of its paper, the title
+    and the arXiv id.
+
+    Args:
+        max_tokens (int): Maximum number of tokens of the context.
+        duplicate_threshold (float): Jaccard similarity of word trigrams above which a passage counts as a
+                                     duplicate.
+        min_passage_tokens (int): A passage is only cut off to fit the budget if at least this many tokens
+                                  of it fit.
+        encoding (str): tiktoken encoding used to count tokens.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 1000,
+        duplicate_threshold: float = 0.8,
+        min_passage_tokens: int = 48,
+        encoding: str = "cl100k_base",
+    ):
+        import tiktoken
+
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.min_passage_tokens = min_passage_tokens
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def passages(self, docs: list) -> list:
+        """Merges the retrieved chunks into passages and drops duplicates.
+
+        Args:
+            docs (list): The retrieved documents, best first.
+
+        Returns:
+            list of dict: The passages, best first, each with the 'rank' of its best chunk, the 'paper'
+                          key, 'title', 'arxiv_id' and 'text'.
+        """
+        papers = {}
+        for rank, doc in enumerate(docs):
+            key = doc.metadata.get("arxiv_id") or doc.metadata.get("source") or rank
+            papers.setdefault(key, []).append((rank, doc))
+
+        passages = []
+        for key, chunks in papers.items():
+            # Chunks carrying their position in the paper are merged in reading order.
+            if all("chunk" in doc.metadata for _, doc in chunks):
+                chunks.sort(key=lambda chunk: chunk[1].metadata["chunk"])
+            merged = []
+            for rank, doc in chunks:
+                position = doc.metadata.get("chunk")
+                for passage in merged:
+                    text = merge_text(passage["text"], doc.page_content)
+                    if (
+                        text is None
+                        and position is not None
+                        and passage["last"] is not None
+                        and position - passage["last"] == 1
+                    ):
+                        text = passage["text"] + " " + doc.page_content
+                    if text is not None:
+                        passage["text"] = text
+                        passage["rank"] = min(passage["rank"], rank)
+                        if position is not None:
+                            passage["last"] = max(passage["last"], position)
+                        break
+                else:
+                    merged.append(
+                        {
+                            "rank": rank,
+                            "paper": key,
+                            "title": doc.metadata.get("title"),
+                            "arxiv_id": doc.metadata.get("arxiv_id"),
+                            "text": doc.page_content,
+                            "last": position,
+                        }
+                    )
+            passages.extend(merged)
+        passages.sort(key=lambda passage: passage["rank"])
+
+        kept = []
+        for passage in passages:
+            passage["shingles"] = shingles(passage["text"])
+            if not any(
+                len(passage["shingles"] & other["shingles"])
+                / len(passage["shingles"] | other["shingles"])
+                >= self.duplicate_threshold
+                for other in kept
+            ):
+                kept.append(passage)
+        for passage in kept:
+            del passage["shingles"], passage["last"]
+        return kept
+
+    def format(self, docs: list) -> str:
+        """Formats the retrieved documents into the context of the prompt.
+
+        Args:
+            docs (list): The retrieved documents, best first.
+
+        Returns:
+            str: The passages, each headed by its citation, e.g. '[1] Attention Is All You Need (arXiv:1706.03762)'.
+        """
+        numbers = {}
+        blocks, used = [], 0
+        for passage in self.passages(docs):
+            number = numbers.setdefault(passage["paper"], len(numbers) + 1)
+            citation = f"[{number}] {passage['title'] or 'Untitled'}"
+            if passage["arxiv_id"]:
+                citation += f" (arXiv:{passage['arxiv_id']})"
+            block = f"{citation}\n{passage['text']}"
+
+            tokens = self._encoding.encode(block, disallowed_special=())
+            if used + len(tokens) > self.max_tokens:
+                remaining = self.max_tokens - used
+                if remaining >= self.min_passage_tokens:
+                    blocks.append(self._encoding.decode(tokens[: remaining - 1]) + "…")
+                    used = self.max_tokens
+                break
+            blocks.append(block)
+            used += len(tokens) + 1
+
+        observe("rag.context_tokens", used, unit="tokens")
+        return "\n\n".join(blocks)
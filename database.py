@@ -1,52 +1,176 @@
 # If decide to continuously expand database of papers
 
 # from get_data import get_paper_info
+import json
+import os
 import sqlite3
+import time
+import urllib.parse
 
+# The Streamlit app reads the paper database, so the indexing helpers (and the HTTP client they pull in)
+# are only imported when papers are written.
 
-def insert_or_update_database(paper_metadata):
+DATABASE_PATH = "data/papers.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    arxiv_link TEXT,
+    arxiv_id TEXT,
+    published DATE,
+    authors TEXT,
+    summary TEXT,
+    first_seen TEXT,
+    last_seen TEXT,
+    topic_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS trending_snapshots (
+    snapshot_at TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    url TEXT NOT NULL REFERENCES papers (url),
+    PRIMARY KEY (snapshot_at, rank)
+);
+CREATE TABLE IF NOT EXISTS topics (
+    topic_id INTEGER PRIMARY KEY,
+    keywords TEXT
+);
+"""
+
+# Created after the columns are migrated, as older databases lack the arxiv_id column.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS papers_published ON papers (published);
+CREATE INDEX IF NOT EXISTS papers_arxiv_id ON papers (arxiv_id);
+CREATE INDEX IF NOT EXISTS papers_topic_id ON papers (topic_id, published);
+CREATE INDEX IF NOT EXISTS trending_snapshots_url ON trending_snapshots (url);
+"""
+
+# Columns added since the first version of the papers table.
+NEW_COLUMNS = {
+    "arxiv_id": "TEXT",
+    "first_seen": "TEXT",
+    "last_seen": "TEXT",
+    "topic_id": "INTEGER",
+}
+
+# Existing fields are kept when the new value is missing, e.g. when the arXiv metadata lookup failed.
+UPSERT = """
+INSERT INTO papers (url, title, arxiv_link, arxiv_id, published, authors, summary, first_seen, last_seen)
+VALUES (:url, :title, :arxiv_link, :arxiv_id, :published, :authors, :summary, :seen, :seen)
+ON CONFLICT (url) DO UPDATE SET
+    title = COALESCE(excluded.title, title),
+    arxiv_link = COALESCE(excluded.arxiv_link, arxiv_link),
+    arxiv_id = COALESCE(excluded.arxiv_id, arxiv_id),
+    published = COALESCE(excluded.published, published),
+    authors = COALESCE(excluded.authors, authors),
+    summary = COALESCE(excluded.summary, summary),
+    last_seen = excluded.last_seen
+"""
+
+
+def migrate(conn: sqlite3.Connection):
+    """Creates the tables and indexes of the paper database, adding the columns older databases lack.
+
+    Args:
+        conn (sqlite3.Connection): Writable connection to the paper database.
+    """
+    conn.executescript(SCHEMA)
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(papers)")}
+    for column, column_type in NEW_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE papers ADD COLUMN {column} {column_type}")
+    conn.executescript(INDEXES)
+
+
+def connect(path: str = DATABASE_PATH) -> sqlite3.Connection:
+    """Opens the paper database for writing in WAL mode, creating or migrating its schema.
+
+    WAL lets the app read the database while a refresh writes to it, and with synchronous=NORMAL a
+    transaction costs no fsync until the next checkpoint. Only the writers use this connection; the
+    queries of the app go through `connect_read_only`, so a page view never runs the migration.
+
+    Args:
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: The open connection.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    migrate(conn)
+    return conn
+
+
+def connect_read_only(path: str = DATABASE_PATH) -> sqlite3.Connection:
+    """Opens the paper database for reading only, without touching its schema.
+
+    The database must have been created by a writer, see `connect`.
+
+    Args:
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: The open connection.
+    """
+    return sqlite3.connect(
+        f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro", uri=True
+    )
+
+
+def insert_or_update_database(
+    paper_metadata, path: str = DATABASE_PATH, snapshot: bool = True
+) -> int:
     """
     Inserts new records or updates existing records in the SQLite database for a collection of research papers.
 
-    This function connects to an SQLite database named 'papers.db', ensures the existence of a table named 'papers',
-    and then iterates over a list of paper metadata. For each paper, it checks whether a record with the same URL
-    already exists in the database. If it does not exist, the function inserts a new record. If it does exist, the
-    function updates the existing record with the new data. The function tracks and prints the total number of rows
-    affected by insert or update operations.
+    All papers are upserted with a single `executemany` of `INSERT ... ON CONFLICT DO UPDATE` in one
+    transaction, so loading tens of thousands of papers takes seconds. When `snapshot` is set, the order
+    of `paper_metadata` is also recorded as a snapshot of the trending list in the 'trending_snapshots'
+    table, which keeps the history of which papers were trending when.
 
     Args:
         paper_metadata (list of dict): A list of dictionaries where each dictionary contains metadata of a paper, including
                              its 'url', 'title', 'arxiv_link', 'published', 'authors', and 'summary'.
+        path (str): Path of the SQLite database file.
+        snapshot (bool): Whether `paper_metadata` is the current trending list, as opposed to e.g. a
+                         historical backfill.
 
-    Prints:
-        The total number of rows inserted or updated in the database.
+    Returns:
+        int: The total number of rows inserted or updated in the 'papers' table.
     """
-    total_rows_affected = 0  # Initialize a counter to track affected rows
-    try:
-        # Using a context manager to handle the database connection
-        with sqlite3.connect("data/papers.db") as conn:
-            c = conn.cursor()
-            # Create table
-            c.execute(
-                """CREATE TABLE IF NOT EXISTS papers
-                        (url TEXT PRIMARY KEY, title TEXT, arxiv_link TEXT, published DATE, authors TEXT, summary TEXT )"""
-            )
-            for paper in paper_metadata:
-                # Check if the record already exists
-                c.execute(
-                    "SELECT 1 FROM papers WHERE url = :url", {"url": paper["url"]}
-                )
-                if not c.fetchone():
-                    # Prepare SQL query to insert or replace records
-                    sql_query = """INSERT OR REPLACE INTO papers (url, title, arxiv_link, published, authors, summary)
-                                VALUES (:url, :title, :arxiv_link, :published, :authors, :summary)"""
+    from indexing import get_arxiv_id
 
-                    # Execute SQL query
-                    c.execute(sql_query, paper)
+    seen = time.strftime("%Y-%m-%dT%H:%M:%S")
+    rows = [
+        {
+            "url": paper["url"],
+            "title": paper.get("title"),
+            "arxiv_link": paper.get("arxiv_link"),
+            "arxiv_id": get_arxiv_id(paper),
+            "published": paper.get("published"),
+            "authors": paper.get("authors"),
+            "summary": paper.get("summary"),
+            "seen": seen,
+        }
+        for paper in paper_metadata
+    ]
 
-                    total_rows_affected += c.rowcount
-
-            # Commit changes automatically due to the context manager
+    total_rows_affected = 0  # Initialize a counter to track affected rows
+    try:
+        conn = connect(path)
+        try:
+            # The connection context manager commits the transaction, or rolls it back on an error
+            with conn:
+                total_rows_affected = conn.executemany(UPSERT, rows).rowcount
+                if snapshot:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO trending_snapshots (snapshot_at, rank, url) VALUES (?, ?, ?)",
+                        [(seen, rank, row["url"]) for rank, row in enumerate(rows)],
+                    )
+        finally:
+            conn.close()
 
     except sqlite3.DatabaseError as e:
         print(f"Database error: {e}")
@@ -54,7 +178,170 @@ def insert_or_update_database(paper_metadata):
         print(f"An error occurred: {e}")
 
     print(f"Total rows affected (inserted or updated): {total_rows_affected}")
+    return total_rows_affected
+
+
+def database_version(path: str = DATABASE_PATH) -> float:
+    """Returns the last modification time of the database, or None if it does not exist.
+
+    In WAL mode, committed writes land in the -wal file until the next checkpoint, so both files count.
+    """
+    mtimes = [
+        os.path.getmtime(file) for file in (path, path + "-wal") if os.path.exists(file)
+    ]
+    return max(mtimes) if mtimes else None
+
+
+def get_papers(without_topic: bool = False, path: str = DATABASE_PATH) -> list:
+    """Returns the url, title and summary of every paper with a summary, oldest first.
+
+    Args:
+        without_topic (bool): Only the papers that have not been assigned a topic yet.
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        list of dict: The papers.
+    """
+    sql = "SELECT url, title, summary FROM papers WHERE summary IS NOT NULL"
+    if without_topic:
+        sql += " AND topic_id IS NULL"
+    conn = connect_read_only(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(sql + " ORDER BY published, url").fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def save_topics(topic_keywords: dict, paper_topics: dict, path: str = DATABASE_PATH):
+    """Saves the output of topic modeling: the topics and the topic assignment of papers.
+
+    Args:
+        topic_keywords (dict): The keywords of each topic, by topic id, replacing the current topics.
+                               None keeps the current topics, e.g. when only new papers were assigned.
+        paper_topics (dict): The topic id of each paper, by paper url.
+        path (str): Path of the SQLite database file.
+    """
+    conn = connect(path)
+    try:
+        with conn:
+            if topic_keywords is not None:
+                conn.execute("DELETE FROM topics")
+                conn.executemany(
+                    "INSERT INTO topics (topic_id, keywords) VALUES (?, ?)",
+                    [
+                        (int(topic_id), json.dumps(list(keywords)))
+                        for topic_id, keywords in topic_keywords.items()
+                    ],
+                )
+            conn.executemany(
+                "UPDATE papers SET topic_id = ? WHERE url = ?",
+                [(int(topic_id), url) for url, topic_id in paper_topics.items()],
+            )
+    finally:
+        conn.close()
+
+
+def get_topics(path: str = DATABASE_PATH) -> list:
+    """Returns every topic as a dictionary with its 'topic_id' and list of 'keywords', by topic id."""
+    conn = connect_read_only(path)
+    try:
+        rows = conn.execute(
+            "SELECT topic_id, keywords FROM topics ORDER BY topic_id"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        {"topic_id": topic_id, "keywords": json.loads(keywords)}
+        for topic_id, keywords in rows
+    ]
+
+
+def _paper_filters(
+    start_date=None, end_date=None, topic_id: int = None, trending: bool = False
+):
+    """Builds the FROM and WHERE clauses and parameters shared by `query_papers` and `count_papers`."""
+    sql = "FROM papers"
+    clauses, params = [], []
+    if trending:
+        # Only the papers of the latest trending snapshot.
+        sql += (
+            " JOIN trending_snapshots AS s ON s.url = papers.url"
+            " AND s.snapshot_at = (SELECT MAX(snapshot_at) FROM trending_snapshots)"
+        )
+    if start_date is not None:
+        clauses.append("published >= ?")
+        params.append(str(start_date))
+    if end_date is not None:
+        clauses.append("published <= ?")
+        params.append(str(end_date))
+    if topic_id is not None:
+        clauses.append("topic_id = ?")
+        params.append(topic_id)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    return sql, params
+
+
+def query_papers(
+    page: int = 0,
+    page_size: int = 20,
+    start_date=None,
+    end_date=None,
+    topic_id: int = None,
+    trending: bool = False,
+    path: str = DATABASE_PATH,
+) -> list:
+    """Returns one page of papers from the paper database.
+
+    Only the requested page is read, so the cost of a page does not grow with the size of the archive.
+
+    Args:
+        page (int): Zero-based page number.
+        page_size (int): Number of papers per page.
+        start_date (str or datetime.date, optional): Earliest publication date.
+        end_date (str or datetime.date, optional): Latest publication date.
+        topic_id (int, optional): Only papers assigned to this topic.
+        trending (bool): Only the papers of the latest trending snapshot, in trending order. Otherwise
+                         papers are ordered from the most recently published.
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        list of dict: The papers, with the same fields as data/paper_metadata.json plus 'arxiv_id' and 'topic_id'.
+    """
+    sql, params = _paper_filters(start_date, end_date, topic_id, trending)
+    order = "s.rank" if trending else "published DESC, papers.url"
+    conn = connect_read_only(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            "SELECT papers.url, title, arxiv_link, arxiv_id, published, authors, summary, topic_id "
+            f"{sql} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [page_size, page * page_size],
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def count_papers(
+    start_date=None,
+    end_date=None,
+    topic_id: int = None,
+    trending: bool = False,
+    path: str = DATABASE_PATH,
+) -> int:
+    """Returns the number of papers matching the filters of `query_papers`."""
+    sql, params = _paper_filters(start_date, end_date, topic_id, trending)
+    conn = connect_read_only(path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) {sql}", params).fetchone()[0]
+    finally:
+        conn.close()
 
 
-# Update data base with new data
-# insert_or_update_database(get_paper_info())
+if __name__ == "__main__":
+    # Load the papers scraped so far into the database
+    with open("data/paper_metadata.json", "r") as file:
+        insert_or_update_database(json.load(file))
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from embedding_cache import text_hash
+
+ARTIFACT_DIRECTORY = "data/embeddings"
+
+
+class EmbeddingArtifact:
+    """Immutable, versioned matrix of embeddings, one row per text, stored as a memory-mapped .npy file.
+
+    Each version lives in its own directory `<directory>/<name>/<version>` holding the vectors
+    (`vectors.npy`), the hash of the text of each row (`keys.json`) and the embedding model
+    (`meta.json`). The version is a hash of the model and the texts, so writing the same embeddings
+    twice yields the same version, and the `CURRENT` file names the version readers load.
+
+    Args:
+        path (str): Directory of the version.
+        version (str): The version.
+        model (str): Name of the embedding model.
+        keys (list): The hash of the text of each row.
+        vectors (np.ndarray): The memory-mapped float32 vectors.
+    """
+
+    def __init__(self, path: str, version: str, model: str, keys: list, vectors):
+        self.path = path
+        self.version = version
+        self.model = model
+        self.keys = keys
+        self.vectors = vectors
+        self._rows = {key: row for row, key in enumerate(keys)}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def rows(self, texts: list) -> list:
+        """Returns the row of each text, or None for texts that are not in the artifact."""
+        return [self._rows.get(text_hash(text)) for text in texts]
+
+    def get_many(self, texts: list) -> list:
+        """Returns the vector of each text, or None for texts that are not in the artifact."""
+        return [
+            None if row is None else np.asarray(self.vectors[row])
+            for row in self.rows(texts)
+        ]
+
+
+def artifact_version(model: str, keys: list) -> str:
+    """Hashes the embedding model and the text keys of an artifact into its version."""
+    digest = hashlib.sha256(model.encode())
+    for key in keys:
+        digest.update(key.encode())
+    return digest.hexdigest()[:16]
+
+
+def load_artifact(
+    name: str, model: str = None, directory: str = ARTIFACT_DIRECTORY
+) -> EmbeddingArtifact:
+    """Memory-maps the current version of an embedding artifact.
+
+    Args:
+        name (str): Name of the artifact, e.g. 'abstracts' or 'chunks'.
+        model (str, optional): Only return the artifact if it was embedded with this model.
+        directory (str): Directory holding all artifacts.
+
+    Returns:
+        EmbeddingArtifact: The artifact, or None if there is none.
+    """
+    current_path = os.path.join(directory, name, "CURRENT")
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path, "r") as file:
+        version = file.read().strip()
+
+    path = os.path.join(directory, name, version)
+    with open(os.path.join(path, "meta.json"), "r") as file:
+        meta = json.load(file)
+    if model is not None and meta["model"] != model:
+        return None
+    with open(os.path.join(path, "keys.json"), "r") as file:
+        keys = json.load(file)
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    return EmbeddingArtifact(path, version, meta["model"], keys, vectors)
+
+
+def write_artifact(
+    name: str,
+    texts: list,
+    embeddings,
+    model: str,
+    directory: str = ARTIFACT_DIRECTORY,
+    batch_size: int = 4096,
+    keep: int = 2,
+) -> EmbeddingArtifact:
+    """Writes the embeddings of `texts` as a new version of an artifact and makes it the current one.
+
+    Vectors are taken from the embedding cache of `embeddings` where possible and written in batches
+    straight into the memory-mapped file, so the whole matrix never has to fit in memory. Nothing is
+    written if the current version already holds the same texts.
+
+    Args:
+        name (str): Name of the artifact, e.g. 'abstracts' or 'chunks'.
+        texts (list): The texts, one per row.
+        embeddings (Embeddings): Embeddings with a `cache`, e.g. `BatchedEmbeddings` or `CachedEmbeddings`.
+        model (str): Name of the embedding model.
+        directory (str): Directory holding all artifacts.
+        batch_size (int): Number of rows embedded and written at a time.
+        keep (int): Number of versions kept, including the new one.
+
+    Returns:
+        EmbeddingArtifact: The current version of the artifact.
+    """
+    keys = [text_hash(text) for text in texts]
+    version = artifact_version(model, keys)
+    current = load_artifact(name, directory=directory)
+    if current is not None and current.version == version:
+        return current
+
+    path = os.path.join(directory, name, version)
+    temporary_path = path + ".tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    vectors = None
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start : start + batch_size]
+        # Only texts missing from the cache are sent to the embedding model.
+        found = embeddings.cache.get_many(batch)
+        missing = [i for i, vector in enumerate(found) if vector is None]
+        if missing:
+            computed = embeddings.embed_documents([batch[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                found[i] = vector
+
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                os.path.join(temporary_path, "vectors.npy"),
+                mode="w+",
+                dtype=np.float32,
+                shape=(len(texts), len(found[0])),
+            )
+        vectors[start : start + len(batch)] = np.asarray(found, dtype=np.float32)
+
+    if vectors is None:
+        np.save(
+            os.path.join(temporary_path, "vectors.npy"), np.zeros((0, 0), np.float32)
+        )
+    else:
+        vectors.flush()
+        del vectors
+    with open(os.path.join(temporary_path, "keys.json"), "w") as file:
+        json.dump(keys, file)
+    with open(os.path.join(temporary_path, "meta.json"), "w") as file:
+        json.dump({"model": model, "rows": len(keys), "created": time.time()}, file)
+
+    # Publish the new version, then point readers at it.
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temporary_path, path)
+    current_path = os.path.join(directory, name, "CURRENT")
+    with open(current_path + ".tmp", "w") as file:
+        file.write(version)
+    os.replace(current_path + ".tmp", current_path)
+
+    # Remove old versions; readers holding an older one keep their memory map until they reload.
+    versions = sorted(
+        (
+            entry
+            for entry in os.scandir(os.path.join(directory, name))
+            if entry.is_dir() and not entry.name.endswith(".tmp")
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in versions[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+    return load_artifact(name, directory=directory)
+
+
+def index_embeddings():
+    """Returns the embeddings of the vector database, backed by the shared embedding cache."""
+    from embedding_cache import open_cache
+    from embedding_executor import BatchedEmbeddings
+    from embedding_models import create_embeddings
+
+    base_embeddings = create_embeddings()
+    return BatchedEmbeddings(base_embeddings, cache=open_cache(base_embeddings.model))
+
+
+def build_abstract_artifact() -> EmbeddingArtifact:
+    """Writes the embeddings of the abstracts of all papers in the paper database as the 'abstracts' artifact.
+
+    The vectors come from the embedding cache, where create_vector_database puts the abstracts of the
+    papers it indexes; topic modeling reads them.
+    """
+    from database import get_papers
+
+    embeddings = index_embeddings()
+    artifact = write_artifact(
+        "abstracts",
+        [paper["summary"] for paper in get_papers()],
+        embeddings,
+        embeddings.cache.model_name,
+    )
+    print(f"Abstract embeddings: {len(artifact)} rows, version {artifact.version}")
+    return artifact
+
+
+def build_chunk_artifact() -> EmbeddingArtifact:
+    """Writes the embeddings of the chunks in the vector database as the 'chunks' artifact.
+
+    The vectors come straight from the embedding cache filled while indexing; the retriever reads them.
+    """
+    from vectorstore import get_vectorstore, vectorstore_exists
+
+    if not vectorstore_exists():
+        return None
+    embeddings = index_embeddings()
+    texts = get_vectorstore(embeddings).get(include=["documents"])["documents"]
+    artifact = write_artifact("chunks", texts, embeddings, embeddings.cache.model_name)
+    print(f"Chunk embeddings: {len(artifact)} rows, version {artifact.version}")
+    return artifact
+
+
+def build_embedding_artifacts():
+    """Writes the 'abstracts' and 'chunks' embedding artifacts."""
+    build_abstract_artifact()
+    build_chunk_artifact()
+
+
+if __name__ == "__main__":
+    build_embedding_artifacts()
@@ -0,0 +1,278 @@
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from instrumentation import span
+
+CACHE_DIRECTORY = "data/embedding_cache"
+
+
+def text_hash(text: str) -> str:
+    """Hashes a text into the key it is cached under."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """Disk-backed cache of the embeddings computed by one model.
+
+    Vectors are stored as float32 rows of a memory-mapped array (`vectors.f32`), and a SQLite index
+    (`index.db`) maps the hash of each text to its row and the time it was last used. When the cache
+    holds `max_entries` vectors, the least recently used ones are evicted and their rows reused.
+
+    Args:
+        model_name (str): Name of the embedding model; every model gets its own cache directory.
+        directory (str): Directory holding the caches of all models.
+        max_entries (int): Maximum number of vectors kept in the cache.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        directory: str = CACHE_DIRECTORY,
+        max_entries: int = 200_000,
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.directory = os.path.join(directory, re.sub(r"[^\w.-]", "_", model_name))
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(
+            os.path.join(self.directory, "index.db"),
+            check_same_thread=False,
+            timeout=60,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER UNIQUE, last_used REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self._conn.commit()
+
+        self.dim = self._stored_dim()
+        self._vectors = None
+        self._capacity = 0
+        if self.dim is not None and os.path.exists(self._vectors_path):
+            self._map(0)
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _stored_dim(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        return row[0] if row else None
+
+    def _map(self, capacity: int):
+        """Memory-maps the vectors file, growing it to hold at least `capacity` rows.
+
+        The whole file is mapped, so rows added by other processes sharing the cache are picked up too.
+        """
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as file:
+            file.truncate(
+                max(capacity * 4 * self.dim, os.path.getsize(self._vectors_path))
+            )
+        self._capacity = os.path.getsize(self._vectors_path) // (4 * self.dim)
+        self._vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(self._capacity, self.dim),
+        )
+
+    def _ensure_rows(self, rows: int):
+        """Maps at least `rows` rows, re-mapping the file when another process grew it since it was mapped."""
+        if rows <= self._capacity:
+            return
+        if self.dim is None:
+            self.dim = self._stored_dim()
+        self._map(rows)
+
+    def _lookup(self, keys: list) -> dict:
+        """Maps each of `keys` that is cached to its row, querying in batches to stay under SQLite's variable limit."""
+        rows = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start : start + 500]
+            rows.update(
+                self._conn.execute(
+                    f"SELECT key, row FROM entries WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+            )
+        return rows
+
+    def get_many(self, texts: list) -> list:
+        """Looks up the cached embedding of each text.
+
+        Args:
+            texts (list): The texts to look up.
+
+        Returns:
+            list: The cached vector of each text as a float32 array, or None where the text is not cached.
+        """
+        keys = [text_hash(text) for text in texts]
+        with self._lock:
+            # Writers only touch the vectors file inside their write transaction. Holding the write lock from
+            # the lookup until the vectors are copied, which the last_used update needs anyway, keeps another
+            # process from evicting a row and overwriting its vector in between.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._lookup(keys)
+                if rows:
+                    self._ensure_rows(max(rows.values()) + 1)
+                results = [
+                    np.array(self._vectors[rows[key]]) if key in rows else None
+                    for key in keys
+                ]
+                self._conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in rows],
+                )
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+            found = sum(key in rows for key in keys)
+            self.hits += found
+            self.misses += len(keys) - found
+
+        return results
+
+    def put_many(self, texts: list, vectors: list):
+        """Stores the embeddings of texts, evicting the least recently used entries when the cache is full.
+
+        Args:
+            texts (list): The embedded texts.
+            vectors (list): The embedding of each text.
+        """
+        entries = dict(zip((text_hash(text) for text in texts), vectors))
+        if not entries:
+            return
+
+        with self._lock:
+            # Rows are allocated in a write transaction, so processes sharing the cache never pick the same ones.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._put(entries)
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+    def _put(self, entries: dict):
+        """Stores the entries, within the write transaction of `put_many`."""
+        self.dim = self._stored_dim()
+        if self.dim is None:
+            self.dim = len(next(iter(entries.values())))
+            self._conn.execute(
+                "INSERT INTO meta (name, value) VALUES ('dim', ?)", (self.dim,)
+            )
+
+        # Skip texts another caller stored in the meantime.
+        existing = self._lookup(list(entries))
+        new_keys = [key for key in entries if key not in existing][-self.max_entries :]
+        if not new_keys:
+            return
+
+        # Rows are kept contiguous: new entries take the next free rows, or the rows of evicted entries.
+        used = self._conn.execute(
+            "SELECT COALESCE(MAX(row) + 1, 0) FROM entries"
+        ).fetchone()[0]
+        free_rows = list(range(used, min(used + len(new_keys), self.max_entries)))
+        n_evict = len(new_keys) - len(free_rows)
+        if n_evict > 0:
+            evicted = self._conn.execute(
+                "SELECT key, row FROM entries ORDER BY last_used LIMIT ?",
+                (n_evict,),
+            ).fetchall()
+            self._conn.executemany(
+                "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted]
+            )
+            free_rows.extend(row for _, row in evicted)
+
+        if max(free_rows) >= self._capacity:
+            self._ensure_rows(
+                min(
+                    max(2 * self._capacity, 1024, max(free_rows) + 1),
+                    self.max_entries,
+                )
+            )
+
+        now = time.time()
+        for key, row in zip(new_keys, free_rows):
+            self._vectors[row] = np.asarray(entries[key], dtype=np.float32)
+        self._vectors.flush()
+        self._conn.executemany(
+            "INSERT INTO entries (key, row, last_used) VALUES (?, ?, ?)",
+            [(key, row, now) for key, row in zip(new_keys, free_rows)],
+        )
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of this cache instance and the number of cached vectors."""
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def open_cache(model_name: str, directory: str = CACHE_DIRECTORY) -> EmbeddingCache:
+    """Returns the cache of a model, opened once per process so its users share one connection and mapping."""
+    return EmbeddingCache(model_name, directory)
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain embeddings that only call the wrapped model for texts missing from the cache.
+
+    Args:
+        embeddings (Embeddings): The embedding model to wrap, e.g. `OpenAIEmbeddings()`.
+        cache (EmbeddingCache, optional): The cache to use. Defaults to a cache named after the model.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache = None):
+        self.embeddings = embeddings
+        self.cache = cache or open_cache(getattr(embeddings, "model", "embeddings"))
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            with span("embed.request"):
+                computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+
+        return [list(map(float, vector)) for vector in vectors]
+
+    def embed_query(self, text: str) -> list:
+        (vector,) = self.cache.get_many([text])
+        if vector is None:
+            with span("embed.query"):
+                vector = self.embeddings.embed_query(text)
+            self.cache.put_many([text], [vector])
+        return list(map(float, vector))
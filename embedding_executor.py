@@ -0,0 +1,210 @@
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from instrumentation import count, span
+
+
+class RateBudget:
+    """Sliding one-minute budget of requests and tokens shared by concurrent callers.
+
+    Args:
+        tokens_per_minute (int): Maximum number of tokens sent per minute.
+        requests_per_minute (int): Maximum number of requests sent per minute.
+    """
+
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Blocks until a request of `tokens` tokens fits in the budget of the last minute, then records it."""
+        # A single request larger than the whole budget can only ever be sent on an empty minute.
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0][0] >= 60:
+                    self._sent.popleft()
+
+                used = sum(sent for _, sent in self._sent)
+                if (
+                    len(self._sent) < self.requests_per_minute
+                    and used + tokens <= self.tokens_per_minute
+                ):
+                    self._sent.append((now, tokens))
+                    return
+                wait = 60 - (now - self._sent[0][0])
+            time.sleep(min(max(wait, 0.01), 1.0))
+
+
+def retry_after(error: Exception) -> float:
+    """Returns the delay in seconds requested by the Retry-After header of a failed API call, if any.
+
+    The header holds either a number of seconds or an HTTP date.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class BatchedEmbeddings(Embeddings):
+    """Embeds many texts in token-aware batches, with several batches in flight under a TPM/RPM budget.
+
+    Texts are grouped into batches of at most `max_batch_tokens` tokens (counted with tiktoken) and
+    `max_batch_size` texts. Up to `max_concurrency` batches are sent at the same time, each waiting on the
+    shared rate budget first. Failed batches (e.g. HTTP 429) are retried with exponential backoff and
+    jitter, honoring Retry-After.
+
+    When a cache is given, texts that are already cached are not sent, and every batch is written to the
+    cache as soon as it completes. The cache thereby checkpoints the work: when a run fails, the next run
+    only embeds the batches that did not complete.
+
+    Throughput counters are kept in `metrics`.
+
+    Args:
+        embeddings (Embeddings): The embedding model to call, e.g. `OpenAIEmbeddings()`.
+        cache (EmbeddingCache, optional): Cache used to skip and checkpoint embedded texts.
+        max_batch_tokens (int): Maximum number of tokens per request.
+        max_batch_size (int): Maximum number of texts per request.
+        max_concurrency (int): Maximum number of requests in flight.
+        tokens_per_minute (int): Token rate limit of the API.
+        requests_per_minute (int): Request rate limit of the API.
+        max_retries (int): Maximum number of retries of a failed batch.
+        encoding (str): tiktoken encoding used to count tokens.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache=None,
+        max_batch_tokens: int = 100_000,
+        max_batch_size: int = 512,
+        max_concurrency: int = 4,
+        tokens_per_minute: int = 1_000_000,
+        requests_per_minute: int = 3_000,
+        max_retries: int = 6,
+        encoding: str = "cl100k_base",
+    ):
+        import tiktoken
+
+        self.embeddings = embeddings
+        self.cache = cache
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.budget = RateBudget(tokens_per_minute, requests_per_minute)
+        self._encoding = tiktoken.get_encoding(encoding)
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            "texts": 0,
+            "cached": 0,
+            "tokens": 0,
+            "requests": 0,
+            "retries": 0,
+            "seconds": 0.0,
+        }
+
+    def batches(self, texts: list) -> list:
+        """Groups the indices of `texts` into batches within the token and size limits."""
+        batches, batch, batch_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            tokens = len(self._encoding.encode(text, disallowed_special=()))
+            if batch and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or len(batch) >= self.max_batch_size
+            ):
+                batches.append((batch, batch_tokens))
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append((batch, batch_tokens))
+        return batches
+
+    def _embed_batch(self, texts: list, tokens: int) -> list:
+        """Sends one batch, retrying with exponential backoff, and checkpoints the result to the cache."""
+        for attempt in range(self.max_retries + 1):
+            self.budget.acquire(tokens)
+            try:
+                with span("embed.request"):
+                    vectors = self.embeddings.embed_documents(texts)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = min(60, 2**attempt) * (0.5 + random.random())
+                print(f"Embedding batch failed ({e}), retrying in {delay:.1f} s")
+                with self._metrics_lock:
+                    self.metrics["retries"] += 1
+                time.sleep(delay)
+
+        if self.cache is not None:
+            self.cache.put_many(texts, vectors)
+        with self._metrics_lock:
+            self.metrics["requests"] += 1
+            self.metrics["tokens"] += tokens
+        count("embed.tokens", tokens)
+        return vectors
+
+    def embed_documents(self, texts: list) -> list:
+        start = time.perf_counter()
+        vectors = (
+            self.cache.get_many(texts)
+            if self.cache is not None
+            else [None] * len(texts)
+        )
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        missing_texts = [texts[i] for i in missing]
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [
+                (
+                    batch,
+                    executor.submit(
+                        self._embed_batch, [missing_texts[i] for i in batch], tokens
+                    ),
+                )
+                for batch, tokens in self.batches(missing_texts)
+            ]
+            for batch, future in futures:
+                for i, vector in zip(batch, future.result()):
+                    vectors[missing[i]] = vector
+
+        with self._metrics_lock:
+            self.metrics["texts"] += len(texts)
+            self.metrics["cached"] += len(texts) - len(missing)
+            self.metrics["seconds"] += time.perf_counter() - start
+        return [list(map(float, vector)) for vector in vectors]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    def throughput(self) -> dict:
+        """Returns the counters in `metrics` along with the tokens and texts embedded per second."""
+        metrics = dict(self.metrics)
+        seconds = metrics["seconds"] or 1e-9
+        metrics["tokens_per_second"] = metrics["tokens"] / seconds
+        metrics["texts_per_second"] = metrics["texts"] / seconds
+        return metrics
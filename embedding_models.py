@@ -0,0 +1,41 @@
+import os
+
+import dotenv
+
+# Load .env
+dotenv.load_dotenv()
+
+# The embedding model of the vector database and the queries can be set in .env: EMBEDDING_MODEL is 'openai'
+# (default) or 'onnx', a local sentence-transformers model quantized to int8 and run with onnxruntime on
+# the CPU, which takes the round trip to the OpenAI API out of every question. ONNX_THREADS is the number
+# of CPU threads of the local model (0 lets onnxruntime pick). Run `python onnx_embeddings.py --export`
+# once to export the local model, then rebuild the index.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "openai")
+
+
+def index_suffix(model: str = EMBEDDING_MODEL) -> str:
+    """Returns the suffix of the vector store and manifest paths of a model.
+
+    Vectors of different models cannot be compared, so every model but the default one gets its own index.
+    """
+    return "" if model == "openai" else f"_{model}"
+
+
+def create_embeddings(model: str = EMBEDDING_MODEL):
+    """Creates the embedding model selected by the EMBEDDING_MODEL setting.
+
+    Args:
+        model (str): 'openai' or 'onnx', overriding the EMBEDDING_MODEL setting.
+
+    Returns:
+        Embeddings: The LangChain embeddings, with the name of the model in `model`.
+    """
+    if model == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings()
+    if model == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings(threads=int(os.getenv("ONNX_THREADS", 0)))
+    raise ValueError(f"Unknown embedding model: {model}")
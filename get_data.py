@@ -1,40 +1,65 @@
 ### Get top papers
-import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup, SoupStrainer
 import re
-from langchain_community.retrievers import ArxivRetriever
+from http_client import HttpCache, RateLimiter, create_session, fetch
+from arxiv_api import fetch_arxiv_metadata
 from database import insert_or_update_database
+from indexing import (
+    MANIFEST_PATH,
+    get_arxiv_id,
+    publish_index_version,
+    update_vector_database,
+)
+from instrumentation import count, print_report, save_report, span
 import json
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
+import os
 
+# The LangChain, OpenAI and Chroma imports of the indexing functions are done on first use, so scraping
+# the paper metadata does not pay for them.
 
-def scrape_paper_metadata() -> list:
+PAPERSWITHCODE_URL = "https://paperswithcode.com/"
+
+# The arXiv link of a paper page never changes once it is published, so it is looked up only once.
+ARXIV_LINKS_PATH = "data/arxiv_links.json"
+
+# Only the links of the pages are used, so only the 'a' tags are parsed, with the faster lxml parser.
+ONLY_LINKS = SoupStrainer("a")
+ONLY_ARXIV_PDF_LINKS = SoupStrainer("a", href=re.compile(r"https://arxiv\.org/pdf"))
+
+
+def scrape_paper_metadata(
+    url: str = PAPERSWITHCODE_URL, session=None, rate_limiter=None, cache=None
+) -> list:
     """Scrape the trending papers' metadata from the front page of paperswithcode.com.
 
+    Args:
+        url (str): url of the page listing the trending papers
+        session (requests.Session, optional): pooled HTTP session to send the request with
+        rate_limiter (RateLimiter, optional): per-host rate limiter to wait on before the request
+        cache (HttpCache, optional): HTTP cache revalidating the page with a conditional request
+
     Returns:
         list: A list of dictionaries, each containing the 'url' and 'title' of a paper.
     """
-    # URL to scrape
-    url = "https://paperswithcode.com/"
+    unique_papers = []
+    titles = []
 
     # Make an HTTP GET request to the URL
-    response = requests.get(url)
+    response = fetch(url, session, rate_limiter, cache=cache)
 
     # Ensure the request was successful (HTTP status code 200)
     if response.status_code == 200:
-        # Parse the HTML content of the page using Beautiful Soup
-        soup = BeautifulSoup(response.text, "html.parser")
+        # Parse the links of the page using Beautiful Soup
+        with span("http.parse"):
+            soup = BeautifulSoup(response.content, "lxml", parse_only=ONLY_LINKS)
 
         # Use Beautiful Soup methods to find data in the soup object
         # Find all 'a' tags (hyperlinks) in the document:
         a_tags = soup.find_all("a")
 
         pattern = r"\/paper\/(?!.*(#code|#tasks)$).*$"
-        unique_papers = []
-        titles = []
 
         for tag in a_tags:
             href = tag.get("href")
@@ -50,39 +75,33 @@ def scrape_paper_metadata() -> list:
 
     paper_metadata = []
     for paper, title in zip(unique_papers, titles):
-        paper_metadata.append(
-            {"url": "https://paperswithcode.com" + paper, "title": title}
-        )
+        paper_metadata.append({"url": urljoin(url, paper), "title": title})
 
     return paper_metadata
 
 
-def get_arxiv_link(url: str) -> str:
+def get_arxiv_link(url: str, session=None, rate_limiter=None, cache=None) -> str:
     """Get the link to the pdf of the research article
 
     Args:
         url (str): url of trending paper on paperswith code
+        session (requests.Session, optional): pooled HTTP session to send the request with
+        rate_limiter (RateLimiter, optional): per-host rate limiter to wait on before the request
+        cache (HttpCache, optional): HTTP cache revalidating the page with a conditional request
 
     Returns:
         str: the arxiv_link
     """
     pdf_link = None
-    response = requests.get(url)
+    response = fetch(url, session, rate_limiter, cache=cache)
 
     if response.status_code == 200:
-        # Parse the HTML content of the page using Beautiful Soup
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # Define a function that checks if an 'a' tag's 'href' attribute contains the arXiv PDF URL
-        def is_arxiv_pdf(tag):
-            return (
-                tag.name == "a"
-                and tag.get("href")
-                and "https://arxiv.org/pdf" in tag.get("href")
+        # Parse only the 'a' tags whose 'href' attribute contains the arXiv PDF URL
+        with span("http.parse"):
+            soup = BeautifulSoup(
+                response.content, "lxml", parse_only=ONLY_ARXIV_PDF_LINKS
             )
-
-        # Use the function to filter 'a' tags
-        links = soup.find_all(is_arxiv_pdf)
+        links = soup.find_all("a")
 
         # Print the 'href' attribute of each link
         for link in links:
@@ -93,34 +112,129 @@ def get_arxiv_link(url: str) -> str:
     return pdf_link
 
 
-def get_paper_info() -> list:
-    # Initialize an ArxivRetriever object to fetch documents from arXiv.
-    # The `load_max_docs=1` argument indicates that for each query, only one document should be loaded.
-    retriever = ArxivRetriever(load_max_docs=1)
+def load_arxiv_links(path: str = ARXIV_LINKS_PATH) -> dict:
+    """Loads the memo mapping the url of each paper page to its arXiv link."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
 
-    # Call the scrape_paper_metadata function to obtain the list of trending papers' metadata from paperswithcode.com.
-    paper_metadata = scrape_paper_metadata()
 
-    # Iterate over each paper's metadata in the list.
-    for data in paper_metadata:
-        # Retrieve the arXiv PDF link for the paper and add it to the paper's metadata.
-        data["arxiv_link"] = get_arxiv_link(data["url"])
+def save_arxiv_links(links: dict, path: str = ARXIV_LINKS_PATH):
+    """Writes the arXiv link memo atomically."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(links, file, indent=4)
+    os.replace(tmp_path, path)
 
-        # Extract the document number from the arXiv link. This assumes the arXiv link format ends with
-        # a document number followed by ".pdf" and uses string manipulation to extract this number.
-        doc_num = data["arxiv_link"].split("/")[-1][:-4]
 
-        # Use the ArxivRetriever object to load the document from arXiv using the extracted document number.
-        # This step fetches the document's metadata from arXiv.
-        docs = retriever.load(query=doc_num)
+def get_arxiv_links(
+    paper_metadata: list,
+    max_workers: int = 8,
+    session=None,
+    rate_limiter=None,
+    cache=None,
+    memo_path: str = None,
+) -> list:
+    """Get the arXiv pdf links of many papers concurrently.
 
-        # Update the paper's metadata with the published date, authors, and summary extracted from the arXiv document's metadata.
-        data["published"] = docs[0].metadata["Published"]
-        data["authors"] = docs[0].metadata["Authors"]
-        data["summary"] = docs[0].metadata["Summary"]
+    Args:
+        paper_metadata (list): list of paper dictionaries, each containing the 'url' of the paper on paperswithcode
+        max_workers (int): maximum number of paper pages fetched at the same time
+        session (requests.Session, optional): pooled HTTP session shared by all requests
+        rate_limiter (RateLimiter, optional): per-host rate limiter shared by all requests
+        cache (HttpCache, optional): HTTP cache revalidating the pages with conditional requests
+        memo_path (str, optional): path of the memo of the links found by earlier runs; the pages of papers
+            in the memo are not fetched, and the links found are added to it
+
+    Returns:
+        list: the arxiv_link of each paper, in the same order as `paper_metadata`
+    """
+    memo = load_arxiv_links(memo_path) if memo_path else {}
+    urls = [data["url"] for data in paper_metadata]
+    missing = [url for url in dict.fromkeys(urls) if url not in memo]
+    count("http.memo_hits", len(urls) - len(missing))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        found = executor.map(
+            lambda url: get_arxiv_link(url, session, rate_limiter, cache), missing
+        )
+        links = dict(zip(missing, found))
+
+    # Pages without a link are looked up again next time, the link may be added later.
+    if memo_path and any(links.values()):
+        memo.update({url: link for url, link in links.items() if link})
+        save_arxiv_links(memo, memo_path)
+    return [memo.get(url) or links.get(url) for url in urls]
+
+
+def get_paper_info(
+    max_workers: int = 8,
+    requests_per_second: float = 10.0,
+    url: str = PAPERSWITHCODE_URL,
+) -> list:
+    """Scrape the trending papers and collect their arXiv links and metadata.
+
+    Paper pages are fetched concurrently over a pooled HTTP session and the arXiv metadata of all papers
+    is resolved with bulk arXiv API requests. Every request waits on a per-host rate limiter and failed
+    requests are retried with exponential backoff. Pages are revalidated against the HTTP cache in
+    data/http_cache, and the arXiv links of papers seen before are read from data/arxiv_links.json.
+
+    Args:
+        max_workers (int): maximum number of requests in flight at the same time
+        requests_per_second (float): maximum request rate per host
+        url (str): url of the page listing the trending papers
+
+    Returns:
+        list: the metadata of each paper, as saved to data/paper_metadata.json
+    """
+    session = create_session(pool_size=max_workers)
+    # The arXiv API asks clients to wait 3 seconds between requests.
+    rate_limiter = RateLimiter(
+        requests_per_second, host_limits={"export.arxiv.org": 1 / 3}
+    )
+    # Pages that did not change since the last run are answered with 304 Not Modified.
+    cache = HttpCache()
+
+    # Call the scrape_paper_metadata function to obtain the list of trending papers' metadata from paperswithcode.com.
+    paper_metadata = scrape_paper_metadata(url, session, rate_limiter, cache)
+
+    # Retrieve the arXiv PDF link for every paper and add it to the paper's metadata. The pages of papers
+    # seen by earlier runs are not fetched again.
+    arxiv_links = get_arxiv_links(
+        paper_metadata,
+        max_workers,
+        session,
+        rate_limiter,
+        cache,
+        memo_path=ARXIV_LINKS_PATH,
+    )
+    for data, arxiv_link in zip(paper_metadata, arxiv_links):
+        data["arxiv_link"] = arxiv_link
+
+    # Papers whose page has no arXiv link yet are left out of this run; their page is fetched again next time.
+    for data in paper_metadata:
+        if data["arxiv_link"] is None:
+            print(f"No arXiv link found for {data['url']}")
+    paper_metadata = [data for data in paper_metadata if data["arxiv_link"] is not None]
+
+    # Extract the document number from the arXiv link. This assumes the arXiv link format ends with
+    # a document number followed by ".pdf" and uses string manipulation to extract this number.
+    doc_nums = [data["arxiv_link"].split("/")[-1][:-4] for data in paper_metadata]
+
+    # Fetch the published date, authors, and summary of every paper from arXiv in bulk requests.
+    arxiv_metadata = fetch_arxiv_metadata(doc_nums, session, rate_limiter)
+    for data, doc_num in zip(paper_metadata, doc_nums):
+        if doc_num not in arxiv_metadata:
+            print(f"No arXiv metadata found for {doc_num}")
+        data.update(
+            arxiv_metadata.get(
+                doc_num, {"published": None, "authors": None, "summary": None}
+            )
+        )
 
-    # The following line would insert or update the obtained metadata into a database.
-    # insert_or_update_database(paper_metadata) # Uncomment to use!
+    # Insert or update the obtained metadata in the paper database and record this trending snapshot.
+    insert_or_update_database(paper_metadata)
 
     # Specify the filename
     filename = "data/paper_metadata.json"
@@ -130,47 +244,115 @@ def get_paper_info() -> list:
         json.dump(paper_metadata, file, indent=4)
 
     print("Metadata saved!")
-    # return paper_metadata
+    return paper_metadata
 
 
-def create_vector_database():
-    # Specify the filename
-    filename = "data/paper_metadata.json"
+def load_paper_chunks(
+    papers: list,
+    max_workers: int = 8,
+    parse_workers: int = None,
+    backend: str = "pypdf",
+):
+    """Download the pdfs of papers and split them into chunks for the vector database.
 
-    # Write the dictionary to a file
-    with open(filename, "r") as file:
-        paper_metadata = json.load(file)
+    Pdfs are downloaded concurrently into the local pdf cache and parsed in a process pool, and each
+    paper is split as soon as its pages are ready, so only the pages of one paper are held at a time.
+    Chunks are sized in tokens along the sections of the paper, without its references and boilerplate,
+    see chunking.py.
+
+    Args:
+        papers (list): the metadata of the papers, as saved to data/paper_metadata.json
+        max_workers (int): maximum number of pdfs downloaded at the same time
+        parse_workers (int, optional): number of pdf parsing processes, defaults to the number of CPUs
+        backend (str): pdf parser, 'pypdf' or the faster 'pymupdf'
+
+    Yields:
+        tuple: the paper and the list of its chunk documents, each carrying the paper's metadata
+    """
+    from chunking import PaperSplitter
+    from pdf_ingest import load_pdfs
+
+    # Text splitting
+    text_splitter = PaperSplitter(chunk_tokens=192, overlap_tokens=24)
 
-    # Indexing
-    docs = []
-    for paper in paper_metadata:
-        link = paper["arxiv_link"]
-        loader = PyPDFLoader(link)
-        doc = loader.load_and_split()
+    for paper, doc in load_pdfs(papers, max_workers, parse_workers, backend):
         for idoc in doc:
+            idoc.metadata["arxiv_id"] = get_arxiv_id(paper)
             idoc.metadata["title"] = paper["title"]
             idoc.metadata["published"] = paper["published"]
             idoc.metadata["authors"] = paper["authors"]
             idoc.metadata["summary"] = paper["summary"]
-        docs.extend(doc)
+        with span("index.split"):
+            chunks = text_splitter.split_documents(doc)
+        count("index.chunks", len(chunks))
+        yield paper, chunks
 
-    # Text splitting
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    splits = text_splitter.split_documents(docs)
 
-    # Embed and store the texts
-    # Supplying a persist dicrectory will store the embeddings on disk
-    persist_directory = "data/vectordb"
+def create_vector_database(
+    max_workers: int = 8, parse_workers: int = None, pdf_backend: str = "pypdf"
+):
+    """Index the pdfs of the papers in data/paper_metadata.json into the vector database.
 
-    embeddings = OpenAIEmbeddings()
-    # vectordb = Chroma.from_documents(documents=splits, embedding=embeddings, persist_directory=persist_direcory)
-    Chroma.from_documents(
-        documents=splits, embedding=embeddings, persist_directory=persist_directory
-    ).persist()
-    # vectordb.persist()
-    print("Vector database saved!")
+    Args:
+        max_workers (int): maximum number of pdfs downloaded at the same time
+        parse_workers (int, optional): number of pdf parsing processes, defaults to the number of CPUs
+        pdf_backend (str): pdf parser, 'pypdf' or the faster 'pymupdf'
+    """
+    from embedding_cache import open_cache
+    from embedding_executor import BatchedEmbeddings
+    from embedding_models import create_embeddings
+    from vectorstore import VECTOR_STORE, get_vectorstore, vectorstore_exists
+
+    # Specify the filename
+    filename = "data/paper_metadata.json"
+
+    # Write the dictionary to a file
+    with open(filename, "r") as file:
+        paper_metadata = json.load(file)
+
+    # The manifest describes the contents of the persisted store, so start over if the store is gone.
+    if not vectorstore_exists() and os.path.exists(MANIFEST_PATH):
+        os.remove(MANIFEST_PATH)
+
+    # Embed and store the texts in the vector store selected by the VECTOR_STORE setting, with the model
+    # selected by the EMBEDDING_MODEL setting.
+    # Chunks are embedded in token-aware batches, several at a time within the API rate limits. Chunks
+    # embedded by earlier runs, including runs that failed halfway, are served from the embedding cache.
+    base_embeddings = create_embeddings()
+    embeddings = BatchedEmbeddings(
+        base_embeddings, cache=open_cache(base_embeddings.model)
+    )
+    vectordb = get_vectorstore(embeddings)
+
+    # Only new or changed papers are downloaded, split and embedded; papers no longer trending are removed.
+    stats = update_vector_database(
+        paper_metadata,
+        vectordb,
+        lambda papers: load_paper_chunks(
+            papers, max_workers, parse_workers, pdf_backend
+        ),
+        vector_store=VECTOR_STORE,
+    )
+    # The abstracts are embedded with the same model and batches, once per paper, so the 'abstracts'
+    # embedding artifact and topic modeling read them from the embedding cache (see embedding_artifacts.py).
+    with span("index.abstracts"):
+        embeddings.embed_documents(
+            [paper["summary"] for paper in paper_metadata if paper.get("summary")]
+        )
+    publish_index_version()
+    print(
+        f"Vector database saved! Papers: {stats['indexed']} indexed, {stats['skipped']} unchanged, "
+        f"{stats['removed']} removed. Chunks: {stats['added']} added, {stats['deleted']} deleted."
+    )
+    print(f"Embedding cache: {embeddings.cache.stats()}")
+    print(f"Embedding throughput: {embeddings.throughput()}")
 
 
 if __name__ == "__main__":
+    from embedding_artifacts import build_embedding_artifacts
+
     get_paper_info()
     create_vector_database()
+    build_embedding_artifacts()
+    print_report()
+    save_report()
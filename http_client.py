@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from instrumentation import count, span
+
+HTTP_CACHE_DIRECTORY = "data/http_cache"
+
+
+class RateLimiter:
+    """Spaces out requests so that no single host receives more than a fixed number of requests per second.
+
+    Each host keeps its own schedule, so a slow host never blocks requests to a different one.
+
+    Args:
+        requests_per_second (float): Default request rate allowed for every host.
+        host_limits (dict, optional): Per-host overrides of the request rate, e.g. {"export.arxiv.org": 0.33}.
+    """
+
+    def __init__(self, requests_per_second: float = 10.0, host_limits: dict = None):
+        self.requests_per_second = requests_per_second
+        self.host_limits = host_limits or {}
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        """Blocks until a request to the host of `url` is allowed."""
+        host = urlparse(url).netloc
+        rate = self.host_limits.get(host, self.requests_per_second)
+        if not rate or rate <= 0:
+            return
+
+        # Reserve the next free slot for this host while holding the lock, then sleep outside of it.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1.0 / rate
+
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def create_session(
+    pool_size: int = 16, retries: int = 3, backoff_factor: float = 0.5
+) -> requests.Session:
+    """Creates an HTTP session with a shared connection pool and automatic retries.
+
+    Failed requests (connection errors and HTTP 429/5xx responses) are retried with exponential
+    backoff, honoring any Retry-After header sent by the server.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections kept open per host.
+        retries (int): Maximum number of retries for a single request.
+        backoff_factor (float): Base delay in seconds of the exponential backoff between retries.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HttpCache:
+    """Local store of fetched pages, revalidated with conditional requests.
+
+    Responses carrying an ETag or Last-Modified header are saved as `<sha256 of the url>.body`, and
+    `index.json` maps every url to its validators, content type and encoding. The next request of a cached
+    url sends them as If-None-Match/If-Modified-Since, and a 304 Not Modified answer is served from the
+    store without transferring the page again. Responses without validators are not stored.
+
+    Args:
+        directory (str): Directory holding the pages and the index.
+    """
+
+    def __init__(self, directory: str = HTTP_CACHE_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+
+        self.index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as file:
+                self.index = json.load(file)
+
+    def _path(self, url: str) -> str:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.body")
+
+    def conditional_headers(self, url: str) -> dict:
+        """Returns the headers revalidating the cached copy of `url`, or no headers if it is not cached."""
+        entry = self.index.get(url)
+        if entry is None or not os.path.exists(self._path(url)):
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def get(self, url: str) -> requests.Response:
+        """Rebuilds the cached response of `url`, as a 200 response."""
+        entry = self.index[url]
+        with open(self._path(url), "rb") as file:
+            content = file.read()
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(
+            {"Content-Type": entry.get("content_type") or ""}
+        )
+        response.encoding = entry.get("encoding")
+        response._content = content
+        return response
+
+    def put(self, url: str, response: requests.Response):
+        """Stores a 200 response if it carries validators, and forgets the cached copy otherwise."""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            if url in self.index:
+                with self._lock:
+                    self.index.pop(url, None)
+                    self.save()
+            return
+
+        # Write to a temporary file first so a failed write never leaves a partial page in the cache.
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as file:
+            file.write(response.content)
+        os.replace(file.name, self._path(url))
+
+        with self._lock:
+            self.index[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "content_type": response.headers.get("Content-Type"),
+                "encoding": response.encoding,
+            }
+            self.save()
+
+    def save(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.index, file, indent=4)
+        os.replace(tmp_path, self._index_path)
+
+
+def fetch(
+    url: str,
+    session: requests.Session = None,
+    rate_limiter: RateLimiter = None,
+    timeout: float = 30,
+    cache: HttpCache = None,
+) -> requests.Response:
+    """Sends a GET request, waiting for the host's rate limit first.
+
+    Args:
+        url (str): The URL to fetch.
+        session (requests.Session, optional): Session to send the request with. Falls back to `requests.get`.
+        rate_limiter (RateLimiter, optional): Rate limiter to wait on before sending the request.
+        timeout (float): Timeout of the request in seconds.
+        cache (HttpCache, optional): Cache to revalidate with a conditional request; a 304 answer
+            returns the cached page.
+
+    Returns:
+        requests.Response: The response of the server, or the cached page if it was not modified.
+    """
+    if rate_limiter is not None:
+        rate_limiter.wait(url)
+
+    headers = cache.conditional_headers(url) if cache is not None else {}
+    with span("http.fetch", host=urlparse(url).netloc):
+        if session is None:
+            response = requests.get(url, timeout=timeout, headers=headers)
+        else:
+            response = session.get(url, timeout=timeout, headers=headers)
+    count("http.bytes", len(response.content))
+
+    if cache is not None:
+        if response.status_code == 304 and headers:
+            count("http.not_modified")
+            return cache.get(url)
+        if response.status_code == 200:
+            cache.put(url, response)
+    return response
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import uuid
+
+from arxiv_api import strip_version
+from embedding_models import index_suffix
+from instrumentation import span
+
+MANIFEST_PATH = f"data/index_manifest{index_suffix()}.json"
+INDEX_VERSION_PATH = f"data/index_version{index_suffix()}"
+# Vector store backends that write every change to disk as it is made; the others only on `persist()`.
+WRITE_THROUGH_STORES = {"chroma"}
+# Bump when the way papers are split into chunks changes, so every paper is split and indexed again.
+CHUNKING_VERSION = 4
+
+
+def get_arxiv_id(paper: dict) -> str:
+    """Get the versionless arXiv identifier of a paper from its arXiv pdf link, or None if it has no link."""
+    if not paper.get("arxiv_link"):
+        return None
+    return strip_version(paper["arxiv_link"].split("/")[-1].removesuffix(".pdf"))
+
+
+def paper_hash(paper: dict) -> str:
+    """Hashes the fields of a paper that end up in its indexed chunks.
+
+    The arXiv link carries the version of the paper, so a new version of the pdf changes the hash too.
+    """
+    fields = {
+        key: paper.get(key)
+        for key in ("arxiv_link", "title", "published", "authors", "summary")
+    }
+    fields["chunking"] = CHUNKING_VERSION
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def chunk_id(arxiv_id: str, chunk) -> str:
+    """Builds a content-addressed identifier for a chunk from its text and metadata."""
+    content = json.dumps([chunk.page_content, chunk.metadata], sort_keys=True)
+    return f"{arxiv_id}-{hashlib.sha256(content.encode()).hexdigest()[:16]}"
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """Loads the index manifest, or an empty manifest if none has been written yet.
+
+    The manifest maps the arXiv identifier of every indexed paper to the hash of the paper and the
+    identifiers of its chunks in the vector store.
+    """
+    if not os.path.exists(path):
+        return {"papers": {}}
+
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """Writes the index manifest atomically so an interrupted run never leaves a truncated file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(tmp_path, path)
+
+
+def index_version(path: str = INDEX_VERSION_PATH) -> str:
+    """Returns the version of the persisted vector store, or None if no version was published yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return file.read().strip()
+
+
+def publish_index_version(path: str = INDEX_VERSION_PATH):
+    """Gives the vector store a new version, so the RAG chain and the answer cache pick up its changes.
+
+    Call it once the store is persisted: readers rebuilding on a new version must find the new store.
+    """
+    with open(path + ".tmp", "w") as file:
+        file.write(uuid.uuid4().hex)
+    os.replace(path + ".tmp", path)
+
+
+def update_vector_database(
+    paper_metadata: list,
+    vectordb,
+    load_chunks,
+    manifest_path: str = MANIFEST_PATH,
+    vector_store: str = "chroma",
+) -> dict:
+    """Brings a vector store in line with the current list of papers, embedding only what changed.
+
+    Papers without an arXiv link are ignored. Papers whose hash matches the manifest are skipped without
+    downloading their pdf. For new or changed papers, only the chunks whose content-addressed identifier
+    is not indexed yet are embedded and added, and chunks that no longer exist are deleted. Papers that
+    dropped off the list are removed from the store entirely. The store is persisted at the end.
+
+    The manifest never lists more than the persisted store holds. For a write-through store (Chroma) it is
+    saved after every paper, so an interrupted run resumes where it stopped. For the others (FAISS) it is
+    saved once the store is persisted, so an interrupted run starts over from the last persisted store,
+    with the chunks it had already embedded served from the embedding cache.
+
+    Args:
+        paper_metadata (list): the metadata of the current papers, as saved to data/paper_metadata.json
+        vectordb: the vector store to update
+        load_chunks: function taking the list of papers to index and yielding each paper with the list of
+            its chunk documents, in any order
+        manifest_path (str): path of the index manifest
+        vector_store (str): name of the vector store backend; a manifest written for another backend is ignored
+
+    Returns:
+        dict: the number of papers 'skipped', 'indexed' and 'removed' and of chunks 'added' and 'deleted'
+    """
+    manifest = load_manifest(manifest_path)
+    # Manifests written before the backend was recorded describe the Chroma store.
+    if manifest.get("vector_store", "chroma") != vector_store:
+        manifest = {"papers": {}}
+    manifest["vector_store"] = vector_store
+    indexed = manifest["papers"]
+    paper_metadata = [paper for paper in paper_metadata if get_arxiv_id(paper)]
+    stats = {"skipped": 0, "indexed": 0, "removed": 0, "added": 0, "deleted": 0}
+
+    def checkpoint():
+        if vector_store in WRITE_THROUGH_STORES:
+            save_manifest(manifest, manifest_path)
+
+    # Remove the papers that are no longer trending.
+    current_ids = {get_arxiv_id(paper) for paper in paper_metadata}
+    for arxiv_id in list(indexed):
+        if arxiv_id not in current_ids:
+            stale_ids = indexed.pop(arxiv_id)["chunk_ids"]
+            if stale_ids:
+                vectordb.delete(ids=stale_ids)
+            stats["removed"] += 1
+            stats["deleted"] += len(stale_ids)
+    if stats["removed"]:
+        checkpoint()
+
+    # Only papers that are new or changed since the last run need to be loaded.
+    changed = [
+        paper
+        for paper in paper_metadata
+        if indexed.get(get_arxiv_id(paper), {}).get("hash") != paper_hash(paper)
+    ]
+    stats["skipped"] = len(paper_metadata) - len(changed)
+
+    for paper, paper_chunks in load_chunks(changed):
+        arxiv_id = get_arxiv_id(paper)
+        entry = indexed.get(arxiv_id)
+
+        # Key every chunk by its content, dropping duplicate chunks within the paper.
+        chunks = {}
+        for chunk in paper_chunks:
+            chunks.setdefault(chunk_id(arxiv_id, chunk), chunk)
+
+        old_ids = set(entry["chunk_ids"]) if entry is not None else set()
+        new_ids = [id for id in chunks if id not in old_ids]
+        stale_ids = [id for id in old_ids if id not in chunks]
+
+        if new_ids:
+            # Embeds the new chunks and writes them to the store.
+            with span("index.add"):
+                vectordb.add_documents([chunks[id] for id in new_ids], ids=new_ids)
+        if stale_ids:
+            vectordb.delete(ids=stale_ids)
+
+        indexed[arxiv_id] = {
+            "hash": paper_hash(paper),
+            "arxiv_link": paper["arxiv_link"],
+            "chunk_ids": list(chunks),
+        }
+        checkpoint()
+
+        stats["indexed"] += 1
+        stats["added"] += len(new_ids)
+        stats["deleted"] += len(stale_ids)
+
+    vectordb.persist()
+    save_manifest(manifest, manifest_path)
+    return stats
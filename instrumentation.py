@@ -0,0 +1,285 @@
+import argparse
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Spans and metrics are kept in-process and cost a perf_counter call and a lock each. When
+# OTEL_EXPORTER_OTLP_ENDPOINT is set, spans are also exported with the OpenTelemetry SDK.
+
+METRICS_PATH = "data/metrics.json"
+
+
+def percentile(values: list, q: float) -> float:
+    """Returns the `q` quantile of sorted values, e.g. q=0.95 for the p95, as the value of rank q * (n - 1).
+
+    Every latency report (metrics, benchmarks, batch runs) picks its percentiles with this rule, so their
+    numbers are comparable.
+    """
+    return values[round(q * (len(values) - 1))]
+
+
+class Histogram:
+    """Distribution of the values of one metric, e.g. the seconds of a span.
+
+    The last `max_samples` values are kept for the percentiles; the count and total cover every value.
+
+    Args:
+        unit (str): Unit of the values, 's' for seconds or e.g. 'tokens'.
+        max_samples (int): Number of recent values kept.
+    """
+
+    def __init__(self, unit: str = "s", max_samples: int = 10_000):
+        self.unit = unit
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self) -> dict:
+        """Returns the count, total, mean, p50, p95, p99 and max of the values."""
+        values = sorted(self.samples)
+        if not values:
+            return {"unit": self.unit, "count": 0, "total": 0.0}
+
+        return {
+            "unit": self.unit,
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": values[-1],
+        }
+
+
+class Metrics:
+    """Thread-safe registry of the histograms and counters of a process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name: str, value: float, unit: str = "s"):
+        """Adds a value to the histogram `name`."""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(unit)
+            histogram.add(value)
+
+    def count(self, name: str, value: float = 1):
+        """Adds `value` to the counter `name`."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        """Returns the summary of every histogram and the value of every counter."""
+        with self._lock:
+            return {
+                "histograms": {
+                    name: histogram.summary()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+METRICS = Metrics()
+
+
+@functools.lru_cache(maxsize=None)
+def get_tracer():
+    """Returns an OpenTelemetry tracer exporting over OTLP, or None if OTEL_EXPORTER_OTLP_ENDPOINT is not set."""
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        print(f"OpenTelemetry export disabled: {e}")
+        return None
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": "trending-papers"})
+    )
+    # The endpoint and headers are read from the standard OTEL_EXPORTER_OTLP_* variables.
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer("trending-papers")
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Times a block of code into the histogram `name`, and exports it as a span if OpenTelemetry is on.
+
+    Args:
+        name (str): Name of the span, e.g. 'http.fetch'.
+        **attributes: Attributes of the exported span, e.g. the host of a request.
+    """
+    tracer = get_tracer()
+    start = time.perf_counter()
+    if tracer is None:
+        try:
+            yield
+        finally:
+            METRICS.observe(name, time.perf_counter() - start)
+        return
+
+    with tracer.start_as_current_span(name, attributes=attributes):
+        try:
+            yield
+        finally:
+            METRICS.observe(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """Decorator timing every call of a function as a span named `name`."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def observe(name: str, value: float, unit: str = "s"):
+    """Adds a value, e.g. a duration measured elsewhere or a token count, to the histogram `name`."""
+    METRICS.observe(name, value, unit)
+
+
+def count(name: str, value: float = 1):
+    """Adds `value` to the counter `name`, e.g. the number of tokens sent to a model."""
+    METRICS.count(name, value)
+
+
+def llm_timing_callback():
+    """Returns a LangChain callback handler recording the time to first token and total time of LLM calls.
+
+    The handler observes 'llm.first_token' (only for streamed calls) and 'llm.total', and counts the prompt
+    and completion tokens reported by the model, or the streamed tokens when no usage is reported.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMTimingHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.runs = {}
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self.runs[run_id] = {"start": time.perf_counter(), "tokens": 0}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self.runs[run_id] = {"start": time.perf_counter(), "tokens": 0}
+
+        def on_llm_new_token(self, token, *, run_id, **kwargs):
+            run = self.runs.get(run_id)
+            if run is None:
+                return
+            if run["tokens"] == 0:
+                observe("llm.first_token", time.perf_counter() - run["start"])
+            run["tokens"] += 1
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            run = self.runs.pop(run_id, None)
+            if run is None:
+                return
+            observe("llm.total", time.perf_counter() - run["start"])
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            if usage:
+                count("llm.prompt_tokens", usage.get("prompt_tokens", 0))
+                count("llm.completion_tokens", usage.get("completion_tokens", 0))
+            else:
+                count("llm.completion_tokens", run["tokens"])
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self.runs.pop(run_id, None)
+            count("llm.errors")
+
+    return LLMTimingHandler()
+
+
+def format_report(snapshot: dict) -> str:
+    """Formats a snapshot of the metrics as a table: durations in milliseconds, other values as they are."""
+    lines = [
+        f"{'metric':28s}{'count':>8s}{'p50':>10s}{'p95':>10s}{'p99':>10s}{'max':>10s}{'total':>12s}"
+    ]
+    for name, summary in snapshot["histograms"].items():
+        if not summary["count"]:
+            continue
+        scale, unit = (1000, "ms") if summary["unit"] == "s" else (1, summary["unit"])
+        values = [summary[key] * scale for key in ("p50", "p95", "p99", "max")]
+        lines.append(
+            f"{name + ' (' + unit + ')':28s}{summary['count']:8d}"
+            + "".join(f"{value:10.1f}" for value in values)
+            + f"{summary['total'] * scale:12.1f}"
+        )
+    for name, value in snapshot["counters"].items():
+        lines.append(f"{name:28s}{'':48s}{value:12,.0f}")
+    return "\n".join(lines)
+
+
+def print_report():
+    """Prints the metrics of this process."""
+    print(format_report(METRICS.snapshot()))
+
+
+def save_report(path: str = METRICS_PATH):
+    """Saves the metrics of this process, replacing the saved metrics of the same names.
+
+    Every command line entry point saves its metrics on exit, so `python instrumentation.py` shows the
+    latest numbers of the scrape, index, topic and RAG stages together.
+    """
+    saved = load_report(path)
+    snapshot = METRICS.snapshot()
+    for key in ("histograms", "counters"):
+        saved[key].update(snapshot[key])
+    saved["updated"] = time.time()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as file:
+        json.dump(saved, file, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def load_report(path: str = METRICS_PATH) -> dict:
+    """Loads the saved metrics, or empty metrics if none were saved."""
+    if not os.path.exists(path):
+        return {"histograms": {}, "counters": {}}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the latency and token metrics saved by the last runs."
+    )
+    parser.add_argument("--reset", action="store_true", help="delete the saved metrics")
+    args = parser.parse_args()
+
+    if args.reset:
+        if os.path.exists(METRICS_PATH):
+            os.remove(METRICS_PATH)
+    else:
+        print(format_report(load_report()))
@@ -1,8 +1,43 @@
-import pickle
 import streamlit as st
-from rag import rag
-from summaries import get_summaries
-from topic_modeling import topic_modeling
+from database import (
+    DATABASE_PATH,
+    count_papers,
+    database_version,
+    get_topics,
+    query_papers,
+)
+from summaries import format_summary
+
+PAGE_SIZE = 10
+
+
+# The paper database only changes when the offline pipeline runs, so query results are kept per process
+# and shared by all reruns and sessions (read-only, without the copy st.cache_data makes on every rerun).
+# The database version is part of the cache key, so a refreshed database is queried again.
+@st.cache_resource
+def load_topics(path: str, version: float) -> list:
+    """Loads the topics found by topic modeling, each with its list of keywords."""
+    return get_topics(path)
+
+
+@st.cache_resource(max_entries=256)
+def load_page(
+    path: str,
+    version: float,
+    page: int,
+    start_date,
+    end_date,
+    topic_id: int,
+    trending: bool,
+) -> tuple:
+    """Loads one page of papers matching the filters, along with the number of matching papers."""
+    filters = dict(
+        start_date=start_date, end_date=end_date, topic_id=topic_id, trending=trending
+    )
+    return (
+        query_papers(page, PAGE_SIZE, path=path, **filters),
+        count_papers(path=path, **filters),
+    )
 
 
 def main():
@@ -26,33 +61,58 @@ def main():
     st.divider()
     st.header("Summaries", anchor="summaries", divider="gray")
 
-    # Keywords from topic modeling
-    filename = "data/topic_data.pkl"
-
-    with open(filename, "rb") as file:
-        topics_dict = pickle.load(file)
-
-    # n_topic_list = topics_dict['n_topic_list']
-    topic_lists = topics_dict["topic_lists"]
-
-    # n_topic_list = 2
-    st.write(f"Keywords:")
-
-    # Just put both topic lists together for now as keywords.
-    keyword_list = []
-    for list in topic_lists:
-        concatenated_items = ", ".join(list)
-        keyword_list.append(concatenated_items)
-
-    concatenated_keyword_list = ", ".join(keyword_list)
-
-    st.write(concatenated_keyword_list)
+    version = database_version(DATABASE_PATH)
+    if version is None:
+        st.info("No papers yet, run get_data.py to scrape the trending papers.")
+    else:
+        # Keywords from topic modeling
+        topics = load_topics(DATABASE_PATH, version)
+        keywords = {topic["topic_id"]: topic["keywords"] for topic in topics}
+
+        # Just put all topic keyword lists together for now.
+        st.write(f"Keywords:")
+        st.write(
+            ", ".join(", ".join(topic_keywords) for topic_keywords in keywords.values())
+        )
 
-    st.divider()
+        st.divider()
+
+        # Filters; only the selected page of papers is queried and rendered.
+        trending = st.checkbox("Currently trending papers only", value=True)
+        date_range = st.date_input("Published between", value=())
+        topic_id = st.selectbox(
+            "Topic",
+            [None] + list(keywords),
+            format_func=lambda topic_id: (
+                "All topics" if topic_id is None else ", ".join(keywords[topic_id][:3])
+            ),
+        )
+        start_date = date_range[0] if len(date_range) > 0 else None
+        end_date = date_range[1] if len(date_range) > 1 else None
 
-    summaries = get_summaries()
-    for summary in summaries:
-        st.write(summary)
+        page = st.session_state.get("page", 1) - 1
+        papers, total = load_page(
+            DATABASE_PATH, version, page, start_date, end_date, topic_id, trending
+        )
+        n_pages = max(1, -(-total // PAGE_SIZE))
+        if page >= n_pages:
+            # The filters changed and the selected page no longer exists.
+            page = 0
+            st.session_state["page"] = 1
+            papers, total = load_page(
+                DATABASE_PATH, version, page, start_date, end_date, topic_id, trending
+            )
+
+        st.caption(f"{total} papers")
+        for i, paper in enumerate(papers):
+            st.write(format_summary(paper, page * PAGE_SIZE + i + 1))
+
+        st.number_input(
+            f"Page (of {n_pages})",
+            min_value=1,
+            max_value=n_pages,
+            key="page",
+        )
 
     # For RAG-CHAT
     st.header("AI Chat", anchor="aichat", divider="gray")
@@ -75,8 +135,26 @@ def main():
     #     st.stop()
 
     if user_input:
-        result = rag(user_input)
-        st.write(result)
+        # Questions are answered by the QA service (qa_service.py), shared by all sessions, which queues
+        # them, answers identical questions once and times out stuck ones.
+        from qa_client import QAServiceError, stream_answer
+
+        # Stream the answer to the page as it is generated.
+        try:
+            st.write_stream(stream_answer(user_input))
+        except QAServiceError as e:
+            st.error(str(e))
+
+    # Latency and token metrics of the QA service (retrieval, LLM, embeddings), shown with ?debug=1.
+    if st.query_params.get("debug"):
+        from instrumentation import format_report
+        from qa_client import QAServiceError, get_metrics
+
+        with st.expander("Debug: latency and token metrics", expanded=True):
+            try:
+                st.code(format_report(get_metrics()))
+            except QAServiceError as e:
+                st.error(str(e))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+import argparse
+import os
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# A local sentence-transformers model, exported to ONNX with its weights quantized to int8, embeds texts on
+# the CPU with onnxruntime. Select it with EMBEDDING_MODEL=onnx, see embedding_models.py.
+
+ONNX_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_MODEL_DIRECTORY = "data/models/all-MiniLM-L6-v2"
+
+
+def export_onnx_model(
+    model_name: str = ONNX_MODEL_NAME, directory: str = ONNX_MODEL_DIRECTORY
+) -> str:
+    """Exports a sentence-transformers model to ONNX and quantizes its weights to int8.
+
+    The directory gets `model.onnx` (float32), `model_int8.onnx` (dynamic int8 quantization of the linear
+    layers, about 4 times smaller and faster on the CPU) and the `tokenizer.json` of the model.
+
+    Args:
+        model_name (str): Name of the model on the Hugging Face Hub.
+        directory (str): Directory the model is exported to.
+
+    Returns:
+        str: The path of the quantized model.
+    """
+    # torch and transformers are only needed to export the model, not to run it.
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(directory, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(directory)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    inputs = tokenizer(["An example sentence."], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    names = [name for name in names if name in inputs]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    path = os.path.join(directory, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(inputs[name] for name in names),
+            path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    quantized_path = os.path.join(directory, "model_int8.onnx")
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    print(f"Model exported to {quantized_path}")
+    return quantized_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """LangChain embeddings computed locally by an int8 ONNX sentence-transformers model.
+
+    Texts are tokenized with the fast tokenizer of the model, sorted by length and run in batches of
+    `batch_size`, so each batch is padded to similar lengths only. The token embeddings are mean pooled
+    and normalized, like sentence-transformers does. Batches run one at a time, each on `threads` CPU
+    threads, so concurrent callers (e.g. the batches of `BatchedEmbeddings`) do not oversubscribe the CPU.
+
+    Args:
+        directory (str): Directory of the exported model, see `export_onnx_model`.
+        batch_size (int): Number of texts per inference run.
+        threads (int): Number of CPU threads per inference run; 0 lets onnxruntime pick.
+        max_length (int): Maximum number of tokens per text; longer texts are truncated.
+        quantized (bool): Whether to run the int8 model rather than the float32 one.
+    """
+
+    def __init__(
+        self,
+        directory: str = ONNX_MODEL_DIRECTORY,
+        batch_size: int = 32,
+        threads: int = 0,
+        max_length: int = 256,
+        quantized: bool = True,
+    ):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        path = os.path.join(directory, "model_int8.onnx" if quantized else "model.onnx")
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No ONNX model at {path}, run `python onnx_embeddings.py --export` first"
+            )
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {input.name for input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        pad_token = "[PAD]" if self.tokenizer.token_to_id("[PAD]") is not None else None
+        self.tokenizer.enable_padding(
+            pad_id=self.tokenizer.token_to_id(pad_token) if pad_token else 0,
+            pad_token=pad_token or "[PAD]",
+        )
+
+        self.batch_size = batch_size
+        # Names the embedding cache of the model, see embedding_cache.CachedEmbeddings.
+        self.model = f"onnx-{os.path.basename(os.path.normpath(directory))}" + (
+            "-int8" if quantized else ""
+        )
+        self._lock = threading.Lock()
+
+    def _embed_batch(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array(
+            [encoding.attention_mask for encoding in encodings], dtype=np.int64
+        )
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+
+        with self._lock:
+            (hidden,) = self.session.run(["last_hidden_state"], feed)
+
+        # Mean pooling over the tokens that are not padding, then L2 normalization.
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(
+            np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None
+        )
+
+    def embed_documents(self, texts: list) -> list:
+        # Batching texts of similar length keeps the padding, and the wasted compute, small.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            for i, vector in zip(batch, self._embed_batch([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the local embedding model to ONNX, quantized to int8."
+    )
+    parser.add_argument("--export", action="store_true", help="export the model")
+    parser.add_argument("--model", default=ONNX_MODEL_NAME)
+    parser.add_argument("--directory", default=ONNX_MODEL_DIRECTORY)
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx_model(args.model, args.directory)
+    else:
+        parser.print_help()
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+from langchain_core.documents import Document
+
+from http_client import RateLimiter, create_session, fetch
+from instrumentation import observe
+
+PDF_CACHE_DIRECTORY = "data/pdfs"
+
+
+class PdfCache:
+    """Local content-addressed store of downloaded pdfs.
+
+    Every pdf is saved as `<sha256>.pdf`, and `index.json` maps the url it was downloaded from to its
+    hash. arXiv pdf links carry the version of the paper, so a cached url never needs to be fetched again.
+
+    Args:
+        directory (str): Directory holding the pdfs and the index.
+    """
+
+    def __init__(self, directory: str = PDF_CACHE_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+
+        self.index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as file:
+                self.index = json.load(file)
+
+    def path(self, url: str) -> str:
+        """Returns the local path of the pdf downloaded from `url`, or None if it is not cached."""
+        digest = self.index.get(url)
+        if digest is None:
+            return None
+        path = os.path.join(self.directory, f"{digest}.pdf")
+        return path if os.path.exists(path) else None
+
+    def download(self, url: str, session=None, rate_limiter=None) -> str:
+        """Downloads the pdf at `url` into the cache unless it is already there.
+
+        Returns:
+            str: The local path of the pdf.
+        """
+        path = self.path(url)
+        if path is not None:
+            return path
+
+        response = fetch(url, session, rate_limiter, timeout=120)
+        response.raise_for_status()
+
+        # Write to a temporary file first so a failed download never leaves a partial pdf in the cache.
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = os.path.join(self.directory, f"{digest}.pdf")
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as file:
+            file.write(response.content)
+        os.replace(file.name, path)
+
+        with self._lock:
+            self.index[url] = digest
+            self.save()
+        return path
+
+    def save(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.index, file, indent=4)
+        os.replace(tmp_path, self._index_path)
+
+
+def parse_pdf(path: str, source: str, backend: str = "pypdf") -> list:
+    """Extracts the text of every page of a pdf.
+
+    This runs in a worker process, so it only takes and returns picklable values.
+
+    Args:
+        path (str): Local path of the pdf.
+        source (str): Url of the pdf, stored as the 'source' of every page like PyPDFLoader does.
+        backend (str): 'pypdf', or 'pymupdf' for the faster PyMuPDF parser.
+
+    Returns:
+        list: One document per page, with the 'source' and zero-based 'page' in its metadata.
+    """
+    if backend == "pymupdf":
+        import fitz
+
+        with fitz.open(path) as pdf:
+            texts = [page.get_text() for page in pdf]
+    elif backend == "pypdf":
+        from pypdf import PdfReader
+
+        texts = [page.extract_text() for page in PdfReader(path).pages]
+    else:
+        raise ValueError(f"Unknown pdf backend: {backend}")
+
+    return [
+        Document(page_content=text, metadata={"source": source, "page": i})
+        for i, text in enumerate(texts)
+    ]
+
+
+def parse_pdf_timed(path: str, source: str, backend: str = "pypdf") -> tuple:
+    """Runs `parse_pdf` and also returns its duration, which the parent process records."""
+    start = time.perf_counter()
+    pages = parse_pdf(path, source, backend)
+    return pages, time.perf_counter() - start
+
+
+def load_pdfs(
+    papers: list,
+    max_workers: int = 8,
+    parse_workers: int = None,
+    backend: str = "pypdf",
+    cache: PdfCache = None,
+):
+    """Downloads and parses the pdfs of many papers, yielding each paper as soon as its pages are ready.
+
+    Pdfs are downloaded concurrently into the local pdf cache, and every finished download is handed to
+    a process pool for parsing right away, so downloading and parsing overlap. Papers are yielded in the
+    order they finish, so callers only ever hold the pages of one paper at a time.
+
+    Args:
+        papers (list): paper dictionaries, each containing the 'arxiv_link' of the paper's pdf
+        max_workers (int): maximum number of pdfs downloaded at the same time
+        parse_workers (int, optional): number of parsing processes, defaults to the number of CPUs
+        backend (str): 'pypdf', or 'pymupdf' for the faster PyMuPDF parser
+        cache (PdfCache, optional): the pdf cache to download into
+
+    Yields:
+        tuple: the paper dictionary and the list of its page documents
+    """
+    cache = cache or PdfCache()
+    session = create_session(pool_size=max_workers)
+    rate_limiter = RateLimiter(requests_per_second=4)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as downloads, ProcessPoolExecutor(
+        max_workers=parse_workers
+    ) as parsers:
+        # Every pending future maps to its paper and whether it is a download or a parse job.
+        jobs = {
+            downloads.submit(
+                cache.download, paper["arxiv_link"], session, rate_limiter
+            ): (paper, "download")
+            for paper in papers
+        }
+
+        while jobs:
+            done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+            for future in done:
+                paper, stage = jobs.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Failed to {stage} {paper['arxiv_link']}: {e}")
+                    continue
+
+                if stage == "download":
+                    parse = parsers.submit(
+                        parse_pdf_timed, result, paper["arxiv_link"], backend
+                    )
+                    jobs[parse] = (paper, "parse")
+                else:
+                    pages, seconds = result
+                    # Parsing runs in another process, so its duration is recorded here.
+                    observe("pdf.parse", seconds)
+                    yield paper, pages
@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from indexing import MANIFEST_PATH
+from instrumentation import print_report as print_metrics, save_report, span
+
+PIPELINE_STATE_PATH = "data/pipeline_state.json"
+
+
+def file_hash(path: str) -> str:
+    """Hashes the content of a file, or returns None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Stage:
+    """One stage of the refresh pipeline.
+
+    A stage is identified by the content of its inputs: the outputs of the stages it depends on, its
+    source files and its configuration. Its own output is the content of its output files. A stage is
+    up to date, and skipped, when neither its inputs nor its outputs changed since it last ran.
+
+    Args:
+        name (str): Name of the stage.
+        run: Function running the stage.
+        depends (tuple): Names of the stages whose outputs this stage reads.
+        outputs (tuple): Files written by the stage.
+        sources (tuple): Source files of the stage; editing one reruns the stage.
+        config (dict, optional): Settings of the stage; changing one reruns the stage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run,
+        depends: tuple = (),
+        outputs: tuple = (),
+        sources: tuple = (),
+        config: dict = None,
+    ):
+        self.name = name
+        self.run = run
+        self.depends = depends
+        self.outputs = outputs
+        self.sources = sources
+        self.config = config or {}
+
+    def input_key(self, upstream: dict) -> str:
+        """Hashes the inputs of the stage, given the output hash of every upstream stage."""
+        inputs = {
+            "depends": {name: upstream[name] for name in self.depends},
+            "sources": {path: file_hash(path) for path in self.sources},
+            "config": self.config,
+        }
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def output_key(self) -> str:
+        """Hashes the content of the output files of the stage."""
+        return hashlib.sha256(
+            json.dumps([file_hash(path) for path in self.outputs]).encode()
+        ).hexdigest()
+
+
+def run_papers():
+    from get_data import get_paper_info
+
+    get_paper_info()
+
+
+def run_index(max_workers: int, pdf_backend: str):
+    from get_data import create_vector_database
+
+    create_vector_database(max_workers=max_workers, pdf_backend=pdf_backend)
+
+
+def run_abstract_embeddings():
+    from embedding_artifacts import build_abstract_artifact
+
+    build_abstract_artifact()
+
+
+def run_chunk_embeddings():
+    from embedding_artifacts import build_chunk_artifact
+
+    build_chunk_artifact()
+
+
+def run_topics():
+    from topic_modeling import topic_modeling
+
+    topic_modeling()
+
+
+def default_stages(max_workers: int = 8, pdf_backend: str = "pypdf") -> list:
+    """Returns the stages of the refresh pipeline.
+
+    The papers stage scrapes the trending papers and their arXiv metadata. The index stage then downloads,
+    parses, chunks and embeds the pdfs of new papers into the vector store (streamed paper by paper, see
+    indexing.py), and embeds their abstracts into the embedding cache. Two branches then run concurrently
+    from the index: the chunk embeddings artifact; and the abstract embeddings artifact, read from the
+    cache, followed by topic modeling.
+    """
+    from embedding_artifacts import ARTIFACT_DIRECTORY
+    from topic_modeling import TOPIC_STATE_PATH
+    from embedding_models import EMBEDDING_MODEL
+    from vectorstore import VECTOR_STORE
+
+    return [
+        Stage(
+            "papers",
+            run_papers,
+            outputs=("data/paper_metadata.json",),
+            sources=("get_data.py", "arxiv_api.py", "database.py"),
+            # The trending list changes over the day, so scraping reruns once a day.
+            config={"date": time.strftime("%Y-%m-%d")},
+        ),
+        Stage(
+            "index",
+            lambda: run_index(max_workers, pdf_backend),
+            depends=("papers",),
+            outputs=(MANIFEST_PATH,),
+            sources=(
+                "get_data.py",
+                "indexing.py",
+                "chunking.py",
+                "pdf_ingest.py",
+                "embedding_executor.py",
+                "embedding_models.py",
+                "onnx_embeddings.py",
+                "vectorstore.py",
+            ),
+            config={
+                "vector_store": VECTOR_STORE,
+                "pdf_backend": pdf_backend,
+                "embedding_model": EMBEDDING_MODEL,
+            },
+        ),
+        Stage(
+            "chunk_embeddings",
+            run_chunk_embeddings,
+            depends=("index",),
+            outputs=(os.path.join(ARTIFACT_DIRECTORY, "chunks", "CURRENT"),),
+            sources=("embedding_artifacts.py",),
+            config={"embedding_model": EMBEDDING_MODEL},
+        ),
+        Stage(
+            "abstract_embeddings",
+            run_abstract_embeddings,
+            # The abstracts are embedded into the embedding cache by the index stage.
+            depends=("index",),
+            outputs=(os.path.join(ARTIFACT_DIRECTORY, "abstracts", "CURRENT"),),
+            sources=("embedding_artifacts.py",),
+            config={"embedding_model": EMBEDDING_MODEL},
+        ),
+        Stage(
+            "topics",
+            run_topics,
+            depends=("abstract_embeddings",),
+            outputs=(TOPIC_STATE_PATH,),
+            sources=("topic_modeling.py",),
+        ),
+    ]
+
+
+def load_state(path: str = PIPELINE_STATE_PATH) -> dict:
+    """Loads the input and output hashes of the last run of every stage."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_state(state: dict, path: str = PIPELINE_STATE_PATH):
+    """Writes the pipeline state atomically."""
+    with open(path + ".tmp", "w") as file:
+        json.dump(state, file, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def refresh(
+    stages: list,
+    force: tuple = (),
+    max_workers: int = 4,
+    dry_run: bool = False,
+    state_path: str = PIPELINE_STATE_PATH,
+) -> dict:
+    """Runs the stages that are out of date, each as soon as the stages it depends on are done.
+
+    Stages whose dependencies are done run concurrently in a thread pool, so independent branches overlap.
+    When a stage fails, the stages depending on it are not run, while the other branches carry on.
+
+    Args:
+        stages (list): The stages, see `default_stages`.
+        force (tuple): Names of stages to run even if they are up to date.
+        max_workers (int): Maximum number of stages running at the same time.
+        dry_run (bool): Only report which stages would run.
+        state_path (str): Path of the pipeline state file.
+
+    Returns:
+        dict: The status ('ran', 'skipped', 'stale', 'failed' or 'blocked') and seconds of every stage.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = set(stage.depends) - names
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages {unknown}")
+
+    state = load_state(state_path)
+    lock = threading.Lock()
+    pending = {stage.name: stage for stage in stages}
+    outputs = {}
+    report = {}
+
+    def run(stage: Stage, key: str):
+        start = time.perf_counter()
+        with span(f"pipeline.{stage.name}"):
+            stage.run()
+        seconds = time.perf_counter() - start
+        output = stage.output_key()
+        with lock:
+            state[stage.name] = {"inputs": key, "outputs": output, "seconds": seconds}
+            save_state(state, state_path)
+        return output, seconds
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            # Start or skip every stage whose dependencies are done.
+            for name, stage in list(pending.items()):
+                if any(
+                    report.get(dep, {}).get("status") in ("failed", "blocked")
+                    for dep in stage.depends
+                ):
+                    report[name] = {"status": "blocked", "seconds": 0.0}
+                    del pending[name]
+                    continue
+                if not all(dep in outputs for dep in stage.depends):
+                    continue
+                del pending[name]
+
+                key = stage.input_key(outputs)
+                last = state.get(name, {})
+                if (
+                    name not in force
+                    and last.get("inputs") == key
+                    and last.get("outputs") == stage.output_key()
+                ):
+                    outputs[name] = last["outputs"]
+                    report[name] = {"status": "skipped", "seconds": 0.0}
+                elif dry_run:
+                    # Assume the stage would change its outputs, so everything downstream is stale too.
+                    outputs[name] = None
+                    report[name] = {"status": "stale", "seconds": 0.0}
+                else:
+                    print(f"[pipeline] running {name}")
+                    running[executor.submit(run, stage, key)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    outputs[name], seconds = future.result()
+                    report[name] = {"status": "ran", "seconds": seconds}
+                except Exception as e:
+                    print(f"[pipeline] {name} failed: {e!r}")
+                    report[name] = {"status": "failed", "seconds": 0.0}
+
+    return {stage.name: report[stage.name] for stage in stages}
+
+
+def print_report(report: dict, seconds: float):
+    """Prints the status and duration of every stage."""
+    print(f"\n{'stage':22s}{'status':10s}{'seconds':>10s}")
+    for name, entry in report.items():
+        print(f"{name:22s}{entry['status']:10s}{entry['seconds']:10.1f}")
+    print(f"{'total':32s}{seconds:10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data pipeline of the app.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = commands.add_parser(
+        "refresh", help="run every stage that is out of date"
+    )
+    refresh_parser.add_argument(
+        "--force", nargs="+", default=(), help="stages to run even if up to date"
+    )
+    refresh_parser.add_argument("--dry-run", action="store_true")
+    refresh_parser.add_argument("--workers", type=int, default=4)
+    refresh_parser.add_argument("--download-workers", type=int, default=8)
+    refresh_parser.add_argument(
+        "--pdf-backend", default="pypdf", choices=("pypdf", "pymupdf")
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = refresh(
+        default_stages(args.download_workers, args.pdf_backend),
+        force=tuple(args.force),
+        max_workers=args.workers,
+        dry_run=args.dry_run,
+    )
+    print_report(report, time.perf_counter() - start)
+    print()
+    print_metrics()
+    save_report()
+    if any(entry["status"] in ("failed", "blocked") for entry in report.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
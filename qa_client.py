@@ -0,0 +1,102 @@
+import functools
+import json
+import os
+
+import dotenv
+import requests
+
+from http_client import create_session
+
+# Load .env
+dotenv.load_dotenv()
+
+# The app and the command line interface ask their questions to the QA service (qa_service.py), which
+# can be moved to another host with QA_SERVICE_URL in .env.
+QA_SERVICE_URL = os.getenv("QA_SERVICE_URL", "http://127.0.0.1:8000")
+
+
+class QAServiceError(Exception):
+    """The QA service could not answer: it is down, overloaded, timed out or failed."""
+
+
+@functools.lru_cache(maxsize=None)
+def get_session():
+    """Returns the HTTP session to the QA service, created once per process so connections are reused."""
+    return create_session(pool_size=64, retries=0)
+
+
+def stream_answer(question: str, url: str = QA_SERVICE_URL, timeout: float = 120):
+    """Asks the QA service a question and streams its answer as it is generated.
+
+    Args:
+        question (str): The question.
+        url (str): Base url of the QA service.
+        timeout (float): Seconds to wait for the next chunk of the answer.
+
+    Yields:
+        str: The answer, chunk by chunk.
+
+    Raises:
+        QAServiceError: If the service is unreachable, overloaded, times out or fails.
+    """
+    try:
+        response = get_session().post(
+            url.rstrip("/") + "/stream",
+            json={"question": question},
+            stream=True,
+            timeout=(5, timeout),
+        )
+    except requests.RequestException as e:
+        raise QAServiceError(
+            f"The QA service at {url} is not reachable, start it with `python qa_service.py` ({e})"
+        )
+
+    with response:
+        if response.status_code != 200:
+            raise QAServiceError(error_message(response))
+
+        # Server-sent events: an 'event:' line (none for answer chunks), a 'data:' line, then a blank line.
+        event = None
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:") :].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:") :])
+                    if event == "error":
+                        raise QAServiceError(data["error"])
+                    if event == "done":
+                        return
+                    yield data
+                elif not line:
+                    event = None
+        except requests.RequestException as e:
+            raise QAServiceError(f"The QA service stream was interrupted ({e})")
+    raise QAServiceError(
+        "The QA service closed the stream before the end of the answer"
+    )
+
+
+def answer(question: str, url: str = QA_SERVICE_URL, timeout: float = 120) -> str:
+    """Asks the QA service a question and returns the whole answer, see `stream_answer`."""
+    return "".join(stream_answer(question, url, timeout))
+
+
+def get_metrics(url: str = QA_SERVICE_URL) -> dict:
+    """Returns the latency and token metrics of the QA service, see instrumentation.py."""
+    try:
+        response = get_session().get(url.rstrip("/") + "/metrics", timeout=5)
+    except requests.RequestException as e:
+        raise QAServiceError(f"The QA service at {url} is not reachable ({e})")
+    if response.status_code != 200:
+        raise QAServiceError(error_message(response))
+    return response.json()
+
+
+def error_message(response) -> str:
+    """Returns the error detail of a failed response of the QA service."""
+    try:
+        detail = response.json()["detail"]
+    except (ValueError, KeyError, TypeError):
+        detail = response.text
+    return f"QA service error (HTTP {response.status_code}): {detail}"
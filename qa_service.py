@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+import dotenv
+import httpx
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from answer_cache import normalize_query
+from instrumentation import METRICS, count, observe, print_report, save_report
+from rag import arag_stream, get_rag_chain
+
+# Load .env
+dotenv.load_dotenv()
+
+# The QA service answers the questions of the app and the command line interface with the RAG chain, in
+# one process for all users. Its limits can be set in .env: QA_MAX_CONCURRENCY is the number of questions
+# answered at the same time, QA_MAX_QUEUE the number of questions waiting for a slot before new ones are
+# turned away with 503, and QA_TIMEOUT the seconds after which a question fails with 504.
+MAX_CONCURRENCY = int(os.getenv("QA_MAX_CONCURRENCY", 8))
+MAX_QUEUE = int(os.getenv("QA_MAX_QUEUE", 32))
+TIMEOUT = float(os.getenv("QA_TIMEOUT", 60))
+
+
+class Overloaded(Exception):
+    """Too many questions are waiting for a slot."""
+
+
+class Flight:
+    """Answer of a question being generated, streamed to every request asking that question.
+
+    Chunks are kept as they arrive, so a request joining late replays them before waiting for new ones.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Exception = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self):
+        """Yields every chunk of the answer, raising the error of the flight if it failed."""
+        i = 0
+        while True:
+            changed = self._changed
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class QAService:
+    """Answers questions with the RAG chain, with bounded concurrency, backpressure and timeouts.
+
+    At most `max_concurrency` questions are in the chain at the same time; further questions wait for a
+    slot, and once `max_queue` of them are waiting new ones are refused with `Overloaded`. A question
+    that is not answered within `timeout` seconds, waiting included, fails with `TimeoutError`. Requests
+    for a question that is already being answered (up to case, whitespace and trailing punctuation)
+    share its answer instead of running the chain again.
+
+    Every answer is generated by a task of its own, so it completes for the other requests and the
+    answer cache even if the request that started it goes away.
+
+    Args:
+        max_concurrency (int): Maximum number of questions answered at the same time.
+        max_queue (int): Maximum number of questions waiting for a slot.
+        timeout (float): Seconds after which a question fails.
+        http_client (httpx.AsyncClient, optional): Pooled HTTP client the LLM calls are sent with.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_queue: int = MAX_QUEUE,
+        timeout: float = TIMEOUT,
+        http_client: httpx.AsyncClient = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.http_client = http_client
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._running = 0
+        self._flights = {}
+        self._tasks = set()
+
+    def stream(self, question: str):
+        """Admits a question and returns the async iterator of its answer.
+
+        Raises:
+            Overloaded: If the queue of questions waiting for a slot is full.
+        """
+        key = normalize_query(question)
+        flight = self._flights.get(key)
+        if flight is not None:
+            count("qa.deduplicated")
+            return flight.subscribe()
+
+        # Admitted questions are counted from admission on, so a burst arriving at once cannot overfill
+        # the queue before their tasks get to wait for a slot.
+        if len(self._flights) >= self.max_concurrency + self.max_queue:
+            count("qa.rejected")
+            raise Overloaded(
+                f"{len(self._flights)} questions are being answered or waiting, try again later"
+            )
+
+        flight = self._flights[key] = Flight()
+        task = asyncio.create_task(self._run(key, question, flight))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return flight.subscribe()
+
+    async def _run(self, key: str, question: str, flight: Flight):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._answer(question, flight), self.timeout)
+        except asyncio.TimeoutError:
+            count("qa.timeouts")
+            flight.finish(TimeoutError(f"No answer within {self.timeout:g} s"))
+        except Exception as e:
+            count("qa.errors")
+            flight.finish(e)
+        else:
+            flight.finish()
+        finally:
+            del self._flights[key]
+            observe("qa.request", time.perf_counter() - start)
+
+    async def _answer(self, question: str, flight: Flight):
+        start = time.perf_counter()
+        async with self._semaphore:
+            observe("qa.queue_wait", time.perf_counter() - start)
+            self._running += 1
+            try:
+                async for chunk in arag_stream(question, self.http_client):
+                    flight.publish(chunk)
+            finally:
+                self._running -= 1
+
+    def stats(self) -> dict:
+        """Returns the number of questions being answered and waiting for a slot."""
+        return {
+            "in_flight": self._running,
+            "queued": len(self._flights) - self._running,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+class Question(BaseModel):
+    question: str
+
+
+def server_sent_event(data, event: str = None) -> str:
+    """Formats a server-sent event, with its data as JSON so newlines in answers cannot end the event."""
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+
+def create_app(
+    max_concurrency: int = MAX_CONCURRENCY,
+    max_queue: int = MAX_QUEUE,
+    timeout: float = TIMEOUT,
+) -> FastAPI:
+    """Creates the FastAPI app of the QA service.
+
+    Endpoints:
+        POST /stream: streams the answer to {"question": ...} as server-sent events; every answer chunk is
+            a 'data:' event holding a JSON string, and the stream ends with a 'done' or an 'error' event.
+        POST /answer: returns {"answer": ...} once the whole answer is generated.
+        GET /health: returns the load of the service.
+        GET /metrics: returns the latency and token metrics of the service, see instrumentation.py.
+
+    Questions refused because the queue is full get 503 with Retry-After, and questions not answered in
+    time get 504 (or an 'error' event once the answer is streaming).
+    """
+    state = {}
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # One pool of keep-alive connections to the LLM API, shared by every question.
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=2 * max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+            timeout=httpx.Timeout(timeout, connect=10),
+        )
+        state["service"] = QAService(max_concurrency, max_queue, timeout, http_client)
+        # Open the vector database and build the chain before the first question.
+        await asyncio.to_thread(get_rag_chain, http_client)
+        yield
+        await http_client.aclose()
+
+    app = FastAPI(title="Trending papers QA", lifespan=lifespan)
+
+    def admit(question: Question):
+        try:
+            return state["service"].stream(question.question)
+        except Overloaded as e:
+            raise HTTPException(503, str(e), headers={"Retry-After": "1"})
+
+    @app.post("/stream")
+    async def stream(question: Question):
+        chunks = admit(question)
+
+        async def events():
+            try:
+                async for chunk in chunks:
+                    yield server_sent_event(chunk)
+            except Exception as e:
+                yield server_sent_event({"error": str(e)}, "error")
+            else:
+                yield server_sent_event({}, "done")
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.post("/answer")
+    async def answer(question: Question):
+        chunks = admit(question)
+        try:
+            return {"answer": "".join([chunk async for chunk in chunks])}
+        except TimeoutError as e:
+            raise HTTPException(504, str(e))
+        except Exception as e:
+            raise HTTPException(500, str(e))
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", **state["service"].stats()}
+
+    @app.get("/metrics")
+    async def metrics():
+        return METRICS.snapshot()
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the QA service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT)
+    args = parser.parse_args()
+
+    # One worker process: the answer cache, the in-flight questions and the connection pool are shared
+    # by all requests within it.
+    uvicorn.run(
+        create_app(args.max_concurrency, args.max_queue, args.timeout),
+        host=args.host,
+        port=args.port,
+    )
+    print_report()
+    save_report()
@@ -1,53 +1,158 @@
+import argparse
+import asyncio
+import functools
 import json
+import os
+import threading
+import time
 
-# from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
+import dotenv
 
-# from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import ChatOpenAI
+from indexing import index_version
+from instrumentation import count, observe, percentile, print_report, save_report
 
-# from langchain import hub
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.prompts import PromptTemplate
-import dotenv
+# LangChain, the OpenAI client and the vector store are imported inside the functions below, on first use, so that
+# importing this module (e.g. from the Streamlit app) stays fast.
 
 # Load .env
 dotenv.load_dotenv()
 
-## Load vectorized data and initialize embeddings.
-persist_directory = "data/vectordb"
-embeddings = OpenAIEmbeddings()
-vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+# Retrieval settings, which can be overridden in .env:
+# RAG_RETRIEVAL_K is the number of chunks put into the prompt, and RAG_RERANK one of 'none', 'mmr' or
+# 'cross-encoder' (see retrieval.HybridRetriever).
+retrieval_k = int(os.getenv("RAG_RETRIEVAL_K", 4))
+rerank = os.getenv("RAG_RERANK", "none")
+# RAG_CONTEXT_TOKENS is the maximum number of tokens of retrieved context put into the prompt.
+context_tokens = int(os.getenv("RAG_CONTEXT_TOKENS", 1000))
 
 # Define a prompt template for the RAG task, outlining how the context and question should be presented.
 template = """You are an assistant for question-answering tasks regarding trending research (the context). Use the following pieces of context to answer the question at the end.
-Provide sources as a list. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+Each piece of context starts with the number, title and arXiv id of its source. Cite the sources you use by their number, e.g. [1], and list them with their titles and arXiv ids at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
 
 {context}
 
 Question: {question}
 
 Helpful Answer:"""
-custom_rag_prompt = PromptTemplate.from_template(template)
 
-# Set up the retriever and language model (LLM) for the RAG system.
-retriever = vectordb.as_retriever(search_kwargs={"k": 10})
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+
+@functools.lru_cache(maxsize=None)
+def get_embeddings():
+    """Returns the embeddings used for retrieval, created once per process.
+
+    The model is the one of the vector database, OpenAI's or the local ONNX model (EMBEDDING_MODEL setting).
+    Repeated questions are embedded once and then served from the on-disk embedding cache.
+    """
+    from embedding_cache import CachedEmbeddings
+    from embedding_models import create_embeddings
+
+    return CachedEmbeddings(create_embeddings())
+
+
+_rag_chains_lock = threading.Lock()
 
 
-def format_docs(docs):
-    """Formats documents into a single string.
+def get_rag_chain(async_http_client=None):
+    """Returns the RAG chain, built once per process on first use and rebuilt when the vector store changes.
+
+    Every HTTP client gets a chain of its own, so the sync path and the QA service do not rebuild each
+    other's chain.
+
+    Opening the vector database and creating the clients is deferred until a question is asked, so
+    importing this module stays cheap and app reruns reuse the same chain.
 
     Args:
-        docs: A list of documents to format.
+        async_http_client (httpx.AsyncClient, optional): Pooled HTTP client the async LLM calls are sent
+            with, e.g. the one of the QA service.
+    """
+    version = index_version()
+    chains = rag_chains(version)
+    with _rag_chains_lock:
+        # The entry keeps a reference to the client, so its id cannot be reused by another client.
+        entry = chains.get(id(async_http_client))
+        if entry is None:
+            entry = chains[id(async_http_client)] = (
+                async_http_client,
+                build_rag_chain(version, async_http_client),
+            )
+    return entry[1]
 
-    Returns:
-        A string containing the formatted documents.
+
+@functools.lru_cache(maxsize=1)
+def rag_chains(version) -> dict:
+    """Returns the RAG chains built for a version of the vector store, by id of their HTTP client.
+
+    Only the latest version is kept, so a new version of the vector store drops the chains of the previous one.
     """
+    return {}
+
 
-    return "\n\n".join(doc.page_content for doc in docs)
+def build_rag_chain(version, async_http_client=None):
+    """Builds the RAG chain for a given version of the vector store (see `indexing.index_version`)."""
+    from langchain_openai import ChatOpenAI
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnablePassthrough
+    from langchain_core.prompts import PromptTemplate
+    from context import ContextAssembler
+    from instrumentation import llm_timing_callback
+    from embedding_artifacts import load_artifact
+    from retrieval import HybridRetriever
+    from vectorstore import get_vectorstore
+
+    custom_rag_prompt = PromptTemplate.from_template(template)
+
+    ## Load vectorized data and initialize embeddings.
+    # The backend (Chroma or FAISS) is selected by the VECTOR_STORE setting.
+    embeddings = get_embeddings()
+    vectordb = get_vectorstore(embeddings)
+
+    # Set up the retriever and language model (LLM) for the RAG system.
+    # The retriever fuses vector search with BM25 keyword search over the same chunks, and reranks with
+    # the chunk embeddings written at index time.
+    retriever = HybridRetriever.from_vectordb(
+        vectordb,
+        k=retrieval_k,
+        rerank=rerank,
+        artifact=load_artifact("chunks", model=embeddings.cache.model_name),
+    )
+    # The callback records the time to first token, total time and tokens of every LLM call.
+    llm_clients = {}
+    if async_http_client is not None:
+        from openai import AsyncOpenAI
+
+        # Async calls reuse the connections of the caller's pool instead of a client of their own.
+        llm_clients["async_client"] = AsyncOpenAI(
+            http_client=async_http_client
+        ).chat.completions
+    llm = ChatOpenAI(
+        model_name="gpt-3.5-turbo",
+        temperature=0,
+        callbacks=[llm_timing_callback()],
+        **llm_clients,
+    )
+
+    # The retrieved chunks are merged, deduplicated and cited within the context token budget.
+    assembler = ContextAssembler(max_tokens=context_tokens)
+
+    # Set up the RAG chain, combining the retriever, context assembler, prompt, LLM, and output parser.
+    return (
+        {"context": retriever | assembler.format, "question": RunnablePassthrough()}
+        | custom_rag_prompt
+        | llm
+        | StrOutputParser()
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_answer_cache():
+    """Returns the answer cache, created once per process.
+
+    Answers to repeated or near-identical questions are served from the answer cache without reaching the LLM.
+    The cache is cleared whenever create_vector_database updates the vector store.
+    """
+    from answer_cache import AnswerCache
+
+    return AnswerCache(get_embeddings().embed_query, version_fn=index_version)
 
 
 def rag(prompt):
@@ -60,37 +165,271 @@ def rag(prompt):
         The generated answer as a string.
     """
 
-    # Set up the RAG chain, combining the retriever, prompt formatter, LLM, and output parser.
-    rag_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | custom_rag_prompt
-        | llm
-        | StrOutputParser()
+    result = get_answer_cache().get(prompt)
+    if result is not None:
+        count("rag.cache_hits")
+        return result
+
+    start = time.perf_counter()
+    result = get_rag_chain().invoke(prompt)
+    observe("rag.answer", time.perf_counter() - start)
+    get_answer_cache().put(prompt, result, time.perf_counter() - start)
+
+    return result
+
+
+def rag_stream(prompt):
+    """Executes the RAG chain and streams the answer as it is generated.
+
+    The first tokens arrive as soon as retrieval is done and the LLM starts generating, instead of
+    after the full answer has been generated.
+
+    Args:
+        prompt: The prompt to provide to the RAG system.
+
+    Yields:
+        The generated answer, chunk by chunk.
+    """
+
+    result = get_answer_cache().get(prompt)
+    if result is not None:
+        count("rag.cache_hits")
+        yield result
+        return
+
+    start = time.perf_counter()
+    chunks = []
+    for chunk in get_rag_chain().stream(prompt):
+        if not chunks:
+            observe("rag.first_chunk", time.perf_counter() - start)
+        chunks.append(chunk)
+        yield chunk
+    observe("rag.answer", time.perf_counter() - start)
+    get_answer_cache().put(prompt, "".join(chunks), time.perf_counter() - start)
+
+
+async def arag_stream(prompt, async_http_client=None):
+    """Executes the RAG chain asynchronously and streams the answer as it is generated.
+
+    Args:
+        prompt: The prompt to provide to the RAG system.
+        async_http_client (httpx.AsyncClient, optional): Pooled HTTP client the LLM calls are sent with.
+
+    Yields:
+        The generated answer, chunk by chunk.
+    """
+
+    answer_cache = get_answer_cache()
+    result = await asyncio.to_thread(answer_cache.get, prompt)
+    if result is not None:
+        count("rag.cache_hits")
+        yield result
+        return
+
+    start = time.perf_counter()
+    chain = await asyncio.to_thread(get_rag_chain, async_http_client)
+    chunks = []
+    async for chunk in chain.astream(prompt):
+        if not chunks:
+            observe("rag.first_chunk", time.perf_counter() - start)
+        chunks.append(chunk)
+        yield chunk
+    observe("rag.answer", time.perf_counter() - start)
+    await asyncio.to_thread(
+        answer_cache.put, prompt, "".join(chunks), time.perf_counter() - start
     )
 
-    result = rag_chain.invoke(prompt)
+
+def embed_questions(prompts: list):
+    """Embeds many questions with one request to the embedding model.
+
+    The vectors land in the embedding cache, so the answer cache lookups and the retrieval of every
+    question read them from there instead of embedding each question on its own.
+    """
+    get_embeddings().embed_documents(list(dict.fromkeys(prompts)))
+
+
+async def arag(prompt):
+    """Executes the RAG chain asynchronously to generate an answer based on a given prompt.
+
+    Args:
+        prompt: The prompt to provide to the RAG system.
+
+    Returns:
+        The generated answer as a string.
+    """
+
+    answer_cache = get_answer_cache()
+    result = await asyncio.to_thread(answer_cache.get, prompt)
+    if result is not None:
+        count("rag.cache_hits")
+        return result
+
+    start = time.perf_counter()
+    chain = await asyncio.to_thread(get_rag_chain)
+    result = await chain.ainvoke(prompt)
+    observe("rag.answer", time.perf_counter() - start)
+    await asyncio.to_thread(
+        answer_cache.put, prompt, result, time.perf_counter() - start
+    )
 
     return result
 
 
+async def arag_batch(prompts: list, max_concurrency: int = 8):
+    """Answers many questions concurrently, yielding every answer as soon as it is generated.
+
+    All questions are embedded in one request first. At most `max_concurrency` questions are in the
+    chain at the same time, and repeated questions are answered once. A failing question does not stop
+    the others; its error is returned instead of an answer.
+
+    Args:
+        prompts (list): The questions.
+        max_concurrency (int): Maximum number of questions answered at the same time.
+
+    Yields:
+        dict: The 'index' of the question in `prompts`, its 'answer' (or None), the 'error' (or None) and
+              the 'seconds' it took, in the order the answers complete.
+    """
+    from answer_cache import normalize_query
+
+    await asyncio.to_thread(embed_questions, prompts)
+    await asyncio.to_thread(get_rag_chain)
+
+    # Questions that only differ in case, whitespace or trailing punctuation are answered once.
+    groups = {}
+    for i, prompt in enumerate(prompts):
+        groups.setdefault(normalize_query(prompt), []).append(i)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def answer(indices: list):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result, error = await arag(prompts[indices[0]]), None
+            except Exception as e:
+                result, error = None, repr(e)
+            return indices, result, error, time.perf_counter() - start
+
+    for task in asyncio.as_completed([answer(indices) for indices in groups.values()]):
+        indices, result, error, seconds = await task
+        for i in indices:
+            yield {"index": i, "answer": result, "error": error, "seconds": seconds}
+
+
+@functools.lru_cache(maxsize=None)
+def get_event_loop():
+    """Returns an event loop running in a background thread, shared by the synchronous batch API.
+
+    The async clients of the chain keep their connections on the loop they are first used on, so every
+    batch of a process runs on the same loop.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def rag_batch(prompts: list, max_concurrency: int = 8):
+    """Answers many questions concurrently, yielding every answer as soon as it is generated.
+
+    Synchronous version of `arag_batch`, which runs on a background event loop.
+
+    Args:
+        prompts (list): The questions.
+        max_concurrency (int): Maximum number of questions answered at the same time.
+
+    Yields:
+        dict: The 'index', 'answer', 'error' and 'seconds' of every question, see `arag_batch`.
+    """
+    loop = get_event_loop()
+    results = arag_batch(prompts, max_concurrency)
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(
+                    results.__anext__(), loop
+                ).result()
+            except StopAsyncIteration:
+                break
+    finally:
+        asyncio.run_coroutine_threadsafe(results.aclose(), loop).result()
+
+
+def rag_batch_file(input_path: str, output_path: str, max_concurrency: int = 8):
+    """Answers the questions of a JSONL file and writes the answers to another JSONL file.
+
+    Every input line holds a 'question', and any other fields (e.g. an 'id'), which are copied to the
+    output line along with the 'answer', 'error' and 'seconds'. Output lines are written as the answers
+    complete, so they are not in input order.
+
+    Args:
+        input_path (str): Path of the JSONL file of questions.
+        output_path (str): Path of the JSONL file the answers are written to.
+        max_concurrency (int): Maximum number of questions answered at the same time.
+    """
+    with open(input_path, "r") as file:
+        items = [json.loads(line) for line in file if line.strip()]
+    if not items:
+        print(f"No questions in {input_path}")
+        return
+
+    start = time.perf_counter()
+    seconds, errors = [], 0
+    with open(output_path, "w") as file:
+        for result in rag_batch([item["question"] for item in items], max_concurrency):
+            answer = {key: result[key] for key in ("answer", "error", "seconds")}
+            file.write(json.dumps({**items[result["index"]], **answer}) + "\n")
+            file.flush()
+            seconds.append(result["seconds"])
+            errors += result["error"] is not None
+    elapsed = time.perf_counter() - start
+
+    seconds.sort()
+    print(
+        f"Answered {len(items)} questions ({errors} failed) in {elapsed:.1f} s ({len(items) / elapsed:.2f} questions/s), "
+        f"latency p50 {percentile(seconds, 0.5):.2f} s, p95 {percentile(seconds, 0.95):.2f} s"
+    )
+    print(f"Answer cache: {get_answer_cache().stats()}")
+
+
 def rag_cl():
     """Interactive command-line interface to continuously run the RAG process.
 
-    Prompts the user for questions, retrieves context, and generates answers until the user quits.
+    Prompts the user for questions and streams the answers of the QA service (see qa_service.py) until the
+    user quits.
     """
-    rag_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | custom_rag_prompt
-        | llm
-        | StrOutputParser()
-    )
+    from qa_client import QAServiceError, stream_answer
 
     while (prompt := input("Enter a prompt (q to quit): ")) != "q":
-        result = rag_chain.invoke(prompt)
-
-        print("\n" + result)
+        print()
+        try:
+            for chunk in stream_answer(prompt):
+                print(chunk, end="", flush=True)
+        except QAServiceError as e:
+            print(e)
+        print()
 
 
 if __name__ == "__main__":
-    # If this script is executed directly, start the interactive RAG command-line interface.
-    rag_cl()
+    parser = argparse.ArgumentParser(
+        description="Ask questions about the trending papers."
+    )
+    parser.add_argument(
+        "--batch", metavar="QUESTIONS", help="JSONL file of questions to answer"
+    )
+    parser.add_argument(
+        "--output",
+        default="answers.jsonl",
+        help="JSONL file the answers are written to",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.batch:
+        rag_batch_file(args.batch, args.output, args.max_concurrency)
+        print_report()
+        save_report()
+    else:
+        # Without a batch, start the interactive RAG command-line interface.
+        rag_cl()
@@ -0,0 +1,175 @@
+import functools
+import math
+import re
+from collections import Counter, defaultdict
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from instrumentation import span
+
+
+def tokenize(text: str) -> list:
+    """Splits a text into lower case word tokens."""
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """In-process BM25 inverted index over a list of documents.
+
+    Args:
+        documents (list): The documents to index.
+        k1 (float): Term frequency saturation.
+        b (float): Document length normalization.
+    """
+
+    def __init__(self, documents: list, k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for i, document in enumerate(documents):
+            tokens = tokenize(document.page_content)
+            self.lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings[term].append((i, frequency))
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if documents else 0
+        n = len(documents)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = 20) -> list:
+        """Returns the `k` best matching documents for `query`, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, frequency in self.postings[term]:
+                norm = self.k1 * (
+                    1 - self.b + self.b * self.lengths[i] / self.average_length
+                )
+                scores[i] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [self.documents[i] for i in best]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """Fuses several rankings of documents into one with reciprocal rank fusion.
+
+    Documents are identified by their text, so the same chunk returned by different retrievers is merged.
+
+    Args:
+        rankings (list): Lists of documents, each ordered best first.
+        k (int): Smoothing constant; larger values flatten the influence of the top ranks.
+
+    Returns:
+        list: The unique documents ordered by fused score, best first.
+    """
+    scores = defaultdict(float)
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            scores[document.page_content] += 1 / (k + rank + 1)
+            documents.setdefault(document.page_content, document)
+
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever fusing dense vector search and BM25 keyword search, with an optional rerank stage.
+
+    Both searches return `fetch_k` candidates, which are fused with reciprocal rank fusion. The fused
+    candidates are then optionally reranked with maximal marginal relevance ('mmr', which reuses the
+    chunk embeddings of the 'chunks' embedding artifact, or of the embedding cache, and drops
+    near-duplicate chunks) or a local cross-encoder ('cross-encoder'),
+    and the best `k` are returned.
+    """
+
+    vectordb: object
+    bm25: BM25Index
+    k: int = 4
+    fetch_k: int = 20
+    rerank: str = "none"
+    mmr_lambda: float = 0.7
+    cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    artifact: object = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_vectordb(cls, vectordb, **kwargs) -> "HybridRetriever":
+        """Builds the BM25 index over every chunk stored in the vector database."""
+        stored = vectordb.get(include=["documents", "metadatas"])
+        documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(stored["documents"], stored["metadatas"])
+        ]
+        return cls(vectordb=vectordb, bm25=BM25Index(documents), **kwargs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list:
+        with span("retrieval.dense"):
+            dense = self.vectordb.similarity_search(query, k=self.fetch_k)
+        with span("retrieval.bm25"):
+            sparse = self.bm25.search(query, k=self.fetch_k)
+        candidates = reciprocal_rank_fusion([dense, sparse])[: self.fetch_k]
+        if not candidates:
+            return []
+
+        if self.rerank == "mmr":
+            with span("retrieval.rerank", method="mmr"):
+                return self._mmr(query, candidates)
+        if self.rerank == "cross-encoder":
+            with span("retrieval.rerank", method="cross-encoder"):
+                return self._cross_encode(query, candidates)
+        return candidates[: self.k]
+
+    def _mmr(self, query: str, candidates: list) -> list:
+        import numpy as np
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+        embeddings = self.vectordb.embeddings
+        texts = [doc.page_content for doc in candidates]
+        vectors = (
+            self.artifact.get_many(texts)
+            if self.artifact is not None
+            else [None] * len(texts)
+        )
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+
+        selected = maximal_marginal_relevance(
+            np.array(embeddings.embed_query(query)),
+            np.array(vectors),
+            lambda_mult=self.mmr_lambda,
+            k=self.k,
+        )
+        return [candidates[i] for i in selected]
+
+    def _cross_encode(self, query: str, candidates: list) -> list:
+        scores = load_cross_encoder(self.cross_encoder_model).predict(
+            [(query, doc.page_content) for doc in candidates]
+        )
+        ranked = sorted(zip(scores, range(len(candidates))), reverse=True)
+        return [candidates[i] for _, i in ranked[: self.k]]
+
+
+@functools.lru_cache(maxsize=None)
+def load_cross_encoder(model_name: str):
+    """Loads a sentence-transformers cross-encoder once per process."""
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(model_name)
@@ -2,7 +2,27 @@
 import json
 
 
-def get_summaries() -> list:
+def format_summary(paper: dict, number: int) -> str:
+    """Formats the title, authors, publication date, link and summary of a paper for display.
+
+    Args:
+        paper (dict): The metadata of the paper.
+        number (int): The position of the paper in the listing.
+
+    Returns:
+        str: The formatted summary string.
+    """
+    return (
+        f"\n#{number}\n{paper['title']}\n"
+        f"\nAuthors: {paper['authors']}\n"
+        f"\nPublished: {paper['published']}\n"
+        f"\nLink to paper: {paper['arxiv_link']}\n"
+        "\nSummary:\n"
+        f"\n{paper['summary']}"
+    )
+
+
+def get_summaries(filename: str = "data/paper_metadata.json") -> list:
     """
     Loads paper metadata from a JSON file and extracts summaries for each paper.
 
@@ -11,35 +31,19 @@ def get_summaries() -> list:
     paper's title, authors, publication date, link to the paper, and the summary text itself.
     These summary strings are compiled into a list, with each element representing a single paper's summary.
 
+    Args:
+        filename (str): Path of the paper metadata file.
+
     Returns:
         list of str: A list containing formatted summary strings for each paper. Each summary string
         includes the paper's title, authors, publication date, a link to the paper, and the summary text.
     """
-    # Specify the filename
-    filename = "data/paper_metadata.json"
-
     # Write the dictionary to a file
     with open(filename, "r") as file:
         paper_metadata = json.load(file)
 
-    # List for paper summaries
-    paper_summaries = []
-
-    i = 0
-    for paper in paper_metadata:
-        i += 1
-        # Concatenate all the required information into a single string for each paper
-        summary_string = (
-            f"\n#{i}\n{paper['title']}\n"
-            f"\nAuthors: {paper['authors']}\n"
-            f"\nPublished: {paper['published']}\n"
-            f"\nLink to paper: {paper['arxiv_link']}\n"
-            "\nSummary:\n"
-            f"\n{paper['summary']}"
-        )
-        paper_summaries.append(summary_string)
-
-    return paper_summaries
+    # Concatenate all the required information into a single string for each paper
+    return [format_summary(paper, i + 1) for i, paper in enumerate(paper_metadata)]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+import os
+import xml.etree.ElementTree as ET
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from arxiv_api import ATOM_NS, fetch_arxiv_metadata, parse_feed, strip_version
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), "r") as file:
+        return file.read()
+
+
+class FakeArxiv:
+    """Session answering arXiv API queries from the recorded feed.
+
+    Args:
+        omitted (set): Identifiers left out of feeds asking for more than one id.
+        failing (callable, optional): Given the requested ids, whether the request fails with HTTP 500.
+    """
+
+    def __init__(self, omitted: set = (), failing=None):
+        self.omitted = set(omitted)
+        self.failing = failing or (lambda ids: False)
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None):
+        query = parse_qs(urlparse(url).query)
+        ids = query["id_list"][0].split(",")
+        self.requests.append((ids, int(query["max_results"][0])))
+
+        response = requests.Response()
+        response.url = url
+        if self.failing(ids):
+            response.status_code = 500
+            response._content = b"Internal Server Error"
+            return response
+
+        wanted = {strip_version(id) for id in ids}
+        if len(ids) > 1:
+            wanted -= {strip_version(id) for id in self.omitted}
+        root = ET.fromstring(read_fixture("arxiv_feed.xml"))
+        for entry in root.findall("atom:entry", ATOM_NS):
+            entry_id = entry.findtext("atom:id", namespaces=ATOM_NS)
+            if strip_version(entry_id.split("/abs/")[-1]) not in wanted:
+                root.remove(entry)
+        response.status_code = 200
+        response._content = ET.tostring(root, encoding="utf-8")
+        response.encoding = "utf-8"
+        return response
+
+
+def test_parse_feed_fields():
+    metadata = parse_feed(read_fixture("arxiv_feed.xml"))
+
+    assert set(metadata) == {"1706.03762", "1810.04805", "2005.14165"}
+    assert metadata["1706.03762"] == {
+        # The date of the latest version, not of the first one.
+        "published": "2023-08-02",
+        "authors": "Ashish Vaswani, Noam Shazeer, Niki Parmar",
+        "summary": "The dominant sequence transduction models are based on complex recurrent or\n"
+        "convolutional neural networks in an encoder-decoder configuration. We propose a\n"
+        "new simple network architecture, the Transformer.",
+    }
+    assert metadata["1810.04805"]["authors"] == (
+        "Jacob Devlin, Ming-Wei Chang, Kenton Lee, Kristina Toutanova"
+    )
+
+
+def test_parse_feed_skips_error_entries():
+    assert parse_feed(read_fixture("arxiv_error_feed.xml")) == {}
+
+
+def test_fetch_chunks_the_id_list():
+    session = FakeArxiv()
+    doc_nums = ["1706.03762v7", "1810.04805", "2005.14165v4"]
+
+    metadata = fetch_arxiv_metadata(doc_nums, session, chunk_size=2)
+
+    assert session.requests == [
+        (["1706.03762v7", "1810.04805"], 2),
+        (["2005.14165v4"], 1),
+    ]
+    # Results are keyed by the document numbers as given, versions included.
+    assert list(metadata) == doc_nums
+    assert metadata["2005.14165v4"]["published"] == "2020-07-22"
+
+
+def test_fetch_looks_up_ids_omitted_from_the_feed_one_at_a_time():
+    session = FakeArxiv(omitted={"1810.04805"})
+    doc_nums = ["1706.03762v7", "1810.04805", "2005.14165v4", "9999.99999"]
+
+    metadata = fetch_arxiv_metadata(doc_nums, session)
+
+    assert session.requests == [
+        (doc_nums, 4),
+        (["1810.04805"], 1),
+        (["9999.99999"], 1),
+    ]
+    assert list(metadata) == ["1706.03762v7", "1810.04805", "2005.14165v4"]
+
+
+def test_fetch_falls_back_one_at_a_time_when_a_chunk_fails():
+    # Bulk requests fail, and so does the lookup of one of the ids on its own.
+    session = FakeArxiv(failing=lambda ids: len(ids) > 1 or ids == ["1810.04805"])
+    doc_nums = ["1706.03762v7", "1810.04805", "2005.14165v4"]
+
+    metadata = fetch_arxiv_metadata(doc_nums, session)
+
+    assert session.requests == [(doc_nums, 3)] + [([id], 1) for id in doc_nums]
+    assert list(metadata) == ["1706.03762v7", "2005.14165v4"]
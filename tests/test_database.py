@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from database import (
+    connect_read_only,
+    count_papers,
+    get_papers,
+    get_topics,
+    insert_or_update_database,
+    query_papers,
+    save_topics,
+)
+
+
+def paper(i):
+    return {
+        "url": f"https://paperswithcode.com/paper/paper-{i}",
+        "title": f"Paper {i}",
+        "arxiv_link": f"https://arxiv.org/pdf/2401.{i:05d}v1.pdf",
+        "published": f"2024-01-{1 + i:02d}",
+        "authors": "Ada Lovelace",
+        "summary": f"Abstract {i}.",
+    }
+
+
+def test_writers_migrate_an_old_database(tmp_path):
+    path = str(tmp_path / "papers.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE papers (url TEXT PRIMARY KEY, title TEXT, arxiv_link TEXT, "
+            "published DATE, authors TEXT, summary TEXT)"
+        )
+    conn.close()
+
+    insert_or_update_database([paper(0), paper(1)], path)
+    save_topics({0: ["attention"]}, {paper(1)["url"]: 0}, path)
+
+    assert count_papers(path=path) == 2
+    assert [p["url"] for p in query_papers(topic_id=0, path=path)] == [paper(1)["url"]]
+    assert [p["arxiv_id"] for p in query_papers(trending=True, path=path)] == [
+        "2401.00000",
+        "2401.00001",
+    ]
+    assert get_topics(path) == [{"topic_id": 0, "keywords": ["attention"]}]
+    assert [p["url"] for p in get_papers(without_topic=True, path=path)] == [
+        paper(0)["url"]
+    ]
+
+
+def test_readers_do_not_write(tmp_path):
+    path = str(tmp_path / "papers.db")
+    insert_or_update_database([paper(0)], path)
+
+    conn = connect_read_only(path)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM papers")
+    finally:
+        conn.close()
+
+    # Queries do not create a missing database either.
+    with pytest.raises(sqlite3.OperationalError):
+        count_papers(path=str(tmp_path / "missing.db"))
+    assert not (tmp_path / "missing.db").exists()
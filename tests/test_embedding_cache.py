@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def test_get_many_is_consistent_with_concurrent_eviction(tmp_path):
+    # Two instances stand for two processes sharing the cache, each with its own connection and mapping.
+    reader = EmbeddingCache("model", str(tmp_path), max_entries=2)
+    writer = EmbeddingCache("model", str(tmp_path), max_entries=2)
+    reader.put_many(["a", "b"], [[1.0, 1.0], [2.0, 2.0]])
+
+    evicted = threading.Event()
+
+    def evict():
+        writer.put_many(["c"], [[3.0, 3.0]])
+        evicted.set()
+
+    ensure_rows = reader._ensure_rows
+
+    def evict_between_lookup_and_read(rows):
+        # Give the writer every chance to evict 'a' or 'b' and reuse its row before the vectors are read.
+        thread = threading.Thread(target=evict)
+        thread.start()
+        evicted.wait(0.5)
+        ensure_rows(rows)
+
+    reader._ensure_rows = evict_between_lookup_and_read
+    vectors = reader.get_many(["a", "b"])
+    reader._ensure_rows = ensure_rows
+
+    np.testing.assert_array_equal(vectors, [[1.0, 1.0], [2.0, 2.0]])
+    assert evicted.wait(5)
+    assert [vector is None for vector in reader.get_many(["a", "b", "c"])].count(
+        True
+    ) == 1
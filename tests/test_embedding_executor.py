@@ -0,0 +1,247 @@
+import base64
+import email.utils
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+import embedding_executor
+from embedding_cache import EmbeddingCache
+from embedding_executor import BatchedEmbeddings, RateBudget
+
+
+class WordEncoding:
+    """Counts one token per word, so batch sizes do not depend on the tiktoken vocabulary."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+def vector(text: str) -> list:
+    digest = hashlib.sha256(text.encode()).digest()
+    return [byte / 255 for byte in digest[:8]]
+
+
+class FakeEmbeddingsServer:
+    """Local server speaking the OpenAI embeddings API.
+
+    Every request records its inputs in `requests`. Responses queued in `failures` (status and headers)
+    are sent instead of embeddings, one per request, and requests with an input in `poison` fail with 500.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.failures = []
+        self.poison = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                inputs = body["input"]
+                server.requests.append(inputs)
+
+                if server.failures or server.poison.intersection(inputs):
+                    status, headers = (
+                        server.failures.pop(0) if server.failures else (500, {})
+                    )
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    payload = json.dumps({"error": {"message": "try again"}}).encode()
+                else:
+                    data = []
+                    for i, text in enumerate(inputs):
+                        embedding = vector(text)
+                        if body.get("encoding_format") == "base64":
+                            embedding = base64.b64encode(
+                                np.asarray(embedding, dtype=np.float32).tobytes()
+                            ).decode()
+                        data.append(
+                            {"object": "embedding", "index": i, "embedding": embedding}
+                        )
+                    payload = json.dumps(
+                        {
+                            "object": "list",
+                            "data": data,
+                            "model": body["model"],
+                            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                        }
+                    ).encode()
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/v1"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    server = FakeEmbeddingsServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def word_encoding(monkeypatch):
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: WordEncoding())
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the delays slept by the executor instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(embedding_executor.time, "sleep", delays.append)
+    return delays
+
+
+class OpenAIClientEmbeddings(Embeddings):
+    """Embeds through the OpenAI client, without the token-level chunking of `OpenAIEmbeddings`.
+
+    The client's own retries are off, so every failure reaches the executor.
+    """
+
+    def __init__(self, server):
+        from openai import OpenAI
+
+        self.client = OpenAI(base_url=server.url, api_key="test", max_retries=0)
+
+    def embed_documents(self, texts):
+        response = self.client.embeddings.create(
+            input=texts, model="text-embedding-ada-002"
+        )
+        return [item.embedding for item in response.data]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_batches_are_token_aware(server):
+    executor = BatchedEmbeddings(
+        OpenAIClientEmbeddings(server), max_batch_tokens=10, max_batch_size=3
+    )
+    texts = ["one two three four", "five six seven", "eight nine", "ten", "a b", "c"]
+
+    assert executor.batches(texts) == [([0, 1, 2], 9), ([3, 4, 5], 4)]
+    # One long text still goes out, on its own.
+    assert executor.batches(["w " * 20, "x"]) == [([0], 20), ([1], 1)]
+
+    vectors = executor.embed_documents(texts)
+    # The batches are sent concurrently, in any order.
+    assert sorted(server.requests) == [texts[:3], texts[3:]]
+    np.testing.assert_allclose(vectors, [vector(text) for text in texts], rtol=1e-6)
+    assert executor.metrics["requests"] == 2 and executor.metrics["tokens"] == 13
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_budget_blocks_once_tokens_are_exhausted(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(embedding_executor.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(embedding_executor.time, "sleep", clock.sleep)
+    budget = RateBudget(tokens_per_minute=100, requests_per_minute=100)
+
+    budget.acquire(60)
+    budget.acquire(40)
+    assert clock.now == 0
+    budget.acquire(10)
+    assert 60 <= clock.now < 61
+
+
+def test_budget_blocks_once_requests_are_exhausted(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(embedding_executor.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(embedding_executor.time, "sleep", clock.sleep)
+    budget = RateBudget(tokens_per_minute=10**6, requests_per_minute=2)
+
+    budget.acquire(1)
+    clock.now = 30
+    budget.acquire(1)
+    budget.acquire(1)
+    # The first request leaves the window a minute after it was sent.
+    assert 60 <= clock.now < 61
+
+
+def test_retry_honors_retry_after_seconds(server, sleeps):
+    server.failures = [(429, {"Retry-After": "7"})]
+    executor = BatchedEmbeddings(OpenAIClientEmbeddings(server))
+
+    np.testing.assert_allclose(
+        executor.embed_documents(["hello"]), [vector("hello")], rtol=1e-6
+    )
+    assert sleeps == [7.0]
+    assert len(server.requests) == 2 and executor.metrics["retries"] == 1
+
+
+def test_retry_honors_retry_after_date(server, sleeps):
+    server.failures = [
+        (429, {"Retry-After": email.utils.formatdate(time.time() + 30, usegmt=True)})
+    ]
+    executor = BatchedEmbeddings(OpenAIClientEmbeddings(server))
+
+    executor.embed_documents(["hello"])
+    assert len(sleeps) == 1 and 28 <= sleeps[0] <= 30
+
+
+def test_retry_backs_off_exponentially_without_retry_after(server, sleeps):
+    server.failures = [(500, {}), (500, {}), (503, {})]
+    executor = BatchedEmbeddings(OpenAIClientEmbeddings(server), max_retries=3)
+
+    executor.embed_documents(["hello"])
+    # Attempt n waits 2**n seconds, with jitter between half and one and a half times that.
+    assert [0.5 * 2**n <= delay < 1.5 * 2**n for n, delay in enumerate(sleeps)] == [
+        True
+    ] * 3
+
+
+def test_failed_run_resumes_from_the_cache(server, sleeps, tmp_path):
+    texts = [f"text {i}" for i in range(8)]
+    server.poison = {"text 5"}
+
+    def executor():
+        return BatchedEmbeddings(
+            OpenAIClientEmbeddings(server),
+            cache=EmbeddingCache("fake", str(tmp_path)),
+            max_batch_size=2,
+            max_concurrency=1,
+            max_retries=1,
+        )
+
+    with pytest.raises(Exception):
+        executor().embed_documents(texts)
+    # The batch holding 'text 5' failed twice; the other batches completed.
+    assert sorted(map(tuple, server.requests)) == sorted(
+        [tuple(texts[i : i + 2]) for i in range(0, 8, 2)] + [("text 4", "text 5")]
+    )
+
+    server.requests.clear()
+    server.poison.clear()
+    vectors = executor().embed_documents(texts)
+    assert server.requests == [["text 4", "text 5"]]
+    np.testing.assert_allclose(vectors, [vector(text) for text in texts], rtol=1e-6)
@@ -0,0 +1,73 @@
+import hashlib
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from indexing import load_manifest, update_vector_database
+from vectorstore import FaissStore
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic embeddings derived from the hash of the text."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        digest = hashlib.sha256(text.encode()).digest()
+        return [byte / 255 for byte in digest[:8]]
+
+
+def paper(i):
+    return {
+        "arxiv_link": f"https://arxiv.org/pdf/2401.{i:05d}v1.pdf",
+        "title": f"Paper {i}",
+        "summary": f"Abstract {i}.",
+    }
+
+
+def chunks(paper):
+    return [
+        Document(page_content=f"{paper['title']} chunk {j}", metadata={"chunk": j})
+        for j in range(3)
+    ]
+
+
+def test_interrupted_faiss_update_resumes(tmp_path):
+    papers = [paper(i) for i in range(4)]
+    directory = str(tmp_path / "faiss")
+    manifest_path = str(tmp_path / "manifest.json")
+
+    def interrupted(changed):
+        for i, p in enumerate(changed):
+            if i == 2:
+                raise KeyboardInterrupt
+            yield p, chunks(p)
+
+    with pytest.raises(KeyboardInterrupt):
+        update_vector_database(
+            papers,
+            FaissStore(directory, HashEmbeddings(), index_type="flat"),
+            interrupted,
+            manifest_path=manifest_path,
+            vector_store="faiss",
+        )
+    # Nothing was persisted, so the manifest must not claim any paper.
+    assert load_manifest(manifest_path)["papers"] == {}
+
+    stats = update_vector_database(
+        papers,
+        FaissStore(directory, HashEmbeddings(), index_type="flat"),
+        lambda changed: ((p, chunks(p)) for p in changed),
+        manifest_path=manifest_path,
+        vector_store="faiss",
+    )
+    assert stats["indexed"] == 4 and stats["skipped"] == 0
+
+    store = FaissStore(directory, HashEmbeddings(), index_type="flat")
+    manifest = load_manifest(manifest_path)
+    assert len(manifest["papers"]) == 4
+    assert sorted(store.ids) == sorted(
+        id for entry in manifest["papers"].values() for id in entry["chunk_ids"]
+    )
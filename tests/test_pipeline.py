@@ -0,0 +1,45 @@
+from pipeline import Stage, default_stages, refresh
+
+
+def test_refresh_runs_stages_in_order(tmp_path):
+    calls = []
+
+    def write(name):
+        def run():
+            calls.append(name)
+            (tmp_path / name).write_text(name)
+
+        return run
+
+    stages = [
+        Stage("a", write("a"), outputs=(str(tmp_path / "a"),)),
+        Stage("b", write("b"), depends=("a",), outputs=(str(tmp_path / "b"),)),
+    ]
+    state_path = str(tmp_path / "state.json")
+
+    report = refresh(stages, state_path=state_path)
+    assert {name: entry["status"] for name, entry in report.items()} == {
+        "a": "ran",
+        "b": "ran",
+    }
+    assert calls == ["a", "b"]
+
+    # Nothing changed, so a second refresh skips both stages.
+    report = refresh(stages, state_path=state_path)
+    assert {name: entry["status"] for name, entry in report.items()} == {
+        "a": "skipped",
+        "b": "skipped",
+    }
+    assert calls == ["a", "b"]
+
+
+def test_default_stages_read_abstracts_after_the_index():
+    depends = {stage.name: stage.depends for stage in default_stages()}
+
+    assert depends == {
+        "papers": (),
+        "index": ("papers",),
+        "chunk_embeddings": ("index",),
+        "abstract_embeddings": ("index",),
+        "topics": ("abstract_embeddings",),
+    }
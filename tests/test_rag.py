@@ -0,0 +1,27 @@
+import rag
+
+
+def test_each_client_keeps_its_chain_until_the_index_changes(monkeypatch):
+    version = ["v1"]
+    builds = []
+
+    def build_rag_chain(version, async_http_client=None):
+        builds.append((version, async_http_client))
+        return object()
+
+    monkeypatch.setattr(rag, "index_version", lambda: version[0])
+    monkeypatch.setattr(rag, "build_rag_chain", build_rag_chain)
+    rag.rag_chains.cache_clear()
+    client = object()
+
+    sync_chain = rag.get_rag_chain()
+    service_chain = rag.get_rag_chain(client)
+    # Alternating between the sync path and the service reuses both chains.
+    assert rag.get_rag_chain() is sync_chain
+    assert rag.get_rag_chain(client) is service_chain
+    assert builds == [("v1", None), ("v1", client)]
+
+    version[0] = "v2"
+    assert rag.get_rag_chain(client) is not service_chain
+    assert builds[-1] == ("v2", client)
+    rag.rag_chains.cache_clear()
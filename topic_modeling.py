@@ -1,56 +1,111 @@
+import argparse
 import json
-import pickle
 import os
+import shutil
+import time
 import dotenv
-from sentence_transformers import SentenceTransformer
-from umap import UMAP
-from hdbscan import HDBSCAN
-from sklearn.feature_extraction.text import CountVectorizer
-import openai
-from bertopic.representation import OpenAI, KeyBERTInspired
-from bertopic import BERTopic
+from database import get_papers, save_topics
+from instrumentation import print_report, save_report, span
 
+# The models below pull in torch, UMAP, HDBSCAN and BERTopic, so they are only imported when topic modeling runs.
 
-def topic_modeling():
+TOPIC_MODEL_DIRECTORY = "data/topic_model"
+TOPIC_STATE_PATH = "data/topic_model_state.json"
+
+
+def cached_backend(embeddings):
+    """Wraps cached LangChain embeddings, e.g. `CachedEmbeddings`, as a BERTopic embedding backend.
+
+    BERTopic also embeds the topic keywords through this backend (e.g. for KeyBERTInspired), so those
+    are cached too.
     """
-    Performs topic modeling on a dataset of paper summaries and titles loaded from a JSON file.
-    This process involves several steps including loading and preprocessing data, generating
-    text embeddings, reducing dimensionality, clustering to identify topics, and finally,
-    saving the processed topic data for future use.
+    import numpy as np
+    from bertopic.backend import BaseEmbedder
 
-    The function uses a pre-trained SentenceTransformer model to generate embeddings for the abstracts,
-    UMAP for dimensionality reduction, HDBSCAN for clustering, CountVectorizer for improving topic representation,
-    and KeyBERTInspired model for keyword extraction-based topic labeling. Optionally, an OpenAI GPT-3.5 model can
-    be used for generating topic labels based on the documents and keywords.
+    class CachedBackend(BaseEmbedder):
+        def embed(self, documents, verbose=False):
+            return np.array(
+                embeddings.embed_documents(list(documents)), dtype=np.float32
+            )
 
-    Environmental Variables:
-    - OPENAI_API_KEY: The API key for OpenAI, loaded from a .env file.
+    return CachedBackend()
 
-    Outputs:
-    - Saves the topics, probabilities, number of topics, and detailed topic information in a pickle file
-      named 'topic_data.pkl' within the 'data' directory.
 
-    Returns:
-    - None
+def embed_abstracts(abstracts: list, embeddings):
+    """Returns the embeddings of the abstracts, read from the 'abstracts' embedding artifact where possible.
+
+    The artifact is written with the embedding model of the vector database, so topic modeling needs no
+    model of its own. Abstracts missing from the artifact are embedded through the embedding cache.
     """
-    # Load environment variables from .env file
-    dotenv.load_dotenv()
+    import numpy as np
+    from embedding_artifacts import load_artifact
+
+    model = embeddings.cache.model_name
+    artifact = load_artifact("abstracts", model=model)
+    vectors = (
+        artifact.get_many(abstracts)
+        if artifact is not None
+        else [None] * len(abstracts)
+    )
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        computed = embeddings.embed_documents([abstracts[i] for i in missing])
+        for i, vector in zip(missing, computed):
+            vectors[i] = vector
+    print(
+        f"Abstract embeddings: {len(abstracts) - len(missing)} precomputed, {len(missing)} embedded"
+    )
+    return np.array(vectors, dtype=np.float32)
+
+
+def topic_similarity(topic_model, embeddings):
+    """Returns the cosine similarity of each document embedding to the nearest topic embedding."""
+    import numpy as np
+    from sklearn.metrics.pairwise import cosine_similarity
 
-    # Load paper metadata from a JSON file.
-    filename = "data/paper_metadata.json"
+    return cosine_similarity(embeddings, np.array(topic_model.topic_embeddings_)).max(
+        axis=1
+    )
+
+
+def load_state(filename: str = TOPIC_STATE_PATH) -> dict:
+    """Loads the record of the last full fit of the topic model, or None if there is none."""
+    if not os.path.exists(filename) or not os.path.isdir(TOPIC_MODEL_DIRECTORY):
+        return None
     with open(filename, "r") as file:
-        paper_metadata = json.load(file)
+        return json.load(file)
+
+
+def fit_topic_model(papers: list, embedding_model) -> dict:
+    """
+    Fits the topic model on all papers from scratch, saves it and assigns every paper a topic.
+
+    The abstract embeddings are reduced with UMAP, clustered with HDBSCAN, and the topics are described
+    with CountVectorizer and KeyBERTInspired keywords. Optionally, an OpenAI GPT-3.5 model can be used for
+    generating topic labels based on the documents and keywords.
 
-    # Extract summaries and titles from the metadata.
-    abstracts = []
-    titles = []
-    for paper in paper_metadata:
-        abstracts.append(paper["summary"])
-        titles.append(paper["title"])
+    The fitted model is saved with safetensors to 'data/topic_model', without UMAP and HDBSCAN: the saved
+    model assigns new papers to the topic with the most similar embedding, so it loads and predicts fast.
 
-    # Generate embeddings for the abstracts using a pre-trained SentenceTransformer model.
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-    embeddings = embedding_model.encode(abstracts, show_progress_bar=True)
+    Args:
+        papers (list of dict): The papers, each with its 'url' and 'summary'.
+        embedding_model (CachedEmbeddings): The model embedding the abstracts and the topic keywords.
+
+    Returns:
+        dict: The state of the fit, as saved to data/topic_model_state.json.
+    """
+    from umap import UMAP
+    from hdbscan import HDBSCAN
+    from sklearn.feature_extraction.text import CountVectorizer
+    import openai
+    from bertopic.representation import OpenAI, KeyBERTInspired
+    from bertopic import BERTopic
+
+    abstracts = [paper["summary"] for paper in papers]
+
+    # Reuse the embeddings of the abstracts computed for the vector database.
+    with span("topics.embed"):
+        embeddings = embed_abstracts(abstracts, embedding_model)
 
     # Use UMAP to reduce the dimensionality of embeddings, aiming to reduce stochastic behavior.
     umap_model = UMAP(
@@ -103,7 +158,7 @@ def topic_modeling():
     # Initialize and fit the BERTopic model with the specified models and hyperparameters.
     topic_model = BERTopic(
         # Pipeline models
-        embedding_model=embedding_model,
+        embedding_model=cached_backend(embedding_model),
         umap_model=umap_model,
         hdbscan_model=hdbscan_model,
         vectorizer_model=vectorizer_model,
@@ -114,52 +169,159 @@ def topic_modeling():
     )
 
     # Transform the abstracts into topics and probabilities.
-    topics, probs = topic_model.fit_transform(abstracts, embeddings)
+    with span("topics.fit", papers=len(abstracts)):
+        topics, probs = topic_model.fit_transform(abstracts, embeddings)
 
     # # Use ChatGPT's labels
     # chatgpt_topic_labels = {topic: " | ".join(list(zip(*values))[0]) for topic, values in topic_model.topic_aspects_["OpenAI"].items()}
     # chatgpt_topic_labels[-1] = "Outlier Topic"
     # topic_model.set_topic_labels(chatgpt_topic_labels)
 
-    # # Update metadata with topics
-    # for i, paper in enumerate(paper_metadata):
-    #     topic_id = topics[i]
-    #     topic_list = topic_model.get_topic_info()['KeyBERT'][topic_id]
+    # Collect the keywords of each topic.
+    topic_info = topic_model.get_topic_info()
+    topic_lists = list(topic_info["KeyBERT"])
+
+    # Save the topics and the topic of every paper to the paper database, which the app queries.
+    save_topics(
+        dict(zip(topic_info["Topic"], topic_lists)),
+        {paper["url"]: topic for paper, topic in zip(papers, topics)},
+    )
+
+    # Save the fitted model to a temporary directory first, so a failed save keeps the previous model.
+    temporary_directory = TOPIC_MODEL_DIRECTORY + ".tmp"
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+    # No pointer to a sentence-transformers model is saved: the embedding model is passed in on load.
+    topic_model.save(
+        temporary_directory,
+        serialization="safetensors",
+        save_ctfidf=True,
+        save_embedding_model=False,
+    )
+    shutil.rmtree(TOPIC_MODEL_DIRECTORY, ignore_errors=True)
+    os.replace(temporary_directory, TOPIC_MODEL_DIRECTORY)
+
+    # Papers assigned later are compared against how well the papers of this fit match their topics.
+    state = {
+        "fitted_at": time.time(),
+        "embedding_model": embedding_model.cache.model_name,
+        "n_papers": len(papers),
+        "n_topics": len(topic_lists),
+        "similarity": float(topic_similarity(topic_model, embeddings).mean()),
+    }
+    with open(TOPIC_STATE_PATH, "w") as file:
+        json.dump(state, file, indent=4)
 
-    #     paper['topic_id'] = topic_id
-    #     paper['topics'] = topic_list
+    print(f"Topic model fitted on {len(papers)} papers: {len(topic_lists)} topics")
+    return state
 
-    # with open(filename, 'w') as file:
-    #     json.dump(paper_metadata, file, indent=4)
 
-    # print("Metadata updated with topics!")
+def assign_topics(
+    papers: list, embedding_model, state: dict, drift_threshold: float = 0.1
+) -> bool:
+    """
+    Assigns new papers to the topics of the saved topic model, without refitting it.
 
-    # Extract and count the number of topics identified.
-    n_topic_list = len(topic_model.get_topic_info()["KeyBERT"])
+    Only the new abstracts are embedded, and each paper gets the topic with the most similar embedding, so
+    the cost is proportional to the number of new papers. When the new papers match the topics clearly
+    worse than the papers of the last fit did, the topics have drifted and nothing is assigned.
 
-    # Collect detailed information about each topic.
-    topic_lists = []
-    for i in range(n_topic_list):
-        topic_lists.append(topic_model.get_topic_info()["KeyBERT"][i])
+    Args:
+        papers (list of dict): The new papers, each with its 'url' and 'summary'.
+        embedding_model (CachedEmbeddings): The model embedding the abstracts.
+        state (dict): The state of the last fit, see `fit_topic_model`.
+        drift_threshold (float): Drop in the mean topic similarity of the new papers, compared to the
+                                 papers of the last fit, above which the topics count as drifted.
 
-    # Prepare a dictionary to save topic data.
-    topics_dict = {
-        "topics": topics,
-        "probs": probs,
-        "n_topic_list": n_topic_list,
-        "topic_lists": topic_lists,
-    }
+    Returns:
+        bool: False if the topics have drifted and the model should be refit.
+    """
+    from bertopic import BERTopic
 
-    # Save the topic data to a pickle file for easy loading.
-    filename = "data/topic_data.pkl"
+    abstracts = [paper["summary"] for paper in papers]
+    with span("topics.embed"):
+        embeddings = embed_abstracts(abstracts, embedding_model)
 
-    with open(filename, "wb") as file:
-        pickle.dump(topics_dict, file)
+    topic_model = BERTopic.load(
+        TOPIC_MODEL_DIRECTORY, embedding_model=cached_backend(embedding_model)
+    )
+    similarity = float(topic_similarity(topic_model, embeddings).mean())
+    drift = state["similarity"] - similarity
+    print(
+        f"Topic similarity of {len(papers)} new papers: {similarity:.3f} (drift {drift:.3f})"
+    )
+    if drift > drift_threshold:
+        return False
+
+    with span("topics.assign", papers=len(abstracts)):
+        topics, _ = topic_model.transform(abstracts, embeddings)
+    save_topics(None, {paper["url"]: topic for paper, topic in zip(papers, topics)})
+    print(f"Assigned topics to {len(papers)} new papers")
+    return True
+
+
+def topic_modeling(
+    refit: bool = False, refit_days: float = 7, drift_threshold: float = 0.1
+):
+    """
+    Keeps the topics of the papers in the paper database up to date.
+
+    New papers are assigned to the topics of the saved topic model, so a daily update only embeds and
+    assigns the new papers. The topic model is refit from scratch on all papers only when asked to, when
+    the last fit is older than `refit_days` or used another embedding model, or when the new papers have
+    drifted away from the topics.
+
+    Environmental Variables:
+    - OPENAI_API_KEY: The API key for OpenAI, loaded from a .env file.
+
+    Outputs:
+    - Saves the topics and the topic of each paper in the paper database (data/papers.db), the fitted
+      topic model in 'data/topic_model' and the state of the fit in 'data/topic_model_state.json'.
+
+    Args:
+        refit (bool): Whether to refit the topic model from scratch.
+        refit_days (float): Days after which the topic model is refit.
+        drift_threshold (float): Drop in the mean topic similarity of new papers, compared to the papers
+                                 of the last fit, above which the topic model is refit.
+
+    Returns:
+    - None
+    """
+    from embedding_cache import CachedEmbeddings
+    from embedding_models import create_embeddings
+
+    # Load environment variables from .env file
+    dotenv.load_dotenv()
+
+    # The abstracts are embedded with the model of the vector database, see embedding_artifacts.py.
+    embedding_model = CachedEmbeddings(create_embeddings())
+    state = load_state()
+
+    if (
+        refit
+        or state is None
+        or state.get("embedding_model") != embedding_model.cache.model_name
+        or time.time() - state["fitted_at"] > refit_days * 86400
+    ):
+        fit_topic_model(get_papers(), embedding_model)
+    else:
+        new_papers = get_papers(without_topic=True)
+        if not new_papers:
+            print("No new papers to assign topics to")
+        elif not assign_topics(new_papers, embedding_model, state, drift_threshold):
+            print("Topics drifted, refitting the topic model")
+            fit_topic_model(get_papers(), embedding_model)
 
     print("Topics data saved!")
+    print(f"Embedding cache: {embedding_model.cache.stats()}")
 
     return None
 
 
 if __name__ == "__main__":
-    topic_modeling()
+    parser = argparse.ArgumentParser(description="Update the topics of the papers.")
+    parser.add_argument(
+        "--refit", action="store_true", help="refit the topic model from scratch"
+    )
+    topic_modeling(refit=parser.parse_args().refit)
+    print_report()
+    save_report()
@@ -0,0 +1,355 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from embedding_models import index_suffix
+
+# The vector store backend and its search parameters can be set in .env:
+# VECTOR_STORE is 'chroma' (default) or 'faiss'. For FAISS, FAISS_INDEX is 'flat' (exact), 'hnsw' or 'ivf',
+# FAISS_QUANTIZATION is 'none', 'fp16' or 'int8', and FAISS_EF_SEARCH / FAISS_NPROBE trade recall for speed.
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+# Every embedding model but OpenAI's gets its own stores, see embedding_models.py.
+PERSIST_DIRECTORIES = {
+    "chroma": f"data/vectordb{index_suffix()}",
+    "faiss": f"data/faiss{index_suffix()}",
+}
+
+
+def get_vectorstore(embeddings, backend: str = None) -> VectorStore:
+    """Opens the persisted vector store selected by the VECTOR_STORE setting.
+
+    Args:
+        embeddings (Embeddings): The embeddings used to embed the stored chunks and the queries.
+        backend (str, optional): 'chroma' or 'faiss', overriding the VECTOR_STORE setting.
+
+    Returns:
+        VectorStore: The vector store.
+    """
+    backend = backend or VECTOR_STORE
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+
+        return Chroma(
+            persist_directory=PERSIST_DIRECTORIES["chroma"],
+            embedding_function=embeddings,
+        )
+    if backend == "faiss":
+        return FaissStore(
+            PERSIST_DIRECTORIES["faiss"],
+            embeddings,
+            index_type=os.getenv("FAISS_INDEX", "hnsw"),
+            quantization=os.getenv("FAISS_QUANTIZATION", "none"),
+            ef_search=int(os.getenv("FAISS_EF_SEARCH", 64)),
+            nprobe=int(os.getenv("FAISS_NPROBE", 8)),
+        )
+    raise ValueError(f"Unknown vector store: {backend}")
+
+
+def vectorstore_exists(backend: str = None) -> bool:
+    """Returns whether the selected vector store has been persisted."""
+    return os.path.isdir(PERSIST_DIRECTORIES[backend or VECTOR_STORE])
+
+
+def build_index(
+    vectors: np.ndarray,
+    index_type: str = "hnsw",
+    quantization: str = "none",
+    hnsw_m: int = 32,
+    nlist: int = 256,
+):
+    """Builds a FAISS inner-product index over unit-length vectors.
+
+    Args:
+        vectors (np.ndarray): float32 array of shape (n, dim).
+        index_type (str): 'flat' for exact search, 'hnsw' for a graph index or 'ivf' for an inverted file index.
+        quantization (str): 'none' to store float32 vectors, or 'fp16' / 'int8' scalar quantization.
+        hnsw_m (int): Number of graph neighbors per vector of the HNSW index.
+        nlist (int): Number of clusters of the IVF index, capped at the square root of the number of vectors.
+
+    Returns:
+        faiss.Index: The trained index holding all vectors.
+    """
+    import faiss
+
+    dim = vectors.shape[1]
+    metric = faiss.METRIC_INNER_PRODUCT
+    qtype = {
+        "none": None,
+        "fp16": faiss.ScalarQuantizer.QT_fp16,
+        "int8": faiss.ScalarQuantizer.QT_8bit,
+    }[quantization]
+
+    if index_type == "flat":
+        index = (
+            faiss.IndexFlatIP(dim)
+            if qtype is None
+            else faiss.IndexScalarQuantizer(dim, qtype, metric)
+        )
+    elif index_type == "hnsw":
+        index = (
+            faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+            if qtype is None
+            else faiss.IndexHNSWSQ(dim, qtype, hnsw_m, metric)
+        )
+    elif index_type == "ivf":
+        nlist = max(1, min(nlist, int(np.sqrt(len(vectors)))))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = (
+            faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+            if qtype is None
+            else faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, metric)
+        )
+        # Keep a reference so the coarse quantizer is not garbage collected before the index.
+        index.quantizer_ref = quantizer
+    else:
+        raise ValueError(f"Unknown FAISS index type: {index_type}")
+
+    if len(vectors) and not index.is_trained:
+        index.train(vectors)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+
+def set_search_params(index, ef_search: int = 64, nprobe: int = 8):
+    """Sets the recall/speed trade-off of an HNSW (efSearch) or IVF (nprobe) index."""
+    import faiss
+
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+
+
+def normalize(vectors) -> np.ndarray:
+    """Scales vectors to unit length so that inner product search ranks by cosine similarity."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def current_store_path(directory: str) -> str:
+    """Returns the directory of the current version of a persisted FAISS store, see `FaissStore.persist`."""
+    current_path = os.path.join(directory, "CURRENT")
+    if not os.path.exists(current_path):
+        # Stores persisted before they were versioned keep their files in the directory itself.
+        return directory
+    with open(current_path, "r") as file:
+        return os.path.join(directory, file.read().strip())
+
+
+class FaissStore(VectorStore):
+    """Vector store backed by a local FAISS index, persisted as memory-mapped files.
+
+    Every `persist()` writes a new version of the store to its own subdirectory `<directory>/<version>`,
+    holding the unit-length float32 vectors (`vectors.npy`), the chunk texts and metadata
+    (`docstore.json`) and the built index (`index.faiss`), and the `CURRENT` file names the version
+    readers load. Adding or deleting chunks marks the index stale, and it is rebuilt from the stored
+    vectors on `persist()` or on the next search. This suits a corpus that is refreshed in one batch per day.
+
+    Args:
+        directory (str): Directory the store is persisted in.
+        embeddings (Embeddings): The embeddings used to embed the stored chunks and the queries.
+        index_type (str): 'flat', 'hnsw' or 'ivf', see `build_index`.
+        quantization (str): 'none', 'fp16' or 'int8', see `build_index`.
+        ef_search (int): Size of the HNSW candidate list searched per query.
+        nprobe (int): Number of IVF clusters searched per query.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        embeddings,
+        index_type: str = "hnsw",
+        quantization: str = "none",
+        ef_search: int = 64,
+        nprobe: int = 8,
+    ):
+        self.directory = directory
+        self._embeddings = embeddings
+        self.index_type = index_type
+        self.quantization = quantization
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+
+        self.ids, self.texts, self.metadatas = [], [], []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self._index = None
+
+        path = current_store_path(directory)
+        docstore_path = os.path.join(path, "docstore.json")
+        if os.path.exists(docstore_path):
+            with open(docstore_path, "r") as file:
+                docstore = json.load(file)
+            self.ids = docstore["ids"]
+            self.texts = docstore["texts"]
+            self.metadatas = docstore["metadatas"]
+            self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            self._index = self._read_index(path, docstore)
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def _read_index(self, path: str, docstore: dict):
+        """Memory-maps the persisted index if it was built with the current index settings."""
+        import faiss
+
+        index_path = os.path.join(path, "index.faiss")
+        if docstore.get("index") != [self.index_type, self.quantization]:
+            return None
+        if not os.path.exists(index_path):
+            return None
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            # Not every index type supports memory mapping.
+            index = faiss.read_index(index_path)
+        set_search_params(index, self.ef_search, self.nprobe)
+        return index
+
+    def _get_index(self):
+        if self._index is None and len(self.ids):
+            self._index = build_index(self.vectors, self.index_type, self.quantization)
+            set_search_params(self._index, self.ef_search, self.nprobe)
+        return self._index
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> list:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{}] * len(texts)
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+
+        # Adding an existing id replaces the chunk.
+        existing = set(self.ids)
+        self.delete([id for id in ids if id in existing])
+
+        vectors = normalize(self._embeddings.embed_documents(texts))
+        self.vectors = (
+            np.concatenate([self.vectors, vectors]) if len(self.ids) else vectors
+        )
+        self.ids.extend(ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        self._index = None
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return True
+        remove = set(ids)
+        keep = [i for i, id in enumerate(self.ids) if id not in remove]
+        if len(keep) == len(self.ids):
+            return True
+
+        self.vectors = np.asarray(self.vectors[keep])
+        self.ids = [self.ids[i] for i in keep]
+        self.texts = [self.texts[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._index = None
+        return True
+
+    def get(self, include=None, **kwargs) -> dict:
+        """Returns every stored chunk in the same layout as `Chroma.get`."""
+        return {"ids": self.ids, "documents": self.texts, "metadatas": self.metadatas}
+
+    def persist(self, keep: int = 2):
+        """Rebuilds the index if needed and writes the store as a new version, then makes it the current one.
+
+        Args:
+            keep (int): Number of versions kept, including the new one.
+        """
+        import faiss
+
+        index = self._get_index()
+
+        # Write the new version under a temporary name, then publish it and point readers at it, so they
+        # always load a vectors, index and docstore of the same version.
+        version = uuid.uuid4().hex[:16]
+        path = os.path.join(self.directory, version)
+        temporary_path = path + ".tmp"
+        os.makedirs(temporary_path)
+        np.save(
+            os.path.join(temporary_path, "vectors.npy"),
+            np.asarray(self.vectors, dtype=np.float32),
+        )
+        if index is not None:
+            faiss.write_index(index, os.path.join(temporary_path, "index.faiss"))
+        with open(os.path.join(temporary_path, "docstore.json"), "w") as file:
+            json.dump(
+                {
+                    "index": [self.index_type, self.quantization],
+                    "ids": self.ids,
+                    "texts": self.texts,
+                    "metadatas": self.metadatas,
+                },
+                file,
+            )
+        os.replace(temporary_path, path)
+        current_path = os.path.join(self.directory, "CURRENT")
+        with open(current_path + ".tmp", "w") as file:
+            file.write(version)
+        os.replace(current_path + ".tmp", current_path)
+
+        # Remove old versions, and the files of a store persisted before versioning; readers holding an
+        # older version keep their memory maps until they reload.
+        for name in ("vectors.npy", "index.faiss", "docstore.json"):
+            if os.path.exists(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
+        versions = sorted(
+            (
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.is_dir() and not entry.name.endswith(".tmp")
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+        for entry in versions[keep:]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4) -> list:
+        index = self._get_index()
+        if index is None:
+            return []
+        scores, rows = index.search(normalize(embedding), min(k, len(self.ids)))
+        return [
+            (
+                Document(page_content=self.texts[row], metadata=self.metadatas[row]),
+                float(score),
+            )
+            for score, row in zip(scores[0], rows[0])
+            if row >= 0
+        ]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        return [
+            doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_with_score_by_vector(
+            self._embeddings.embed_query(query), k
+        )
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_by_vector(self._embeddings.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities of unit-length vectors.
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls, texts, embedding, metadatas=None, ids=None, directory=None, **kwargs
+    ):
+        store = cls(directory or PERSIST_DIRECTORIES["faiss"], embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store